@@ -0,0 +1,241 @@
+import json
+import platform
+import random
+import time
+import tracemalloc
+import numpy as np
+import multi_agents
+from game_state import GameState
+from bitboard import BitboardGameState
+
+# the latency percentiles reported for every benchmark
+PERCENTILES = (50, 90, 99)
+
+SIZES = tuple(range(3, 10))
+DEPTHS = (1, 2, 3)
+AGENTS = ("MinmaxAgent", "AlphaBetaAgent", "ExpectimaxAgent")
+HEURISTICS = ("score_evaluation_function", "opponent_score_function",
+              "good_minus_bad_evaluation_function", "min_score_evaluation_function",
+              "block_evaluation_function", "combined_heuristic")
+STATE_CLASSES = (GameState, BitboardGameState)
+
+# a benchmark is a regression when it got this much slower than its baseline
+REGRESSION_THRESHOLD = 0.1
+
+
+def random_position(board_size, filled, seed, state_class=GameState):
+    """
+    a position of a game of random moves, the same one for the same arguments
+    :param board_size:
+    :param filled: how many cells have a letter
+    :param seed:
+    :param state_class: GameState or bitboard.BitboardGameState
+    :return:
+    """
+    rnd = random.Random(seed)
+    state = state_class(board_size)
+    player = 0
+    for _ in range(filled):
+        actions = state.get_legal_actions()
+        if state.apply_action(actions[rnd.randrange(len(actions))], player) == 0:
+            player = 1 - player
+    return state
+
+
+def bench_agent(agent_spec, board_size=6, positions=10, filled=8, seed=0,
+                state_class=GameState):
+    """
+    times get_action of a new agent on random positions
+    :param agent_spec: a tournament.AgentSpec
+    :param board_size:
+    :param positions: how many positions to time
+    :param filled: how many cells of each position have a letter
+    :param seed:
+    :param state_class: GameState or bitboard.BitboardGameState
+    :return: a dict with the seconds every get_action took and their mean and percentiles
+    """
+    times = []
+    for i in range(positions):
+        state = random_position(board_size, filled, seed + i, state_class)
+        agent = agent_spec.build()
+        random.seed(seed + i)
+        start = time.perf_counter()
+        agent.get_action(state)
+        times.append(time.perf_counter() - start)
+    result = {"agent": agent_spec.name, "board_size": board_size, "positions": positions,
+              "filled": filled, "seed": seed, "times": times, "mean": float(np.mean(times))}
+    for percentile in PERCENTILES:
+        result[f"p{percentile}"] = float(np.percentile(times, percentile))
+    return result
+
+
+def _time_operation(operation, min_time):
+    """
+    runs operation more and more times until it runs for at least min_time seconds
+    :return: the seconds one run took
+    """
+    runs = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(runs):
+            operation()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return elapsed / runs
+        runs *= 2
+
+
+def state_benchmarks(sizes=SIZES, seed=0, min_time=0.1):
+    """
+    times the operations of the game states on a half full position of every size
+    :return: a list of results
+    """
+    results = []
+    for state_class in STATE_CLASSES:
+        for size in sizes:
+            state = random_position(size, size ** 2 // 2, seed, state_class)
+            action = state.get_legal_actions()[0]
+            filled = [(row, col) for row in range(size) for col in range(size)
+                      if state.board[row, col]]
+            row, col = filled[0]
+
+            def apply_and_undo():
+                state.apply_action(action, 0)
+                state.undo_action()
+
+            operations = {"get_legal_actions": state.get_legal_actions,
+                          "generate_successor": lambda: state.generate_successor(action, 0),
+                          "score_update": lambda: state.score_update(row, col, 0),
+                          "apply_undo": apply_and_undo}
+            for name, operation in operations.items():
+                seconds = _time_operation(operation, min_time)
+                results.append({"name": f"state/{state_class.__name__}/{name}/{size}",
+                                "time": seconds, "per_sec": 1 / seconds})
+    return results
+
+
+def heuristic_benchmarks(sizes=SIZES, seed=0, min_time=0.1):
+    """
+    times every heuristic of multi_agents on a half full position of every size
+    :return: a list of results
+    """
+    results = []
+    for state_class in STATE_CLASSES:
+        for size in sizes:
+            state = random_position(size, size ** 2 // 2, seed, state_class)
+            for heuristic in HEURISTICS:
+                evaluation_function = getattr(multi_agents, heuristic)
+                seconds = _time_operation(lambda: evaluation_function(state), min_time)
+                results.append({"name": f"heuristic/{state_class.__name__}/{heuristic}/{size}",
+                                "time": seconds, "per_sec": 1 / seconds})
+    return results
+
+
+def agent_benchmarks(agents=AGENTS, heuristic="good_minus_bad_evaluation_function",
+                     sizes=SIZES, depths=DEPTHS, seed=0, positions=3, max_move_time=10.0,
+                     memory=True):
+    """
+    times get_action of every agent at every depth on half full positions of every size.
+    once an agent takes more than max_move_time per move, the bigger boards and the
+    deeper searches of that agent are skipped
+    :param agents: names of agent classes of multi_agents
+    :param heuristic: the name of the evaluation function of the agents
+    :param sizes:
+    :param depths:
+    :param seed:
+    :param positions: positions per board size
+    :param max_move_time: seconds
+    :param memory: whether to measure the peak memory of a move too, which searches the
+    first position once more with tracemalloc on
+    :return: a list of results, with the mean time per move, nodes searched per second (see
+    search_stats.SearchStats.nodes) and peak memory in bytes
+    """
+    evaluation_function = getattr(multi_agents, heuristic)
+    results = []
+    for agent_name in agents:
+        agent_class = getattr(multi_agents, agent_name)
+        # the smallest board size that was too slow at a lower depth
+        too_slow = None
+        for depth in depths:
+            for size in sizes:
+                name = f"agent/{agent_name}:{heuristic}:{depth}/{size}"
+                if too_slow is not None and size >= too_slow:
+                    results.append({"name": name, "skipped": True})
+                    continue
+                times, nodes = [], 0
+                for i in range(positions):
+                    state = random_position(size, size ** 2 // 2, seed + i)
+                    agent = agent_class(evaluation_function, depth)
+                    random.seed(seed + i)
+                    start = time.perf_counter()
+                    agent.get_action(state)
+                    times.append(time.perf_counter() - start)
+                    # the nodes are counted by searching the position once more, untimed, so
+                    # counting them does not slow down the timed search
+                    agent = agent_class(evaluation_function, depth, collect_stats=True)
+                    random.seed(seed + i)
+                    agent.get_action(state)
+                    nodes += agent.stats.nodes
+                result = {"name": name, "time": float(np.mean(times)),
+                          "nodes_per_sec": nodes / sum(times) if sum(times) else None}
+                for percentile in PERCENTILES:
+                    result[f"p{percentile}"] = float(np.percentile(times, percentile))
+                if memory:
+                    state = random_position(size, size ** 2 // 2, seed)
+                    random.seed(seed)
+                    tracemalloc.start()
+                    agent_class(evaluation_function, depth).get_action(state)
+                    result["peak_memory"] = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                results.append(result)
+                if result["time"] > max_move_time:
+                    too_slow = size if too_slow is None else min(too_slow, size)
+    return results
+
+
+def run_suite(sizes=SIZES, depths=DEPTHS, agents=AGENTS, seed=0, min_time=0.1, positions=3,
+              max_move_time=10.0, memory=True):
+    """
+    runs every benchmark
+    :return: a dict with the machine the suite ran on and the list of results. every
+    result has a unique name and its time in seconds, the measure compare looks at
+    """
+    results = state_benchmarks(sizes, seed, min_time)
+    results += heuristic_benchmarks(sizes, seed, min_time)
+    results += agent_benchmarks(agents, sizes=sizes, depths=depths, seed=seed,
+                                positions=positions, max_move_time=max_move_time,
+                                memory=memory)
+    return {"machine": {"python": platform.python_version(), "numpy": np.__version__,
+                        "platform": platform.platform(), "processor": platform.processor()},
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"), "seed": seed, "results": results}
+
+
+def save_results(suite, path):
+    with open(path, "w") as file:
+        json.dump(suite, file, indent=1)
+
+
+def load_results(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def compare(suite, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    compares the times of a suite run with a saved run
+    :param suite: the result of run_suite
+    :param baseline: an older result of run_suite
+    :param threshold: how much slower a benchmark may get before it is a regression
+    :return: a list of (name, baseline time, time, ratio) of every benchmark the two runs
+    both timed, sorted by ratio, and the list of the ones that regressed
+    """
+    baseline_times = {result["name"]: result["time"] for result in baseline["results"]
+                      if result.get("time")}
+    rows = []
+    for result in suite["results"]:
+        old_time = baseline_times.get(result["name"])
+        if old_time and result.get("time"):
+            rows.append((result["name"], old_time, result["time"], result["time"] / old_time))
+    rows.sort(key=lambda row: row[3], reverse=True)
+    regressions = [row for row in rows if row[3] > 1 + threshold]
+    return rows, regressions
@@ -0,0 +1,241 @@
+import numpy as np
+from rules import S_LETTER, O_LETTER, get_sos_index
+from symmetry import get_symmetries, packed_hashes, unpack_hashes, HASH_MASK
+from threats import ThreatTable
+
+DEFAULT_SIZE = 6
+
+_masks_cache = {}
+
+
+class LineMasks:
+    """
+    the SOS triples of the sos index of a board size, as bit masks, for count_sos. a move
+    is scored from the threat table, like GameState scores it.
+    a cell (row, col) is bit row * table_size + col of a bitboard
+    """
+
+    def __init__(self, table_size):
+        index = get_sos_index(table_size)
+        self.table_size = table_size
+        self.full = (1 << table_size ** 2) - 1
+        # for every cell, the (other S, middle O) bits of the triples in which the cell is an S
+        self.s_lines = [[(1 << other, 1 << middle) for other, middle in pairs]
+                        for pairs in index.s_pairs]
+        # for every cell, the mask of both S ends of the triples in which the cell is the O
+        self.o_lines = [[(1 << first) | (1 << last) for first, last in pairs]
+                        for pairs in index.o_pairs]
+
+
+def get_line_masks(table_size):
+    """
+    returns the line masks of the given board size, building them only once per size
+    :param table_size:
+    :return:
+    """
+    masks = _masks_cache.get(table_size)
+    if masks is None:
+        masks = _masks_cache[table_size] = LineMasks(table_size)
+    return masks
+
+
+class BitboardGameState(object):
+    """
+    a game state that holds the board as two bitboards, one for the S cells and one for
+    the O cells. it has the same interface as GameState so the search agents can use it
+    """
+
+    __slots__ = ("_done", "_score", "_op_score", "_table_size", "_masks", "_s_bits", "_o_bits",
+                 "_board", "_undo_stack", "_sym_keys", "_sym_hashes", "_threats")
+
+    def __init__(self, table_size=DEFAULT_SIZE, board=None, score1=0, score2=0, done=False):
+        super(BitboardGameState, self).__init__()
+        self._done = done
+        self._score = score1
+        self._op_score = score2
+        self._table_size = table_size
+        self._masks = get_line_masks(table_size)
+        self._s_bits = 0
+        self._o_bits = 0
+        self._board = None
+        # (move, player, score delta) of every applied action, for undo_action
+        self._undo_stack = []
+        self._sym_keys = get_symmetries(table_size).keys
+        self._sym_hashes = 0
+        flat_board = None
+        if board is not None:
+            flat_board = np.asarray(board).ravel()
+            for cell, letter in enumerate(flat_board):
+                if letter == S_LETTER:
+                    self._s_bits |= 1 << cell
+                elif letter == O_LETTER:
+                    self._o_bits |= 1 << cell
+            self._sym_hashes = packed_hashes(flat_board, table_size)
+        self._threats = ThreatTable(table_size, flat_board)
+
+    @property
+    def done(self):
+        return self._done
+
+    @property
+    def score(self):
+        return self._score
+
+    @property
+    def opponent_score(self):
+        return self._op_score
+
+    @property
+    def board(self):
+        """the board as a numpy array, built only when asked for"""
+        if self._board is None:
+            cells = self._table_size ** 2
+            board = np.zeros(cells)
+            for cell in range(cells):
+                bit = 1 << cell
+                if self._s_bits & bit:
+                    board[cell] = S_LETTER
+                elif self._o_bits & bit:
+                    board[cell] = O_LETTER
+            self._board = board.reshape((self._table_size, self._table_size))
+        return self._board
+
+    @property
+    def table_size(self):
+        return self._table_size
+
+    @property
+    def num_applied(self):
+        """how many applied actions can still be taken back with undo_action"""
+        return len(self._undo_stack)
+
+    @property
+    def hash(self):
+        """the zobrist hash of the board, kept up to date by apply_action and undo_action"""
+        return self._sym_hashes & HASH_MASK
+
+    @property
+    def symmetric_hashes(self):
+        """the zobrist hashes of the board under each of the symmetries of the square"""
+        return unpack_hashes(self._sym_hashes)
+
+    @property
+    def threats(self):
+        """the open triples of the board (threats.ThreatTable), kept up to date in place"""
+        return self._threats
+
+    def is_done(self):
+        return self._s_bits | self._o_bits == self._masks.full
+
+    def isInRange(self, loc: tuple):
+        return 0 <= loc[0] < self._table_size and 0 <= loc[1] < self._table_size
+
+    def get_legal_actions(self):
+        """
+        makes a list of legal actions and returns it, in the same order as GameState does
+        (all the S actions and then all the O actions, row by row)
+        :return:
+        """
+        cells = self._table_size ** 2
+        empty = ~(self._s_bits | self._o_bits) & self._masks.full
+        locations = []
+        while empty:
+            low = empty & -empty
+            locations.append(low.bit_length() - 1)
+            empty ^= low
+        return [S_LETTER * cells + cell for cell in locations] + \
+               [O_LETTER * cells + cell for cell in locations]
+
+    def moves(self, order="board"):
+        """
+        generates the legal moves lazily, in the given order (see threats.ThreatTable.moves)
+        :param order:
+        :return:
+        """
+        return self._threats.moves(order)
+
+    def generate_successor(self, action, player):
+        """
+        generates a new state given an action and a player
+        :param action:
+        :param player:
+        :return:
+        """
+        # copying six fields is all it takes, so __init__ is skipped on this hot path
+        successor = BitboardGameState.__new__(BitboardGameState)
+        successor._done = self._done
+        successor._score = self._score
+        successor._op_score = self._op_score
+        successor._table_size = self._table_size
+        successor._masks = self._masks
+        successor._s_bits = self._s_bits
+        successor._o_bits = self._o_bits
+        successor._board = None
+        successor._undo_stack = []
+        successor._sym_keys = self._sym_keys
+        successor._sym_hashes = self._sym_hashes
+        successor._threats = self._threats.copy()
+        successor.apply_action(action, player)
+        return successor
+
+    def apply_action(self, action, player):
+        """
+        applies action to the state in place, it can be taken back with undo_action
+        :param action: a move made by rules.encode_move
+        :param player:
+        :return: the number of sos's the action completed
+        """
+        letter, cell = divmod(action, self._table_size * self._table_size)
+        bit = 1 << cell
+        self._sym_hashes ^= self._sym_keys[letter][cell]
+        if letter == S_LETTER:
+            self._s_bits |= bit
+        else:
+            self._o_bits |= bit
+        self._board = None
+        delta = self._threats.gains[letter][cell]
+        self._threats.place(cell, letter)
+        if player == 0:
+            self._score += delta
+        else:
+            self._op_score += delta
+        self._undo_stack.append((action, player, delta))
+        return delta
+
+    def undo_action(self):
+        """
+        takes back the last action applied on the state
+        :return: the action that was taken back
+        """
+        action, player, delta = self._undo_stack.pop()
+        letter, cell = divmod(action, self._table_size * self._table_size)
+        bit = 1 << cell
+        self._sym_hashes ^= self._sym_keys[letter][cell]
+        self._s_bits &= ~bit
+        self._o_bits &= ~bit
+        self._board = None
+        self._threats.remove(cell)
+        if player == 0:
+            self._score -= delta
+        else:
+            self._op_score -= delta
+        return action
+
+    def count_sos(self, i, j):
+        """counts the sos's that go through the cell (i, j)"""
+        cell = int(i) * self._table_size + int(j)
+        s_bits, o_bits = self._s_bits, self._o_bits
+        if s_bits >> cell & 1:
+            return sum(1 for other, middle in self._masks.s_lines[cell]
+                       if s_bits & other and o_bits & middle)
+        if o_bits >> cell & 1:
+            return sum(1 for ends in self._masks.o_lines[cell] if s_bits & ends == ends)
+        return 0
+
+    def score_update(self, i, j, player):
+        """updates the score according to the player"""
+        score = self.count_sos(i, j)
+        if player == 0:
+            self._score += score
+        else:
+            self._op_score += score
@@ -0,0 +1,121 @@
+from rules import S_LETTER, O_LETTER, EMPTY
+from symmetry import HASH_BITS
+from transposition import TranspositionTable, EXACT, LOWER, UPPER, VALUE, BOUND
+
+# the memory of the cache of solved positions in MB, unless the solver is given another
+DEFAULT_CACHE_MB = 32
+
+# the solved positions, a transposition.TranspositionTable shared by every solver of the
+# process. it is made on the first solve, so a process that never solves takes no memory
+_cache = None
+
+
+def empty_cells(state):
+    """the empty cells of a state, as flat indexes"""
+    return [cell for cell, letter in enumerate(state.threats.letters) if letter == EMPTY]
+
+
+def _get_cache(cache_mb):
+    """the cache of solved positions, made again if it was given another size"""
+    global _cache
+    if _cache is None or _cache.max_mb != cache_mb:
+        _cache = TranspositionTable(cache_mb)
+    return _cache
+
+
+def endgame_value(state, cache_mb=DEFAULT_CACHE_MB):
+    """
+    the exact value of a position for the player to move: the most sos's that player can
+    complete from now to the end of the game more than the other player, when both play
+    perfectly. a move that completes an sos gives its player another move, so it adds the
+    value of the next position instead of taking it away. the value does not depend on the
+    scores, only on the board, so it is cached by the canonical hash of the board and
+    mirrored or rotated boards share it
+    :param state: a GameState or BitboardGameState, it is left as it was given
+    :param cache_mb: the memory of the cache of solved positions, in MB
+    :return:
+    """
+    return _negamax(state, float("-inf"), float("inf"), _get_cache(cache_mb))
+
+
+def solve_endgame(state, cache_mb=DEFAULT_CACHE_MB):
+    """
+    finds a perfect move of the player to move
+    :param state:
+    :param cache_mb: the memory of the cache of solved positions, in MB
+    :return: the value of the position (see endgame_value) and a move (see
+    rules.encode_move) that gets it, or None if the board is full
+    """
+    cache = _get_cache(cache_mb)
+    best, best_move = float("-inf"), None
+    for move in _ordered_moves(state):
+        value = _child_value(state, move, best, float("inf"), cache)
+        if value > best:
+            best, best_move = value, move
+    if best_move is None:
+        return 0, None
+    return best, best_move
+
+
+def _ordered_moves(state):
+    """the moves of a state, the ones that complete more sos's first"""
+    cells = state.table_size ** 2
+    gains = state.threats.gains
+    moves = [(gains[letter][cell], letter * cells + cell)
+             for cell in empty_cells(state) for letter in (S_LETTER, O_LETTER)]
+    moves.sort(key=lambda x: x[0], reverse=True)
+    return [move for _, move in moves]
+
+
+def _child_value(state, move, alpha, beta, cache):
+    """the value of a move for the player making it, searched within (alpha, beta)"""
+    gained = state.apply_action(move, 0)
+    if gained:
+        value = gained + _negamax(state, alpha - gained, beta - gained, cache)
+    else:
+        value = -_negamax(state, -beta, -alpha, cache)
+    state.undo_action()
+    return value
+
+
+def _negamax(state, alpha, beta, cache):
+    """
+    alpha-beta search of the value of a position. a value outside (alpha, beta) is only a
+    bound of the exact value, and it is cached as one, with the empty cells as the depth
+    it was searched to, so the table keeps the positions that took the most to solve
+    """
+    # the board size is part of the key since the same cells hash alike on every size
+    key = (state.table_size << HASH_BITS) | min(state.symmetric_hashes)
+    entry = cache.lookup(key)
+    if entry is not None:
+        value, bound = entry[VALUE], entry[BOUND]
+        if bound == EXACT or (bound == LOWER and value >= beta) or \
+                (bound == UPPER and value <= alpha):
+            return value
+    moves = _ordered_moves(state)
+    if not moves:
+        return 0
+    original_alpha = alpha
+    best = float("-inf")
+    for move in moves:
+        value = _child_value(state, move, alpha, beta, cache)
+        if value > best:
+            best = value
+            if best > alpha:
+                alpha = best
+                if alpha >= beta:
+                    break
+    if best <= original_alpha:
+        bound = UPPER
+    elif best >= beta:
+        bound = LOWER
+    else:
+        bound = EXACT
+    cache.store(key, state.threats.empty, best, bound, None)
+    return best
+
+
+def clear_cache():
+    """forgets every solved position"""
+    if _cache is not None:
+        _cache.clear()
@@ -1,9 +1,6 @@
 import abc
 from board import *
-
-S_LETTER = 1
-O_LETTER = 2
-EMPTY = 0
+from rules import *
 
 
 class Agent(object):
@@ -16,8 +13,24 @@ class Agent(object):
 
     @abc.abstractmethod
     def get_action(self, game_state):
+        """
+        :param game_state: the position as the agent sees it: score is the agent's points
+        and opponent_score the opponent's, whichever player the agent is, and the agent
+        moves as player 0 in it
+        :return: the move to play (see rules.encode_move)
+        """
         return
 
+    def ponder(self, game_state):
+        """
+        called after the agent's turn ended, with the position the opponent is to move in,
+        so the agent can think on the opponent's time. an agent that ponders should stop
+        in stop_running
+        :param game_state:
+        :return:
+        """
+        pass
+
     def stop_running(self):
         pass
 
@@ -31,6 +44,7 @@ class Game:
         self.player = 0
         self.score = [0, 0]
         self.board = Board(table_size)
+        self.sos_index = get_sos_index(table_size)
 
     def choose_tile(self, letter, row, col):
         """
@@ -60,93 +74,16 @@ class Game:
         if old_score == self.score:
             self.player = 1 - self.player
 
-    def sos_in_row(self, i, j):
+    def sos_lines(self, i, j):
         """
-        check how many sos's in row
+        finds the sos's that go through the cell (i, j)
         :param i:
         :param j:
-        :return:
-        """
-        locations = []
-        if self.board.get_letter(i, j) == S_LETTER and self.board.get_letter(i,
-                                                                             j + 1) == O_LETTER \
-                and self.board.get_letter(i, j + 2) == S_LETTER:
-            locations.append([i, j])
-        if self.board.get_letter(i, j - 1) == S_LETTER and self.board.get_letter(i,
-                                                                                 j) == O_LETTER \
-                and self.board.get_letter(i, j + 1) == S_LETTER:
-            locations.append([i, j - 1])
-        if self.board.get_letter(i, j - 2) == S_LETTER and self.board.get_letter(i,
-                                                                                 j - 1) == O_LETTER \
-                and self.board.get_letter(i, j) == S_LETTER:
-            locations.append([i, j - 2])
-        return locations
-
-    def sos_in_col(self, i, j):
-        """
-        check how many sos's in column
-        :param i:
-        :param j:
-        :return:
-        """
-        locations = []
-        if self.board.get_letter(i, j) == S_LETTER and self.board.get_letter(i + 1,
-                                                                             j) == O_LETTER \
-                and self.board.get_letter(i + 2, j) == S_LETTER:
-            locations.append([i, j])
-        if self.board.get_letter(i - 1, j) == S_LETTER and self.board.get_letter(i,
-                                                                                 j) == O_LETTER \
-                and self.board.get_letter(i + 1, j) == S_LETTER:
-            locations.append([i - 1, j])
-        if self.board.get_letter(i - 2, j) == S_LETTER and self.board.get_letter(i - 1,
-                                                                                 j) == O_LETTER \
-                and self.board.get_letter(i, j) == S_LETTER:
-            locations.append([i - 2, j])
-        return locations
-
-    def sos_in_diag(self, i, j):
-        """
-        check how many sos's in diagonal
-        :param i:
-        :param j:
-        :return:
+        :return: list of (direction, (row, col)) with the cell every sos starts from
         """
-        locations = []
-        if self.board.get_letter(i, j) == S_LETTER and self.board.get_letter(i + 1,
-                                                                             j + 1) == O_LETTER \
-                and self.board.get_letter(i + 2, j + 2) == S_LETTER:
-            locations.append([i, j])
-        if self.board.get_letter(i - 1, j - 1) == S_LETTER and self.board.get_letter(i,
-                                                                                     j) == O_LETTER \
-                and self.board.get_letter(i + 1, j + 1) == S_LETTER:
-            locations.append([i - 1, j - 1])
-        if self.board.get_letter(i - 2, j - 2) == S_LETTER and self.board.get_letter(
-                i - 1, j - 1) == O_LETTER \
-                and self.board.get_letter(i, j) == S_LETTER:
-            locations.append([i - 2, j - 2])
-        return locations
-
-    def sos_in_diag2(self, i, j):
-        """
-       check how many sos's in other diagonal
-       :param i:
-       :param j:
-       :return:
-       """
-        locations = []
-        if self.board.get_letter(i, j) == S_LETTER and self.board.get_letter(i + 1,
-                                                                             j - 1) == O_LETTER \
-                and self.board.get_letter(i + 2, j - 2) == S_LETTER:
-            locations.append([i, j])
-        if self.board.get_letter(i - 1, j + 1) == S_LETTER and self.board.get_letter(i,
-                                                                                     j) == O_LETTER \
-                and self.board.get_letter(i + 1, j - 1) == S_LETTER:
-            locations.append([i - 1, j + 1])
-        if self.board.get_letter(i - 2, j + 2) == S_LETTER and self.board.get_letter(
-                i - 1, j + 1) == O_LETTER \
-                and self.board.get_letter(i, j) == S_LETTER:
-            locations.append([i - 2, j + 2])
-        return locations
+        size = self.board.table_size
+        lines = completed_sos(self.board.board.reshape(-1), i * size + j, self.sos_index)
+        return [(direction, divmod(first, size)) for direction, first in lines]
 
     def update_scores(self, i, j):
         """
@@ -156,20 +93,8 @@ class Game:
         :return:
         """
         # i is for column , j is for row
-        score = 0
-        rows = self.sos_in_row(i, j)
-        if rows:
-            score += len(rows)
-        cols = self.sos_in_col(i, j)
-        if cols:
-            score += len(cols)
-        diag1 = self.sos_in_diag(i, j)
-        if diag1:
-            score += len(diag1)
-        diag2 = self.sos_in_diag2(i, j)
-        if diag2:
-            score += len(diag2)
-        self.score[self.player] += score
+        cell = i * self.board.table_size + j
+        self.score[self.player] += count_sos(self.board.board.reshape(-1), cell, self.sos_index)
 
     def get_winner(self):
         """
@@ -197,10 +122,11 @@ class Game:
     def make_turn(self, action):
         """
         runs one full turn with all that is required
-        :param action: [letter, row ,col]
+        :param action: a move made by rules.encode_move
         :return:
         """
-        self.choose_tile(action[0], action[1], action[2])
+        letter, row, col = decode_move(action, self.board.table_size)
+        self.choose_tile(letter, row, col)
         old_score = self.score[:]
-        self.update_scores(action[1], action[2])
+        self.update_scores(row, col)
         self.switch_turn(old_score)
@@ -1,4 +1,7 @@
-from sos import *
+import numpy as np
+from rules import EMPTY, count_sos, get_sos_index
+from symmetry import get_symmetries, packed_hashes, unpack_hashes, HASH_MASK
+from threats import ThreatTable
 
 DEFAULT_SIZE = 6
 
@@ -17,6 +20,14 @@ class GameState(object):
         if board is None:
             board = np.zeros((self._table_size, self._table_size))
         self._board = board
+        # a flat view of the board for the sos index, it shares memory with the board
+        self._flat_board = board.reshape(-1)
+        self._sos_index = get_sos_index(table_size)
+        self._sym_keys = get_symmetries(table_size).keys
+        self._sym_hashes = packed_hashes(self._flat_board, table_size)
+        self._threats = ThreatTable(table_size, self._flat_board)
+        # (move, player, score delta) of every applied action, for undo_action
+        self._undo_stack = []
 
     @property
     def done(self):
@@ -34,23 +45,51 @@ class GameState(object):
     def board(self):
         return self._board
 
+    @property
+    def table_size(self):
+        return self._table_size
+
+    @property
+    def num_applied(self):
+        """how many applied actions can still be taken back with undo_action"""
+        return len(self._undo_stack)
+
+    @property
+    def hash(self):
+        """the zobrist hash of the board, kept up to date by apply_action and undo_action"""
+        return self._sym_hashes & HASH_MASK
+
+    @property
+    def symmetric_hashes(self):
+        """the zobrist hashes of the board under each of the symmetries of the square"""
+        return unpack_hashes(self._sym_hashes)
+
+    @property
+    def threats(self):
+        """the open triples of the board (threats.ThreatTable), kept up to date in place"""
+        return self._threats
+
     def is_done(self):
-        return np.count_nonzero(self._board) == self._table_size ** 2
+        return self._threats.empty == 0
 
     def isInRange(self, loc: tuple):
         return 0 <= loc[0] < self._table_size and 0 <= loc[1] < self._table_size
 
     def get_legal_actions(self):
         """
-        makes a list of legal actions and returns it
+        makes a list of legal actions and returns it, every S move and then every O move,
+        row by row. a move is an int (see rules.encode_move)
         :return:
         """
-        locations = np.array(np.where(self._board == 0)).T
-        s_letter = np.ones(len(locations))
-        o_letter = np.ones(len(locations)) + 1
-        good_s = np.array([s_letter, locations.T[0], locations.T[1]], dtype=np.int).T
-        good_o = np.array([o_letter, locations.T[0], locations.T[1]], dtype=np.int).T
-        return np.concatenate((good_s, good_o))
+        return list(self._threats.moves())
+
+    def moves(self, order="board"):
+        """
+        generates the legal moves lazily, in the given order (see threats.ThreatTable.moves)
+        :param order:
+        :return:
+        """
+        return self._threats.moves(order)
 
     def generate_successor(self, action, player):
         """
@@ -59,106 +98,62 @@ class GameState(object):
         :param player:
         :return:
         """
-        successor = GameState(self._table_size, self._board.copy(),
-                              self._score, self._op_score, self._done)
+        # the threat table and the symmetric hashes are copied rather than built again from
+        # the board, like BitboardGameState.generate_successor does
+        successor = GameState.__new__(GameState)
+        successor._done = self._done
+        successor._score = self._score
+        successor._op_score = self._op_score
+        successor._table_size = self._table_size
+        successor._board = self._board.copy()
+        successor._flat_board = successor._board.reshape(-1)
+        successor._sos_index = self._sos_index
+        successor._sym_keys = self._sym_keys
+        successor._sym_hashes = self._sym_hashes
+        successor._threats = self._threats.copy()
+        successor._undo_stack = []
         successor.apply_action(action, player)
         return successor
 
     def apply_action(self, action, player):
         """
-        applies action to the state
-        :param action:
+        applies action to the state in place, it can be taken back with undo_action
+        :param action: a move made by rules.encode_move
         :param player:
-        :return:
+        :return: the number of sos's the action completed
         """
-        self._board[action[1], action[2]] = action[0]
-        self.score_update(action[1], action[2], player)
-
-    def _sos_in_row(self, i, j):
-        """check if sos in row"""
-        locations = []
-        if self.isInRange((i, j + 2)):
-            if self._board[i, j] == S_LETTER and self._board[i, j + 1] == O_LETTER \
-                    and self._board[i, j + 2] == S_LETTER:
-                locations.append([i, j])
-        if self.isInRange((j - 1, j + 1)):
-            if self._board[i, j - 1] == S_LETTER and self._board[i, j] == O_LETTER \
-                    and self._board[i, j + 1] == S_LETTER:
-                locations.append([i, j - 1])
-        if self.isInRange((i, j - 1)):
-            if self._board[i, j - 2] == S_LETTER and self._board[i, j - 1] == O_LETTER \
-                    and self._board[i, j] == S_LETTER:
-                locations.append([i, j - 2])
-        return locations
-
-    def _sos_in_col(self, i, j):
-        """checks if sos in column"""
-        locations = []
-        if self.isInRange((j, i + 2)):
-            if self._board[i, j] == S_LETTER and self._board[i + 1, j] == O_LETTER \
-                    and self._board[i + 2, j] == S_LETTER:
-                locations.append([i, j])
-        if self.isInRange((i + 1, i - 1)):
-            if self._board[i - 1, j] == S_LETTER and self._board[i, j] == O_LETTER \
-                    and self._board[i + 1, j] == S_LETTER:
-                locations.append([i - 1, j])
-        if self.isInRange((i - 2, j)):
-            if self._board[i - 2, j] == S_LETTER and self._board[i - 1, j] == O_LETTER \
-                    and self._board[i, j] == S_LETTER:
-                locations.append([i - 2, j])
-        return locations
-
-    def _sos_in_diag(self, i, j):
-        """checks if sos in diagonal"""
-        locations = []
-        if self.isInRange((i + 2, j + 2)):
-            if self._board[i, j] == S_LETTER and self._board[i + 1, j + 1] == O_LETTER \
-                    and self._board[i + 2, j + 2] == S_LETTER:
-                locations.append([i, j])
-        if self.isInRange((i + 1, j + 1)) and self.isInRange((i - 1, j - 1)):
-            if self._board[i - 1, j - 1] == S_LETTER and self._board[i, j] == O_LETTER \
-                    and self._board[i + 1, j + 1] == S_LETTER:
-                locations.append([i - 1, j - 1])
-        if self.isInRange((i - 2, j - 2)):
-            if self._board[i - 2, j - 2] == S_LETTER and self._board[
-                i - 1, j - 1] == O_LETTER \
-                    and self._board[i, j] == S_LETTER:
-                locations.append([i - 2, j - 2])
-            return locations
-
-    def _sos_in_diag2(self, i, j):
-        """check if sos in other diagonal"""
-        locations = []
-        if self.isInRange((i + 2, j - 2)):
-            if self._board[i, j] == S_LETTER and self._board[i + 1, j - 1] == O_LETTER \
-                    and self._board[i + 2, j - 2] == S_LETTER:
-                locations.append([i, j])
-        if self.isInRange((i - 1, j + 1)) and self.isInRange((i + 1, j - 1)):
-            if self._board[i - 1, j + 1] == S_LETTER and self._board[i, j] == O_LETTER \
-                    and self._board[i + 1, j - 1] == S_LETTER:
-                locations.append([i - 1, j + 1])
-        if self.isInRange((i - 2, j + 2)):
-            if self._board[i - 2, j + 2] == S_LETTER and self._board[
-                i - 1, j + 1] == O_LETTER \
-                    and self._board[i, j] == S_LETTER:
-                locations.append([i - 2, j + 2])
-        return locations
+        letter, cell = divmod(action, self._table_size * self._table_size)
+        # the threat table knows how many sos's the letter completes before it is placed
+        delta = self._threats.gains[letter][cell]
+        self._flat_board[cell] = letter
+        self._sym_hashes ^= self._sym_keys[letter][cell]
+        self._threats.place(cell, letter)
+        if player == 0:
+            self._score += delta
+        else:
+            self._op_score += delta
+        self._undo_stack.append((action, player, delta))
+        return delta
+
+    def undo_action(self):
+        """
+        takes back the last action applied on the state
+        :return: the action that was taken back
+        """
+        action, player, delta = self._undo_stack.pop()
+        letter, cell = divmod(action, self._table_size * self._table_size)
+        self._flat_board[cell] = EMPTY
+        self._sym_hashes ^= self._sym_keys[letter][cell]
+        self._threats.remove(cell)
+        if player == 0:
+            self._score -= delta
+        else:
+            self._op_score -= delta
+        return action
 
     def score_update(self, i, j, player):
         """updates the score according to the player"""
-        score = 0
-        rows = self._sos_in_row(i, j)
-        if rows:
-            score += len(rows)
-        cols = self._sos_in_col(i, j)
-        if cols:
-            score += len(cols)
-        diag1 = self._sos_in_diag(i, j)
-        if diag1:
-            score += len(diag1)
-        diag2 = self._sos_in_diag2(i, j)
-        if diag2:
-            score += len(diag2)
+        score = count_sos(self._flat_board, i * self._table_size + j, self._sos_index)
         if player == 0:
             self._score += score
         else:
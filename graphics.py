@@ -77,6 +77,10 @@ class Graphics:
                                 command=lambda: self.set_gui_agent(
                                     ExpectimaxAgent(good_minus_bad_evaluation_function, 1),
                                     "Expectimax score heuristic            ", opponent))
+            ai.menu.add_command(label="monte carlo tree search",
+                                command=lambda: self.set_gui_agent(
+                                    MCTSAgent(1000, rollout="block"),
+                                    "monte carlo tree search           ", opponent))
         else:
             ai.menu.add_command(label="random", command=lambda: self.set_gui_agent(RandomAgent(),
                                                                                    "random player", opponent))
@@ -178,25 +182,20 @@ class Graphics:
 
     def gui_update_score(self, i, j):
         """updates the score and crosses the relevant sos's"""
-        row_lines = self.game.sos_in_row(i, j)
         color = BLUE if self.game.get_player() == 0 else RED
-        for line in row_lines:
-            frame = tk.Frame(width=3, height=2 * DISTANCE, bg=color)
-            row_loc = (line[0] + 1) * DISTANCE + 30
-            col_loc = (line[1] + 1) * DISTANCE + 20
-            frame.place(x=row_loc, y=col_loc)
-        col_lines = self.game.sos_in_col(i, j)
-        for line in col_lines:
-            frame = tk.Frame(width=2 * DISTANCE, height=3, bg=color)
-            row_loc = (line[0] + 1) * DISTANCE + 40
-            col_loc = (line[1] + 1) * DISTANCE + 20
-            frame.place(x=row_loc, y=col_loc)
-        diag_lines = self.game.sos_in_diag(i, j)
-        for line in diag_lines:
-            self.draw_diag(color, line, False)
-        diag_lines2 = self.game.sos_in_diag2(i, j)
-        for line in diag_lines2:
-            self.draw_diag(color, line, True)
+        for direction, line in self.game.sos_lines(i, j):
+            if direction == ROW:
+                frame = tk.Frame(width=3, height=2 * DISTANCE, bg=color)
+                row_loc = (line[0] + 1) * DISTANCE + 30
+                col_loc = (line[1] + 1) * DISTANCE + 20
+                frame.place(x=row_loc, y=col_loc)
+            elif direction == COL:
+                frame = tk.Frame(width=2 * DISTANCE, height=3, bg=color)
+                row_loc = (line[0] + 1) * DISTANCE + 40
+                col_loc = (line[1] + 1) * DISTANCE + 20
+                frame.place(x=row_loc, y=col_loc)
+            else:
+                self.draw_diag(color, line, direction == DIAG2)
         self.game.update_scores(i, j)
         self.score_label()
 
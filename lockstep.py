@@ -0,0 +1,258 @@
+import numpy as np
+from rules import S_LETTER, O_LETTER, EMPTY, get_sos_index
+
+POLICIES = ("random", "greedy")
+
+_tables_cache = {}
+
+
+class GainTables:
+    """
+    the sos triples of a board size as arrays, to count the sos's of a move in many games
+    at once. the boards of a batch have one extra cell at the end that is always empty, so
+    padded entries point to it and never count
+    """
+
+    def __init__(self, table_size):
+        index = get_sos_index(table_size)
+        cells = table_size ** 2
+        self.cells = cells
+        pad = cells
+        width = max(len(cell_pairs) for pairs in (index.s_pairs, index.o_pairs)
+                    for cell_pairs in pairs)
+
+        def padded(pairs):
+            table = np.full((cells, width, 2), pad, dtype=np.intp)
+            for cell, cell_pairs in enumerate(pairs):
+                if cell_pairs:
+                    table[cell, :len(cell_pairs)] = cell_pairs
+            return table
+
+        # s_pairs[cell, k] is the (other end, middle) of the k-th triple the cell is an S of,
+        # o_pairs[cell, k] the (first, last) of the k-th triple the cell is the O of
+        self.s_pairs = padded(index.s_pairs)
+        self.o_pairs = padded(index.o_pairs)
+        triples = np.array(index.triples, dtype=np.intp).reshape(-1, 3)
+        self.first, self.middle, self.last = triples[:, 0], triples[:, 1], triples[:, 2]
+        # incidence matrices of the triples and the cells they start, go through and end in
+        incidence = np.zeros((3, len(triples), cells), dtype=np.float32)
+        for position in range(3):
+            incidence[position, np.arange(len(triples)), triples[:, position]] = 1
+        self.first_cells, self.middle_cells, self.last_cells = incidence
+
+
+def get_gain_tables(table_size):
+    """
+    returns the gain tables of the given board size, building them only once per size
+    :param table_size:
+    :return:
+    """
+    tables = _tables_cache.get(table_size)
+    if tables is None:
+        tables = _tables_cache[table_size] = GainTables(table_size)
+    return tables
+
+
+class BatchGames:
+    """
+    many games of one board size played in lockstep: every step makes one move in every
+    game that is not over, all with array operations. the boards are one (games, cells + 1)
+    int8 array of flat boards (see GainTables for the extra cell). scores[:, 0] is the
+    score of player 0, like GameState.score, and scores[:, 1] of player 1. a player who
+    completes an sos moves again
+    """
+
+    def __init__(self, num_games, table_size, seed=None):
+        self.table_size = table_size
+        self.tables = get_gain_tables(table_size)
+        cells = table_size ** 2
+        self.flat_boards = np.zeros((num_games, cells + 1), dtype=np.int8)
+        self.scores = np.zeros((num_games, 2), dtype=np.int32)
+        self.player = np.zeros(num_games, dtype=np.int8)
+        self.empty = np.full(num_games, cells, dtype=np.int32)
+        self.moves = 0
+        self.rng = np.random.default_rng(seed)
+        # the games that are not over
+        self.active = np.arange(num_games)
+
+    @classmethod
+    def from_state(cls, state, num_games, player=0, seed=None):
+        """
+        games that all start from the position of a state
+        :param state: a GameState or BitboardGameState
+        :param num_games:
+        :param player: the player to move
+        :param seed:
+        :return:
+        """
+        games = cls(num_games, state.table_size, seed)
+        letters = np.asarray(state.threats.letters, dtype=np.int8)
+        games.flat_boards[:, :-1] = letters
+        games.scores[:] = (state.score, state.opponent_score)
+        games.player[:] = player
+        games.empty[:] = np.count_nonzero(letters == EMPTY)
+        games.active = np.flatnonzero(games.empty)
+        return games
+
+    @property
+    def num_games(self):
+        return len(self.flat_boards)
+
+    @property
+    def boards(self):
+        """the boards as a (games, n, n) array"""
+        n = self.table_size
+        return self.flat_boards[:, :-1].reshape(-1, n, n)
+
+    @property
+    def done(self):
+        return len(self.active) == 0
+
+    def gains(self, games=None):
+        """
+        the sos's every move would complete
+        :param games: indexes of games, the active ones by default
+        :return: a (games, 2, cells) array, [:, 0] for an S and [:, 1] for an O in every cell
+        """
+        if games is None:
+            games = self.active
+        tables = self.tables
+        boards = self.flat_boards[games]
+        s_cells, o_cells = boards == S_LETTER, boards == O_LETTER
+        empty = boards == EMPTY
+        first, middle, last = tables.first, tables.middle, tables.last
+        # the triples an S at their first (or last) cell, or an O in the middle, completes
+        s_first = (empty[:, first] & o_cells[:, middle] & s_cells[:, last]).astype(np.float32)
+        s_last = (s_cells[:, first] & o_cells[:, middle] & empty[:, last]).astype(np.float32)
+        o_middle = (s_cells[:, first] & empty[:, middle] & s_cells[:, last]).astype(np.float32)
+        gains = np.empty((len(games), 2, tables.cells), dtype=np.float32)
+        gains[:, 0] = s_first @ tables.first_cells + s_last @ tables.last_cells
+        gains[:, 1] = o_middle @ tables.middle_cells
+        return gains.astype(np.int32)
+
+    def random_moves(self, games=None):
+        """
+        a random move of every game, a random letter in a random empty cell
+        :return: the cells and the letters, one of each per game
+        """
+        if games is None:
+            games = self.active
+        keys = self.rng.random((len(games), self.tables.cells))
+        keys[self.flat_boards[games, :-1] != EMPTY] = -1
+        cells = keys.argmax(axis=1)
+        letters = self.rng.integers(S_LETTER, O_LETTER + 1, len(games), dtype=np.int8)
+        return cells, letters
+
+    def greedy_moves(self, games=None):
+        """
+        a move of every game that completes the most sos's, random among the best ones
+        :return: the cells and the letters, one of each per game
+        """
+        if games is None:
+            games = self.active
+        cells = self.tables.cells
+        keys = self.gains(games) + self.rng.random((len(games), 2, cells)) * 0.5
+        keys[np.broadcast_to((self.flat_boards[games, :-1] != EMPTY)[:, np.newaxis],
+                             keys.shape)] = -1
+        best = keys.reshape(len(games), -1).argmax(axis=1)
+        return best % cells, (best // cells + S_LETTER).astype(np.int8)
+
+    def moves_of(self, policies):
+        """
+        the moves of the active games, each by the policy of the player to move
+        :param policies: a policy for each player, "random" or "greedy"
+        :return: the cells and the letters
+        """
+        games = self.active
+        if policies[0] == policies[1]:
+            return self._policy_moves(policies[0], games)
+        cells = np.empty(len(games), dtype=np.intp)
+        letters = np.empty(len(games), dtype=np.int8)
+        for player, policy in enumerate(policies):
+            mine = self.player[games] == player
+            if mine.any():
+                cells[mine], letters[mine] = self._policy_moves(policy, games[mine])
+        return cells, letters
+
+    def _policy_moves(self, policy, games):
+        if policy == "random":
+            return self.random_moves(games)
+        if policy == "greedy":
+            return self.greedy_moves(games)
+        raise ValueError(f"unknown policy {policy!r}")
+
+    def step(self, cells, letters):
+        """
+        makes one move in every active game, and retires the games that end
+        :param cells: the flat cell of the move of every active game
+        :param letters: the letter of the move of every active game
+        :return: the sos's every move completed
+        """
+        games = self.active
+        tables = self.tables
+        boards = self.flat_boards
+        boards[games, cells] = letters
+        # the pairs of cells that make an sos with the new letter
+        pairs = np.where((letters == S_LETTER)[:, np.newaxis, np.newaxis],
+                         tables.s_pairs[cells], tables.o_pairs[cells])
+        first = boards[games[:, np.newaxis], pairs[:, :, 0]]
+        second = boards[games[:, np.newaxis], pairs[:, :, 1]]
+        is_s = letters == S_LETTER
+        gained = np.where(is_s,
+                          np.count_nonzero((first == S_LETTER) & (second == O_LETTER), axis=1),
+                          np.count_nonzero((first == S_LETTER) & (second == S_LETTER), axis=1))
+        player = self.player[games]
+        self.scores[games, player] += gained
+        self.player[games] = np.where(gained > 0, player, 1 - player)
+        self.empty[games] -= 1
+        self.moves += len(games)
+        self.active = games[self.empty[games] > 0]
+        return gained
+
+    def play(self, policies=("random", "random")):
+        """
+        plays every game to its end
+        :param policies: a policy for each player, "random" or "greedy"
+        :return: the scores
+        """
+        while len(self.active):
+            self.step(*self.moves_of(policies))
+        return self.scores
+
+
+def simulate(num_games, table_size, policies=("random", "random"), seed=None):
+    """
+    plays games from the empty board in lockstep
+    :param num_games:
+    :param table_size:
+    :param policies: a policy for each player, "random" or "greedy"
+    :param seed:
+    :return: the scores of every game as a (games, 2) array
+    """
+    return BatchGames(num_games, table_size, seed).play(policies)
+
+
+def generate_dataset(num_games, table_size, policies=("random", "random"), seed=None):
+    """
+    plays games in lockstep and keeps every position reached, for training evaluation
+    functions
+    :param num_games:
+    :param table_size:
+    :param policies: a policy for each player, "random" or "greedy"
+    :param seed:
+    :return: the boards as a (positions, n, n) int8 array, the player to move in each,
+    the scores of both players in it and the final margin of player 0 of its game
+    """
+    games = BatchGames(num_games, table_size, seed)
+    boards, players, scores, game_ids = [], [], [], []
+    while len(games.active):
+        active = games.active
+        boards.append(games.flat_boards[active, :-1].copy())
+        players.append(games.player[active].copy())
+        scores.append(games.scores[active].copy())
+        game_ids.append(active)
+        games.step(*games.moves_of(policies))
+    game_ids = np.concatenate(game_ids)
+    margins = games.scores[:, 0] - games.scores[:, 1]
+    return (np.concatenate(boards).reshape(-1, table_size, table_size), np.concatenate(players),
+            np.concatenate(scores), margins[game_ids])
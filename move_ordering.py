@@ -0,0 +1,101 @@
+from rules import S_LETTER, O_LETTER, EMPTY
+
+# how many killer moves are kept for every ply
+KILLER_SLOTS = 2
+
+
+class MoveOrdering:
+    """
+    orders the moves of a search without making them. the best move known (from the
+    transposition table or the principal variation) comes first, then the moves that
+    complete an sos, most sos's first, then the killer moves of the ply (quiet moves that
+    cut off the search of a sibling) and last the other quiet moves by their history score,
+    which grows every time the move cuts off a search anywhere in the tree.
+    the moves are generated stage by stage, so a cutoff on an early move skips the work
+    of ordering the rest
+    """
+
+    def __init__(self, table_size):
+        self.table_size = table_size
+        # history[move], for the moves of rules.encode_move
+        self.history = [0] * 3 * table_size ** 2
+        # killers[ply] is a list of up to KILLER_SLOTS moves, the newest first
+        self.killers = []
+
+    def clear(self):
+        """forgets every killer move and history score"""
+        self.history = [0] * 3 * self.table_size ** 2
+        self.killers = []
+
+    def age(self):
+        """
+        halves the history scores and forgets the killer moves, before searching a new
+        position, so the history of older searches matters less
+        """
+        self.history = [score >> 1 for score in self.history]
+        self.killers = []
+
+    def record_cutoff(self, state, move, ply, depth):
+        """
+        remembers a move that cut off the search of a state. moves that complete an sos are
+        not remembered since they are always tried early
+        :param state: the state the move was made in (after it was taken back)
+        :param move: a move made by rules.encode_move
+        :param ply: how many moves the state is from the root
+        :param depth: the depth left when the state was searched
+        :return:
+        """
+        letter, cell = divmod(move, self.table_size ** 2)
+        if state.threats.gains[letter][cell]:
+            return
+        # deeper cutoffs save more work, so they count more
+        self.history[move] += int(2 * depth) ** 2
+        while len(self.killers) <= ply:
+            self.killers.append([])
+        killers = self.killers[ply]
+        if move not in killers:
+            killers.insert(0, move)
+            del killers[KILLER_SLOTS:]
+
+    def moves(self, state, ply, first_move=None, sort_quiet=None, use_history=True):
+        """
+        generates the legal moves of a state, best first. the state may be changed between
+        moves as long as it is restored before the next one is asked for
+        :param state:
+        :param ply: how many moves the state is from the root
+        :param first_move: a move to try before all, if it is legal
+        :param sort_quiet: a function that sorts a list of quiet moves in place, instead of
+        sorting them by history
+        :param use_history: whether to sort the quiet moves by history, otherwise they come
+        in board order (s's first) unless sort_quiet is given
+        :return: a generator of moves
+        """
+        cells = self.table_size ** 2
+        letters = state.threats.letters
+        gains = state.threats.gains
+        tried = set()
+        if first_move is not None and letters[first_move % cells] == EMPTY:
+            tried.add(first_move)
+            yield first_move
+        empty = [cell for cell, letter in enumerate(letters) if letter == EMPTY]
+        scoring = [(gains[letter][cell], letter * cells + cell)
+                   for letter in (S_LETTER, O_LETTER) for cell in empty if gains[letter][cell]]
+        scoring.sort(key=lambda x: x[0], reverse=True)
+        for _, move in scoring:
+            if move not in tried:
+                yield move
+        if ply < len(self.killers):
+            for move in self.killers[ply]:
+                letter, cell = divmod(move, cells)
+                if letters[cell] == EMPTY and not gains[letter][cell] and move not in tried:
+                    tried.add(move)
+                    yield move
+        quiet = [letter * cells + cell
+                 for letter in (S_LETTER, O_LETTER) for cell in empty if not gains[letter][cell]]
+        if sort_quiet is not None:
+            sort_quiet(quiet)
+        elif use_history:
+            quiet.sort(key=self.history.__getitem__, reverse=True)
+        for move in quiet:
+            if move not in tried:
+                yield move
@@ -1,9 +1,24 @@
+import heapq
+import itertools
+import math
 import random
+import time
 import numpy as np
 import abc
+import copy
 import game
 from game import Agent
 from game_state import GameState
+from transposition import position_key, EXACT, LOWER, UPPER, DEPTH, VALUE, BOUND, MOVE
+from symmetry import canonical_hash, get_symmetries, map_move, unique_actions
+from move_ordering import MoveOrdering
+from search_stats import SearchStats
+from rules import S_LETTER, O_LETTER, EMPTY, get_sos_index
+from endgame import solve_endgame, DEFAULT_CACHE_MB
+from opening_book import open_book
+from lockstep import BatchGames
+import parallel
+import pondering
 
 MIN_AGENT = 1
 MAX_AGENT = 0
@@ -50,17 +65,12 @@ def is_almost_sos(row, col, current_game_state):
 
 def block_evaluation_function(current_game_state: GameState):
     """
-    counts how many near sos's can be made and returns 1/#nearsos's
+    counts how many near sos's can be made and returns 1/#nearsos's.
+    the state's threat table keeps the count of S's for which is_almost_sos holds
     :param current_game_state:
     :return:
     """
-    board = current_game_state.board
-    locations = np.array(np.where(board == game.S_LETTER))
-    score = 1
-    for row, col in locations.T:
-        if is_almost_sos(row, col, current_game_state):
-            score += 1
-    return 1 / score
+    return 1 / (1 + current_game_state.threats.near_sos)
 
 
 def combined_heuristic(current_game_state: GameState):
@@ -75,22 +85,120 @@ def combined_heuristic(current_game_state: GameState):
     return value
 
 
+def future_sos(state, moves=None):
+    """
+    the most sos's that can still be completed from the state
+    :param state:
+    :param moves: how many moves are left to make, None for the rest of the game
+    :return:
+    """
+    left = len(get_sos_index(state.table_size).triples) - state.score - state.opponent_score
+    if moves is None:
+        return left
+    return min(left, state.threats.most_sos(moves))
+
+
+# the most S's one move can make the end of an open triple (see _block_bounds)
+MAX_NEAR_SOS_PER_MOVE = 9
+
+# an evaluation function declares the range of its values with a bounds attribute:
+# bounds(state, moves) is a (low, high) that holds for the value of the state and of every
+# state up to moves moves after it. ExpectimaxAgent prunes chance nodes with it
+
+def _good_minus_bad_bounds(state, moves=None):
+    value, future = state.score - state.opponent_score, future_sos(state, moves)
+    return value - future, value + future
+
+
+def _score_bounds(state, moves=None):
+    return state.score, state.score + future_sos(state, moves)
+
+
+def _opponent_score_bounds(state, moves=None):
+    return state.opponent_score, state.opponent_score + future_sos(state, moves)
+
+
+def _min_score_bounds(state, moves=None):
+    most = state.opponent_score + future_sos(state, moves)
+    if state.opponent_score == 0:
+        return (1 / most if most else 2), 2
+    return 1 / most, 1 / state.opponent_score
+
+
+def _block_bounds(state, moves=None):
+    # near_sos counts S's, so there are no more of them than cells
+    cells = state.table_size ** 2
+    if moves is None:
+        return 1 / (1 + cells), 1
+    threats = state.threats
+    # an S opens at most the eight triples it ends with the S's two cells away, and is
+    # the end of one itself, and an O opens at most the eight triples of the S's next to it
+    most = min(cells, threats.near_sos + MAX_NEAR_SOS_PER_MOVE * moves)
+    # an S stops being near only when every open triple it ends is closed, by a letter in
+    # the cell the triple misses, and every such triple has at most two S ends
+    closable = heapq.nlargest(moves, (gain_s + gain_o for gain_s, gain_o
+                                      in zip(threats.gains[S_LETTER], threats.gains[O_LETTER])))
+    least = max(0, threats.near_sos - 2 * sum(closable))
+    return 1 / (1 + most), 1 / (1 + least)
+
+
+def _combined_bounds(state, moves=None):
+    high = 3 * (state.score + future_sos(state, moves))
+    if state.score == 0:
+        return _block_bounds(state)[0], max(1, high)
+    return 3 * state.score, high
+
+
+good_minus_bad_evaluation_function.bounds = _good_minus_bad_bounds
+score_evaluation_function.bounds = _score_bounds
+opponent_score_function.bounds = _opponent_score_bounds
+min_score_evaluation_function.bounds = _min_score_bounds
+block_evaluation_function.bounds = _block_bounds
+combined_heuristic.bounds = _combined_bounds
+
+
+def good_minus_bad_evaluation_batch(scores, opponent_scores):
+    return np.asarray(scores) - np.asarray(opponent_scores)
+
+
+def score_evaluation_batch(scores, opponent_scores):
+    return np.asarray(scores)
+
+
+def opponent_score_batch(scores, opponent_scores):
+    return np.asarray(opponent_scores)
+
+
+def min_score_evaluation_batch(scores, opponent_scores):
+    opponent_scores = np.asarray(opponent_scores, dtype=float)
+    return np.where(opponent_scores == 0, 2, 1 / np.where(opponent_scores == 0, 1, opponent_scores))
+
+
+# the batch version of every evaluation function that has one. a batch version takes the
+# scores and opponent scores of k states. block_evaluation_function and combined_heuristic
+# have none: they read the threat table of the state in O(1), which is faster than
+# building the boards of the states would be
+BATCH_EVALUATIONS = {
+    good_minus_bad_evaluation_function: good_minus_bad_evaluation_batch,
+    score_evaluation_function: score_evaluation_batch,
+    opponent_score_function: opponent_score_batch,
+    min_score_evaluation_function: min_score_evaluation_batch,
+}
+
+
+class SearchTimeout(Exception):
+    """raised inside a search when its time or node budget runs out"""
+    pass
+
+
 def smart_random_play(game_state: GameState):
     """
     a random play that does not create a near sos , not always possible therefore might return None
+    the state's threat table keeps these moves up to date, so one is drawn in O(1)
     :param game_state:
     :return:
     """
-    actions = game_state.get_legal_actions()
-    best_actions = []
-    for action in actions:
-        val = block_evaluation_function(game_state.generate_successor(action, MAX_AGENT))
-        if val == 1:
-            best_actions.append(action)
-    if len(best_actions) == 0:
-        return None
-    r = random.randint(0, len(best_actions) - 1)
-    return best_actions[r]
+    return game_state.threats.random_safe_move(random)
 
 
 class MultiAgentSearchAgent(Agent):
@@ -108,9 +216,180 @@ class MultiAgentSearchAgent(Agent):
     is another abstract class.
     """
 
-    def __init__(self, evaluation_function=None, depth=2):
+    def __init__(self, evaluation_function=None, depth=2, transposition_table=None,
+                 use_symmetry=True, workers=None, collect_stats=False, endgame_threshold=None,
+                 opening_book=None, endgame_cache_mb=DEFAULT_CACHE_MB):
         self.evaluation_function = evaluation_function
         self.depth = depth
+        # an optional transposition.TranspositionTable, kept between moves
+        self.transposition_table = transposition_table
+        # search one root action of every group that leads to mirrored or rotated boards,
+        # and let such positions share their transposition table entries
+        self.use_symmetry = use_symmetry
+        # the number of processes to search the root actions with, or None to search them
+        # in this process (see parallel.search_root)
+        self.workers = workers
+        # with collect_stats, stats is the search_stats.SearchStats of the last move and
+        # game_stats the sum of all the moves since reset_stats. the search of the root
+        # actions on the worker processes is not counted
+        self.collect_stats = collect_stats
+        # with this many empty cells or fewer, the move is found by the exact endgame
+        # solver (see endgame.solve_endgame) instead of the search
+        self.endgame_threshold = endgame_threshold
+        # the memory of the endgame solver's cache of solved positions, in MB. the cache is
+        # shared by every solver of the process, so it takes the size of the last one
+        self.endgame_cache_mb = endgame_cache_mb
+        # an optional opening_book.OpeningBook, or the path of one, whose moves are played
+        # without searching
+        self.opening_book = open_book(opening_book) if isinstance(opening_book, str) \
+            else opening_book
+        self.stats = None
+        self.game_stats = SearchStats()
+        # the stats of the move being searched, None when they are not collected
+        self._stats = None
+        self._stats_start = None
+        self._table_counts = None
+
+    def reset_stats(self):
+        """forgets the stats of the moves played so far, before a new game"""
+        self.stats = None
+        self.game_stats = SearchStats()
+
+    def _endgame_action(self, game_state):
+        """
+        a perfect move of the endgame solver if the state has few enough empty cells
+        :return: the move, or None if the search should find the move
+        """
+        if self.endgame_threshold is None:
+            return None
+        empty = game_state.threats.empty
+        if empty == 0 or empty > self.endgame_threshold:
+            return None
+        return solve_endgame(game_state, self.endgame_cache_mb)[1]
+
+    def _known_action(self, game_state):
+        """
+        a move that needs no search: the move of the opening book, or of the endgame solver
+        :return: the move, or None if the search should find the move
+        """
+        if self.opening_book is not None:
+            action = self.opening_book.lookup(game_state)
+            if action is not None:
+                return action
+        return self._endgame_action(game_state)
+
+    def _has_known_action(self, game_state):
+        """whether _known_action has a move for the state, without finding it"""
+        if self.opening_book is not None and self.opening_book.lookup(game_state) is not None:
+            return True
+        empty = game_state.threats.empty
+        return self.endgame_threshold is not None and 0 < empty <= self.endgame_threshold
+
+    def _start_stats(self):
+        """starts counting the stats of a move, if they are collected"""
+        if not self.collect_stats:
+            return
+        self._stats = SearchStats()
+        self._stats_start = time.perf_counter()
+        table = self.transposition_table
+        self._table_counts = None if table is None else (table.hits, table.misses)
+
+    def _finish_stats(self, depth=None):
+        """
+        finishes counting the stats of a move
+        :param depth: the depth of the search, to record it as its only iteration
+        """
+        stats = self._stats
+        if stats is None:
+            return
+        stats.searches = 1
+        stats.seconds = time.perf_counter() - self._stats_start
+        if depth is not None:
+            stats.iteration(depth, stats.seconds)
+        if self._table_counts is not None:
+            stats.table_hits = self.transposition_table.hits - self._table_counts[0]
+            stats.table_misses = self.transposition_table.misses - self._table_counts[1]
+        self.stats = stats
+        self.game_stats.merge(stats)
+        self._stats = None
+
+    def _root_actions(self, game_state, actions):
+        """the root actions worth searching, one of every symmetric group if use_symmetry"""
+        if self.use_symmetry:
+            return unique_actions(game_state, actions, MAX_AGENT)
+        return actions
+
+    def _table_key(self, state, agent):
+        """
+        the transposition table key of a position. with use_symmetry, it is the key of the
+        canonical board, so every mirror of the position finds the same entry
+        :return: the key and the index of the symmetry that maps the board to the stored one
+        """
+        if not self.use_symmetry:
+            return position_key(state, agent), 0
+        board_key, transform = canonical_hash(state)
+        return position_key(state, agent, board_key), transform
+
+    def _evaluate_children(self, state, actions, agent):
+        """
+        evaluates the states that all the actions of agent lead to with one call of the
+        batch version of the evaluation function, for the last layer of a search
+        :param actions: the actions, or None for every legal move in board order
+        :return: list of values, or None if the evaluation function has no batch version
+        """
+        batch = BATCH_EVALUATIONS.get(self.evaluation_function)
+        if batch is None:
+            return None
+        threats = state.threats
+        if actions is None:
+            actions = np.fromiter(state.moves(), dtype=int, count=2 * threats.empty)
+        else:
+            actions = np.asarray(actions, dtype=int)
+        if len(actions) == 0:
+            return None
+        if self._stats is not None:
+            self._stats.evaluate(len(actions))
+        scores = np.full(len(actions), state.score)
+        opponent_scores = np.full(len(actions), state.opponent_score)
+        gains = scores if agent == MAX_AGENT else opponent_scores
+        # the sos's a move completes are its gain in the threat table
+        letters, cells = np.divmod(actions, state.table_size ** 2)
+        gains += np.asarray(threats.gains[S_LETTER:])[letters - S_LETTER, cells]
+        return batch(scores, opponent_scores).tolist()
+
+    @staticmethod
+    def _stored_move(state, action, transform):
+        """an action in the orientation it is stored in the transposition table"""
+        if action is None:
+            return None
+        if transform == 0:
+            return action
+        return map_move(action, get_symmetries(state.table_size).perms[transform],
+                        state.table_size)
+
+    @staticmethod
+    def _table_move(state, move, transform):
+        """a move of the transposition table in the orientation of the state"""
+        if move is None or transform == 0:
+            return move
+        return map_move(move, get_symmetries(state.table_size).inverses[transform],
+                        state.table_size)
+
+    def _worker_copy(self):
+        """a copy of the agent to send to the worker processes, without its search state"""
+        agent = copy.copy(self)
+        agent.transposition_table = None
+        agent.workers = None
+        agent.collect_stats = False
+        agent.stats = None
+        agent.game_stats = SearchStats()
+        return agent
+
+    def _search_root_values(self, game_state, actions):
+        """the values of the root actions, searched in parallel if the agent has workers"""
+        if self.workers:
+            return parallel.search_root(self, game_state, actions)
+        return [self._root_value(game_state, action) for action in actions]
 
     @abc.abstractmethod
     def get_action(self, game_state):
@@ -118,12 +397,24 @@ class MultiAgentSearchAgent(Agent):
 
 
 class RandomAgent(MultiAgentSearchAgent):
+    def __init__(self, evaluation_function=None, depth=2, safe=False):
+        """
+        :param safe: play a random move that leaves the opponent no sos to complete when
+        there is one (see smart_random_play), and any random move otherwise
+        """
+        super().__init__(evaluation_function, depth)
+        self.safe = safe
+
     def get_action(self, game_state):
+        if self.safe:
+            action = smart_random_play(game_state)
+            if action is not None:
+                return action
         actions = game_state.get_legal_actions()
         if list(actions):
             r = random.randint(0, len(actions) - 1)
             return actions[r]
-        return np.array([])
+        return None
 
 
 class MinmaxAgent(MultiAgentSearchAgent):
@@ -132,58 +423,89 @@ class MinmaxAgent(MultiAgentSearchAgent):
         Returns the minimax action from the current gameState using self.depth
         and self.evaluationFunction.
 
-        Here are some method calls that might be useful when implementing minimax.
-
-        game_state.get_legal_actions(agent_index):
-            Returns a list of legal actions for an agent
-            agent_index=0 means our agent, the opponent is agent_index=1
-
-        Action.STOP:
-            The stop direction, which is always legal
-
-        game_state.generate_successor(agent_index, action):
-            Returns the successor game state after an agent takes an action
+        The search walks the given state itself with apply_action / undo_action, so no
+        state is allocated per node and the state is left as it was given.
         """
+        self._start_stats()
+        known_action = self._known_action(game_state)
+        if known_action is not None:
+            self._finish_stats()
+            return known_action
+        if self._stats is not None:
+            self._stats.expand(0)
         max_val = float("-inf")
-        best_action = np.array([])
-        actions = game_state.get_legal_actions()
+        best_action = None
+        actions = self._root_actions(game_state, game_state.get_legal_actions())
+        values = self._evaluate_children(game_state, actions, MAX_AGENT) \
+            if self.depth == 0.5 else None
+        if values is None:
+            values = self._search_root_values(game_state, actions)
         scores = []
-        for action in actions:
-            next_state = game_state.generate_successor(action, MAX_AGENT)
-            diff = game_state.score - next_state.score
-            agent = MIN_AGENT if diff == 0 else MAX_AGENT
-            cur_val = self._minmax_helper(next_state, agent, self.depth - 0.5)
+        for action, cur_val in zip(actions, values):
             scores.append(cur_val)
             if cur_val > max_val:
                 max_val = cur_val
                 best_action = action
+        self._finish_stats(self.depth)
         if max_val == min(scores):
             new_action = smart_random_play(game_state)
             if new_action is not None:
                 best_action = new_action
         return best_action
 
+    def _root_value(self, state, action, alpha=float("-inf")):
+        gained = state.apply_action(action, MAX_AGENT)
+        if self._stats is not None:
+            self._stats.move(1, gained)
+        agent = MIN_AGENT if gained == 0 else MAX_AGENT
+        value = self._minmax_helper(state, agent, self.depth - 0.5)
+        state.undo_action()
+        return value
+
     def _minmax_helper(self, cur_state, agent, depth):
+        stats = self._stats
         if depth == 0 or cur_state.is_done():
+            if stats is not None:
+                stats.evaluate()
             evaluation = self.evaluation_function(cur_state)
             return evaluation
+        table = self.transposition_table
+        if table is not None:
+            key, transform = self._table_key(cur_state, agent)
+            entry = table.lookup(key)
+            if entry is not None and entry[DEPTH] >= depth:
+                # the values are stored for the player to move, like AlphaBetaAgent stores
+                # them, so the two can share a table
+                return entry[VALUE] if agent == MAX_AGENT else -entry[VALUE]
+        if stats is not None:
+            ply = int(2 * (self.depth - depth))
+            stats.expand(ply)
         max_val = float("-inf")
         min_val = np.inf
-        for action in cur_state.get_legal_actions():
-            next_state = cur_state.generate_successor(action, agent)
-            diff = cur_state.score - next_state.score
-            if agent == MIN_AGENT:
-                diff = cur_state.opponent_score - next_state.opponent_score
-            next_agent = 1 - agent if diff == 0 else agent
-            evaluation = self._minmax_helper(next_state, next_agent, depth - 0.5)
+        best_action = None
+        actions = cur_state.moves()
+        values = self._evaluate_children(cur_state, None, agent) if depth == 0.5 else None
+        for i, action in enumerate(actions):
+            if values is not None:
+                evaluation = values[i]
+            else:
+                gained = cur_state.apply_action(action, agent)
+                if stats is not None:
+                    stats.move(ply + 1, gained)
+                next_agent = 1 - agent if gained == 0 else agent
+                evaluation = self._minmax_helper(cur_state, next_agent, depth - 0.5)
+                cur_state.undo_action()
             if evaluation > max_val and agent == MAX_AGENT:
                 max_val = evaluation
+                best_action = action
             if evaluation < min_val and agent == MIN_AGENT:
                 min_val = evaluation
-        if agent == MAX_AGENT:
-            return max_val
-        else:
-            return min_val
+                best_action = action
+        value = max_val if agent == MAX_AGENT else min_val
+        if table is not None:
+            table.store(key, depth, value if agent == MAX_AGENT else -value, EXACT,
+                        self._stored_move(cur_state, best_action, transform))
+        return value
 
 
 class AlphaBetaAgent(MultiAgentSearchAgent):
@@ -191,76 +513,461 @@ class AlphaBetaAgent(MultiAgentSearchAgent):
     Your minimax agent with alpha-beta pruning (question 3)
     """
 
-    def __init__(self, evaluation_function=None, depth=2, ordering_function=lambda x: 0):
-        super().__init__(evaluation_function, depth)
+    def __init__(self, evaluation_function=None, depth=2, ordering_function=None,
+                 transposition_table=None, time_limit=None, node_limit=None,
+                 aspiration_window=None, use_symmetry=True, workers=None, collect_stats=False,
+                 endgame_threshold=None, opening_book=None, ponder=False,
+                 endgame_cache_mb=DEFAULT_CACHE_MB):
+        """
+        :param ordering_function: a function of states to order the quiet moves (the ones
+        that complete no sos) by, instead of the history of the moves that cut off searches
+        :param time_limit: seconds per move. when it or node_limit is given the agent
+        searches anytime: depth 0.5, 1, 1.5... until the budget runs out, and plays the
+        best move of the deepest search that finished. depth is not used then
+        :param node_limit: nodes per move
+        :param aspiration_window: in the anytime search, the first root action is searched
+        within this distance of the previous iteration's score, and again with a full
+        window only if its value falls outside
+        :param workers: the number of processes to search the root actions with. only the
+        fixed depth search is parallel, the anytime search runs in this process
+        :param ponder: whether to search the replies of the opponent on a background
+        process while the opponent thinks (see ponder)
+        """
+        super().__init__(evaluation_function, depth, transposition_table, use_symmetry, workers,
+                         collect_stats, endgame_threshold, opening_book, endgame_cache_mb)
         self.order = ordering_function
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+        self.aspiration_window = aspiration_window
+        # the depth of the last search that finished
+        self.searched_depth = 0
+        self._deadline = None
+        self._nodes = 0
+        self._budgeted = False
+        self._pv = []
+        self._prev_pv = []
+        self._ordering = None
+        self.pondering = ponder
+        # the pondering.Ponder of the opponent's turn, if any
+        self._ponder = None
+        # a function the search stops once it returns True, checked with the budget
+        self._should_stop = None
+
+    def _ordered_actions(self, state, agent, ply, first_move=None):
+        """
+        generates the legal actions of agent best first (see move_ordering.MoveOrdering),
+        with first_move (the best move known from the transposition table or from the
+        previous principal variation) tried before all
+        """
+        sort_quiet = None
+        # the root keeps its quiet moves in board order, so which of equally good moves is
+        # played does not depend on earlier searches, and the parallel search agrees
+        use_history = ply > 0
+        if self.order is not None:
+            def sort_quiet(moves):
+                keys = {}
+                for move in moves:
+                    state.apply_action(move, agent)
+                    keys[move] = self.order(state)
+                    state.undo_action()
+                moves.sort(key=keys.__getitem__, reverse=agent == MAX_AGENT)
+        return self._ordering.moves(state, ply, first_move, sort_quiet, use_history)
 
     def get_action(self, game_state):
         """
         Returns the minimax action using self.depth and self.evaluationFunction
         """
-        best_action = np.array([])
+        self._start_stats()
+        # the book and the endgame solver know better than any search, pondered or not
+        known_action = self._known_action(game_state)
+        if known_action is not None:
+            self.stop_running()
+            self._finish_stats()
+            return known_action
+        pondered_action = self._pondered_action(game_state)
+        if pondered_action is not None:
+            self._finish_stats()
+            return pondered_action
+        if self._ordering is None or self._ordering.table_size != game_state.table_size:
+            self._ordering = MoveOrdering(game_state.table_size)
+        else:
+            self._ordering.age()
+        if self.time_limit is None and self.node_limit is None:
+            if self.workers and self.depth > 0.5:
+                best_action, max_score, scores = self._parallel_search_root(game_state)
+            else:
+                best_action, max_score, scores = self._search_root(game_state, self.depth)
+            self._finish_stats(self.depth)
+        else:
+            best_action, max_score, scores = self._iterative_deepening(game_state)
+            self._finish_stats()
+        if max_score == min(scores):
+            new_action = smart_random_play(game_state)
+            if new_action is not None:
+                best_action = new_action
+        return best_action
+
+    def ponder(self, game_state):
+        """
+        starts searching, on the ponder process, the positions the opponent's replies that
+        complete no sos lead to, the reply of the principal variation first, leaving out the
+        positions the opening book or the endgame solver has a move for. the search of the
+        position the opponent really moves to is played by the next get_action: at once if
+        it reached self.depth, and for an anytime agent after it searched time_limit more
+        seconds
+        :param game_state: the position the opponent is to move in
+        :return:
+        """
+        self.stop_running()
+        if not self.pondering:
+            return
+        predicted = self._pv[0][1] if self._pv and len(self._pv[0]) > 1 else None
+        replies = []
+        for action in game_state.moves():
+            gained = game_state.apply_action(action, 1)
+            known = self._has_known_action(game_state)
+            game_state.undo_action()
+            if not gained and not known:
+                if action == predicted:
+                    replies.insert(0, action)
+                else:
+                    replies.append(action)
+        if not replies:
+            return
+        budgeted = self.time_limit is not None or self.node_limit is not None
+        self._ponder = pondering.Ponder(self, game_state, replies,
+                                        None if budgeted else self.depth)
+
+    def stop_running(self):
+        """stops the pondering of the opponent's turn"""
+        if self._ponder is not None:
+            self._ponder.cancel()
+            self._ponder = None
+
+    def _pondered_action(self, game_state):
+        """
+        the move the pondering found for the position, if the pondering searched it deep
+        enough. any other pondering is stopped
+        :return: the move, or None if the position should be searched
+        """
+        ponder, self._ponder = self._ponder, None
+        if ponder is None:
+            return None
+        result = ponder.result(game_state, self.time_limit)
+        if result is None:
+            return None
+        move, tied, depth = result
+        if self.time_limit is None and self.node_limit is None and \
+                depth < min(self.depth, game_state.threats.empty / 2):
+            return None
+        self.searched_depth = depth
+        if tied:
+            new_action = smart_random_play(game_state)
+            if new_action is not None:
+                return new_action
+        return move
+
+    def _ponder_search(self, game_state, max_depth):
+        """the search of a position of a ponder, on the ponder process"""
+        if self._ordering is None or self._ordering.table_size != game_state.table_size:
+            self._ordering = MoveOrdering(game_state.table_size)
+        else:
+            self._ordering.age()
+        return self._iterative_deepening(game_state, max_depth)
+
+    def _iterative_deepening(self, game_state, max_depth=None):
+        """
+        searches deeper and deeper until the time or node budget runs out. the first
+        search always finishes so there is always a move to play
+        :param game_state:
+        :param max_depth: a depth to stop at, even with budget left
+        :return: the result of the deepest search that finished
+        """
+        start = time.time()
+        self._deadline = None if self.time_limit is None else start + self.time_limit
+        self._nodes = 0
+        self._prev_pv = []
+        mark = game_state.num_applied
+        # searching one move per empty cell is searching to the end of the game
+        end_depth = game_state.threats.empty / 2
+        max_depth = end_depth if max_depth is None else min(max_depth, end_depth)
+        depth = 0.5
+        iteration_start = time.perf_counter()
+        result = self._search_root(game_state, depth)
+        self.searched_depth = depth
+        if self._stats is not None:
+            self._stats.iteration(depth, time.perf_counter() - iteration_start)
+        self._budgeted = True
+        try:
+            while depth < max_depth:
+                depth += 0.5
+                self._prev_pv = self._pv[0]
+                iteration_start = time.perf_counter()
+                result = self._search_root(game_state, depth, result[1])
+                self.searched_depth = depth
+                if self._stats is not None:
+                    self._stats.iteration(depth, time.perf_counter() - iteration_start)
+        except SearchTimeout:
+            while game_state.num_applied > mark:
+                game_state.undo_action()
+        finally:
+            self._budgeted = False
+        return result
+
+    def _check_budget(self):
+        """raises SearchTimeout once the search used up its node or time budget"""
+        self._nodes += 1
+        if self.node_limit is not None and self._nodes > self.node_limit:
+            raise SearchTimeout()
+        if self._nodes % 128 == 0:
+            if self._deadline is not None and time.time() > self._deadline:
+                raise SearchTimeout()
+            if self._should_stop is not None and self._should_stop():
+                raise SearchTimeout()
+
+    def _search_root(self, game_state, depth, guess=None):
+        """
+        searches every action of the root to the given depth. after the first action, every
+        action is searched with a window just around the best score, which tells whether it
+        is worse, equal or better without finding its exact value unless it is better
+        :param guess: the expected score of the root, for the aspiration window
+        :return: the best action, its score and the scores of all the actions, where the
+        score of a worse action may only be a bound that is still lower than the best score
+        """
+        self._pv = [[] for _ in range(int(2 * depth) + 2)]
+        if self._stats is not None:
+            self._stats.expand(0)
+        best_action = None
         max_score = float("-inf")
-        actions = game_state.get_legal_actions()
-        states = [(game_state.generate_successor(action, MAX_AGENT), action) for action in
-                  actions]
-        states.sort(key=lambda x: self.order(x[0]), reverse=True)
         scores = []
-        for state, action in states:
-            cur_score = self._find_score(state, self.depth - 0.5, MIN_AGENT, max_score)
+        first_move = self._prev_pv[0] if self._prev_pv else None
+        actions = list(self._ordered_actions(game_state, MAX_AGENT, 0, first_move))
+        actions = self._root_actions(game_state, actions)
+        values = self._evaluate_children(game_state, actions, MAX_AGENT) if depth == 0.5 else None
+        for i, action in enumerate(actions):
+            on_pv = first_move is not None and action == first_move
+            gained = game_state.apply_action(action, MAX_AGENT)
+            if self._stats is not None:
+                self._stats.move(1, gained)
+            if values is not None:
+                cur_score = values[i]
+            elif max_score == float("-inf"):
+                cur_score = None
+                if guess is not None and self.aspiration_window is not None:
+                    low, high = guess - self.aspiration_window, guess + self.aspiration_window
+                    cur_score = self._child_value(game_state, depth - 0.5, MAX_AGENT, gained,
+                                                  low, high, 1, on_pv)
+                    if cur_score <= low or cur_score >= high:
+                        cur_score = None
+                if cur_score is None:
+                    cur_score = self._child_value(game_state, depth - 0.5, MAX_AGENT, gained,
+                                                  float("-inf"), float("inf"), 1, on_pv)
+            else:
+                low, high = math.nextafter(max_score, -math.inf), math.nextafter(max_score, math.inf)
+                cur_score = self._child_value(game_state, depth - 0.5, MAX_AGENT, gained,
+                                              low, high, 1, on_pv)
+                if cur_score >= high:
+                    cur_score = self._child_value(game_state, depth - 0.5, MAX_AGENT, gained,
+                                                  max_score, float("inf"), 1, on_pv)
+            game_state.undo_action()
             scores.append(cur_score)
             if cur_score > max_score:
                 max_score = cur_score
                 best_action = action
-        if max_score == min(scores):
-            new_action = smart_random_play(game_state)
-            if new_action is not None:
-                best_action = new_action
-        return best_action
+                self._pv[0] = [action] + self._pv[1]
+        return best_action, max_score, scores
+
+    def _parallel_search_root(self, game_state):
+        """
+        searches the root actions on the worker processes (see parallel.search_root), in
+        the order _search_root searches them, so both play the same action
+        :return: the best action, its score and the scores of all the actions
+        """
+        if self._stats is not None:
+            self._stats.expand(0)
+        actions = list(self._ordered_actions(game_state, MAX_AGENT, 0))
+        actions = self._root_actions(game_state, actions)
+        best_action = None
+        max_score = float("-inf")
+        scores = self._search_root_values(game_state, actions)
+        for action, cur_score in zip(actions, scores):
+            if cur_score > max_score:
+                max_score = cur_score
+                best_action = action
+        return best_action, max_score, scores
+
+    def _root_value(self, state, action, alpha=float("-inf")):
+        if self._ordering is None or self._ordering.table_size != state.table_size:
+            self._ordering = MoveOrdering(state.table_size)
+        self._pv = [[] for _ in range(int(2 * self.depth) + 2)]
+        gained = state.apply_action(action, MAX_AGENT)
+        value = self._child_value(state, self.depth - 0.5, MAX_AGENT, gained, alpha,
+                                  float("inf"), 1, False)
+        state.undo_action()
+        return value
 
-    def _find_score(self, state, depth, agent, parent_val):
+    def _worker_copy(self):
+        agent = super()._worker_copy()
+        agent._ordering = None
+        agent._pv = []
+        agent._prev_pv = []
+        agent._ponder = None
+        agent.pondering = False
+        return agent
+
+    def _child_value(self, state, depth, agent, gained, alpha, beta, ply, on_pv):
+        """
+        the value for agent of the state agent just moved to. if the move completed an sos
+        agent plays again, so the child is searched for agent with the same window,
+        otherwise it is the opponent's negated value with the window negated
+        """
+        if gained:
+            return self._negamax(state, depth, agent, alpha, beta, ply, on_pv)
+        return -self._negamax(state, depth, 1 - agent, -beta, -alpha, ply, on_pv)
+
+    def _negamax(self, state, depth, agent, alpha, beta, ply=1, on_pv=False):
+        """
+        fail-soft alpha-beta with principal variation search. a value is the evaluation
+        function for MAX_AGENT and its negation for MIN_AGENT, so both agents maximize.
+        the first action gets the full (alpha, beta) window and the rest a null window that
+        only proves they are no better, with a full re-search for the ones that are
+        :param ply: how many moves the state is from the root
+        :param on_pv: whether every move from the root to here followed the principal
+        variation of the previous iteration
+        """
+        self._pv[ply] = []
+        stats = self._stats
+        if self._budgeted:
+            self._check_budget()
         if depth == 0 or state.is_done():
+            if stats is not None:
+                stats.evaluate()
             evaluation = self.evaluation_function(state)
-            return evaluation
-        if agent == MAX_AGENT:
-            max_val = float("-inf")
-            actions = state.get_legal_actions()
-            states = [state.generate_successor(action, agent) for action in actions]
-            states.sort(key=self.order, reverse=True)
-            for next_state in states:
-                diff = state.score - next_state.score
-                if agent == MIN_AGENT:
-                    diff = state.opponent_score - next_state.opponent_score
-                next_agent = 1 - agent if diff == 0 else agent
-                cur_val = self._find_score(next_state, depth - 0.5, next_agent, max_val)
-                if cur_val > max_val:
-                    max_val = cur_val
-                if cur_val > parent_val:
-                    break
-            return max_val
-        else:
-            min_val = np.inf
-            actions = state.get_legal_actions()
-            states = [state.generate_successor(action, agent) for action in actions]
-            states.sort(key=self.order)
-            for next_state in states:
-                diff = state.score - next_state.score
-                if agent == MIN_AGENT:
-                    diff = state.opponent_score - next_state.opponent_score
-                next_agent = 1 - agent if diff == 0 else agent
-                cur_val = self._find_score(next_state, depth - 0.5, next_agent, min_val)
-                if cur_val < min_val:
-                    min_val = cur_val
-                if cur_val < parent_val:
-                    break
-            return min_val
+            return evaluation if agent == MAX_AGENT else -evaluation
+        table = self.transposition_table
+        first_move = None
+        if table is not None:
+            key, transform = self._table_key(state, agent)
+            entry = table.lookup(key)
+            if entry is not None:
+                first_move = self._table_move(state, entry[MOVE], transform)
+                if entry[DEPTH] >= depth:
+                    value, bound = entry[VALUE], entry[BOUND]
+                    if bound == EXACT or (bound == LOWER and value >= beta) or \
+                            (bound == UPPER and value <= alpha):
+                        return value
+        if stats is not None:
+            stats.expand(ply)
+        on_pv = on_pv and ply < len(self._prev_pv)
+        if on_pv:
+            first_move = self._prev_pv[ply]
+        original_alpha = alpha
+        best_val = float("-inf")
+        best_action = None
+        actions = self._ordered_actions(state, agent, ply, first_move)
+        for i, action in enumerate(actions):
+            child_on_pv = on_pv and action == first_move
+            gained = state.apply_action(action, agent)
+            if stats is not None:
+                stats.move(ply + 1, gained)
+            if i == 0:
+                cur_val = self._child_value(state, depth - 0.5, agent, gained, alpha, beta,
+                                            ply + 1, child_on_pv)
+            else:
+                cur_val = self._child_value(state, depth - 0.5, agent, gained, alpha,
+                                            math.nextafter(alpha, math.inf), ply + 1, child_on_pv)
+                if alpha < cur_val < beta:
+                    cur_val = self._child_value(state, depth - 0.5, agent, gained, alpha, beta,
+                                                ply + 1, child_on_pv)
+            state.undo_action()
+            if cur_val > best_val:
+                best_val = cur_val
+                best_action = action
+                self._pv[ply] = [action] + self._pv[ply + 1]
+            if cur_val > alpha:
+                alpha = cur_val
+            if alpha >= beta:
+                self._ordering.record_cutoff(state, action, ply, depth)
+                if stats is not None:
+                    stats.cutoff(ply, i)
+                break
+        if table is not None:
+            if best_val <= original_alpha:
+                bound = UPPER
+            elif best_val >= beta:
+                bound = LOWER
+            else:
+                bound = EXACT
+            table.store(key, depth, best_val, bound,
+                        self._stored_move(state, best_action, transform))
+        return best_val
 
 
 class ExpectimaxAgent(MultiAgentSearchAgent):
     """
     Your expectimax agent (question 4)
+
+    when the evaluation function declares its bounds (see future_sos), the chance nodes
+    are pruned (star1): the moves of the opponent stop being searched once the average can
+    no longer get into the window of the search, using the bounds of every move not
+    searched yet. every action whose value matters is still searched to its exact value,
+    and it is added up in the same order as without pruning, so the agent plays the same
+    moves (see sos.test_pruning)
+
+    with samples, the search is approximate instead: every node below the root searches at
+    most samples of its moves. a max node searches the moves that complete an sos first,
+    and then moves drawn at random, the ones that open no triple for the opponent first. a
+    chance node averages a stratified sample of the moves of the opponent: the ones that
+    complete an sos first, and quiet ones drawn at random for the rest, two when it can. all
+    the nodes of a ply draw the same random numbers, so sibling subtrees are compared on
+    the same sample. the search of a root action costs at most samples ** (2 * depth - 1)
+    nodes however big the board is, and after every move intervals holds the confidence
+    interval of the value of every root action, unbounded when it can not be estimated
     """
 
+    # the margin the pruning leaves for the rounding of the sums of the values
+    PRUNING_TOLERANCE = 1e-9
+    # the z value of the confidence intervals of the sampled root values (95%)
+    CONFIDENCE_Z = 1.96
+
+    def __init__(self, evaluation_function=None, depth=2, transposition_table=None,
+                 use_symmetry=True, workers=None, collect_stats=False, endgame_threshold=None,
+                 opening_book=None, pruning="star1", samples=None, seed=None,
+                 endgame_cache_mb=DEFAULT_CACHE_MB):
+        """
+        :param pruning: "star1", or None to search every move of the opponent. it is only
+        used when the evaluation function has bounds
+        :param samples: the number of moves a node below the root searches, or None to
+        search all of them
+        :param seed: a seed of the samples, otherwise a random one. the samples of a
+        position depend only on it and on the position
+        """
+        super().__init__(evaluation_function, depth, transposition_table, use_symmetry, workers,
+                         collect_stats, endgame_threshold, opening_book, endgame_cache_mb)
+        if pruning not in (None, "star1"):
+            raise ValueError(f"unknown pruning {pruning!r}")
+        if samples is not None and samples < 1:
+            raise ValueError(f"samples must be positive, got {samples!r}")
+        self.pruning = pruning
+        self.samples = samples
+        self.seed = random.getrandbits(64) if seed is None else seed
+        # with samples, the (action, low, high) of every root action of the last move. the
+        # values searched on worker processes have no interval, so it is unbounded
+        self.intervals = None
+        # the seed of the samples of the current move, and the half width of the confidence
+        # interval of the last root action searched
+        self._move_seed = None
+        self._half_width = 0.0
+        # see _ply_buffers
+        self._buffers = None
+
+    @property
+    def _bounds(self):
+        """the bounds of the evaluation function, or None if the search is not pruned"""
+        if self.pruning is None or self.samples is not None:
+            return None
+        return getattr(self.evaluation_function, "bounds", None)
+
     def get_action(self, game_state):
         """
         Returns the expectimax action using self.depth and self.evaluationFunction
@@ -268,50 +975,611 @@ class ExpectimaxAgent(MultiAgentSearchAgent):
         The opponent should be modeled as choosing uniformly at random from their
         legal moves.
         """
-        """*** YOUR CODE HERE ***"""
-        best_action = np.array([])
+        self._start_stats()
+        known_action = self._known_action(game_state)
+        if known_action is not None:
+            self._finish_stats()
+            return known_action
+        if self._stats is not None:
+            self._stats.expand(0)
+        best_action = None
         max_score = float("-inf")
-        scores=[]
-        for action in game_state.get_legal_actions():
-            cur_state = game_state.generate_successor(action, MAX_AGENT)
-            cur_score = self._expectimax_helper(cur_state, self.depth - 0.5, MIN_AGENT)
+        scores = []
+        actions = self._root_actions(game_state, game_state.get_legal_actions())
+        if self.samples is not None:
+            values = self._sampled_root_values(game_state, actions)
+        elif self.workers or self._bounds is None:
+            values = self._search_root_values(game_state, actions)
+        else:
+            values = self._pruned_root_values(game_state, actions)
+        for action, cur_score in zip(actions, values):
             scores.append(cur_score)
             if cur_score >= max_score:
                 max_score = cur_score
                 best_action = action
+        self._finish_stats(self.depth)
         if max_score == min(scores):
             new_action = smart_random_play(game_state)
             if new_action is not None:
                 best_action = new_action
         return best_action
 
+    def _root_value(self, state, action, alpha=float("-inf")):
+        gained = state.apply_action(action, MAX_AGENT)
+        if self._stats is not None:
+            self._stats.move(1, gained)
+        if self.samples is not None:
+            value = self._sampled_helper(state, self.depth - 0.5, MIN_AGENT)
+        elif self._bounds is None:
+            value = self._expectimax_helper(state, self.depth - 0.5, MIN_AGENT)
+        else:
+            value = self._pruned_helper(state, self.depth - 0.5, MIN_AGENT, alpha, float("inf"))
+        state.undo_action()
+        return value
+
+    def _pruned_root_values(self, game_state, actions):
+        """
+        the values of the root actions, with the pruning. every action only needs to be
+        told apart from the best one so far: a worse one gets a bound under it, and an equal
+        or better one its exact value. the actions a search of depth 1 rates best are
+        searched first, so the rest are told apart from a high value and fail low early
+        """
+        stats = self._stats
+        guesses = []
+        for action in actions:
+            gained = game_state.apply_action(action, MAX_AGENT)
+            agent = MAX_AGENT if gained else MIN_AGENT
+            if stats is not None:
+                stats.move(1, gained)
+                stats.expand(1)
+            values = self._evaluate_children(game_state, None, agent)
+            if values is None:
+                values = []
+                for reply in game_state.moves():
+                    game_state.apply_action(reply, agent)
+                    if stats is not None:
+                        stats.evaluate()
+                    values.append(self.evaluation_function(game_state))
+                    game_state.undo_action()
+            if not values:
+                guesses.append(0)
+            else:
+                guesses.append(max(values) if agent == MAX_AGENT else sum(values) / len(values))
+            game_state.undo_action()
+        values = [None] * len(actions)
+        best = float("-inf")
+        for i in sorted(range(len(actions)), key=lambda i: -guesses[i]):
+            values[i] = self._root_value(game_state, actions[i], math.nextafter(best, -math.inf))
+            best = max(best, values[i])
+        return values
+
     def _expectimax_helper(self, state, depth, agent):
+        stats = self._stats
         if depth == 0:
+            if stats is not None:
+                stats.evaluate()
             return self.evaluation_function(state)
+        if stats is not None:
+            ply = int(2 * (self.depth - depth))
+            stats.expand(ply)
+        count = 2 * state.threats.empty
+        actions = state.moves()
+        values = self._evaluate_children(state, None, agent) if depth == 0.5 else None
         if agent == MAX_AGENT:
             max_val = float("-inf")
-            actions = state.get_legal_actions()
-            for action in actions:
-                new_state = state.generate_successor(action, agent)
-                diff = state.score - new_state.score
-                if agent == MIN_AGENT:
-                    diff = state.opponent_score - new_state.opponent_score
-                next_agent = 1 - agent if diff == 0 else agent
-                cur_val = self._expectimax_helper(new_state, depth - 0.5, next_agent)
+            for i, action in enumerate(actions):
+                if values is not None:
+                    cur_val = values[i]
+                else:
+                    gained = state.apply_action(action, agent)
+                    if stats is not None:
+                        stats.move(ply + 1, gained)
+                    next_agent = 1 - agent if gained == 0 else agent
+                    cur_val = self._expectimax_helper(state, depth - 0.5, next_agent)
+                    state.undo_action()
                 if cur_val >= max_val:
                     max_val = cur_val
             return max_val
         else:
             avg_val = 0.0
-            actions = state.get_legal_actions()
-            for action in actions:
-                new_state = state.generate_successor(action, agent)
-                diff = state.score - new_state.score
-                if agent == MIN_AGENT:
-                    diff = state.opponent_score - new_state.opponent_score
-                next_agent = 1 - agent if diff == 0 else agent
-                cur_val = self._expectimax_helper(new_state, depth - 0.5, next_agent)
+            for i, action in enumerate(actions):
+                if values is not None:
+                    cur_val = values[i]
+                else:
+                    gained = state.apply_action(action, agent)
+                    if stats is not None:
+                        stats.move(ply + 1, gained)
+                    next_agent = 1 - agent if gained == 0 else agent
+                    cur_val = self._expectimax_helper(state, depth - 0.5, next_agent)
+                    state.undo_action()
                 avg_val += cur_val
-            if len(actions) == 0:
+            if count == 0:
                 return 0
-            return avg_val / len(actions)
+            return avg_val / count
+
+    def _pruned_helper(self, state, depth, agent, alpha, beta):
+        """
+        the value _expectimax_helper finds, searched within the window (alpha, beta). a
+        value that is not in the window is only a bound: at most alpha if the exact value
+        is, at least beta if the exact value is. a value in the window is exact
+        """
+        stats = self._stats
+        if depth == 0:
+            if stats is not None:
+                stats.evaluate()
+            return self.evaluation_function(state)
+        ply = int(2 * (self.depth - depth))
+        if stats is not None:
+            stats.expand(ply)
+        values = self._evaluate_children(state, None, agent) if depth == 0.5 else None
+        if agent == MAX_AGENT:
+            max_val = float("-inf")
+            for i, action in enumerate(state.moves()):
+                if values is not None:
+                    cur_val = values[i]
+                else:
+                    gained = state.apply_action(action, agent)
+                    if stats is not None:
+                        stats.move(ply + 1, gained)
+                    next_agent = 1 - agent if gained == 0 else agent
+                    cur_val = self._pruned_helper(state, depth - 0.5, next_agent,
+                                                  max(alpha, max_val), beta)
+                    state.undo_action()
+                if cur_val >= max_val:
+                    max_val = cur_val
+                    if max_val >= beta:
+                        if stats is not None:
+                            stats.cutoff(ply, i)
+                        break
+            return max_val
+        count = 2 * state.threats.empty
+        if count == 0:
+            return 0
+        if values is not None:
+            avg_val = 0.0
+            for cur_val in values:
+                avg_val += cur_val
+            return avg_val / count
+        if count < 4 * depth:
+            # the board fills up before the leaves, and a full board is worth 0 or -inf,
+            # which no bounds hold for
+            return self._expectimax_helper(state, depth, agent)
+        tolerance = self.PRUNING_TOLERANCE
+        # the bounds and values of the moves, indexed by move, in buffers of the ply that
+        # every node of the ply reuses
+        lows, highs, child_values = self._ply_buffers(state, ply)
+        rest_low = rest_high = 0.0
+        if depth == 0.5:
+            low, high = self._bounds(state, 1)
+        for action in state.moves():
+            if depth > 0.5:
+                # every move is bounded on its own, after it is made, which holds it much
+                # tighter than the bounds of the chance node: they take in what every move
+                # could gain
+                state.apply_action(action, agent)
+                low, high = self._bounds(state, int(2 * depth) - 1)
+                state.undo_action()
+            lows[action], highs[action] = low, high
+            rest_low += low
+            rest_high += high
+        # the moves that complete an sos for the opponent are searched first, since they
+        # lower the average the most and fail the node low the soonest. the values are still
+        # added up in the order of the moves
+        searched = 0.0
+        for k, action in enumerate(state.moves("gain")):
+            rest_low -= lows[action]
+            rest_high -= highs[action]
+            child_alpha = count * alpha - searched - rest_high - tolerance
+            child_beta = count * beta - searched - rest_low + tolerance
+            gained = state.apply_action(action, agent)
+            if stats is not None:
+                stats.move(ply + 1, gained)
+            next_agent = 1 - agent if gained == 0 else agent
+            cur_val = self._pruned_helper(state, depth - 0.5, next_agent, child_alpha,
+                                          child_beta)
+            state.undo_action()
+            searched += cur_val
+            child_values[action] = cur_val
+            if cur_val <= child_alpha:
+                if stats is not None:
+                    stats.cutoff(ply, k)
+                # the values were added up in another order than the exact value would be,
+                # so the bound is widened by the rounding that may have made
+                return min((searched + rest_high + tolerance) / count, alpha)
+            if cur_val >= child_beta:
+                if stats is not None:
+                    stats.cutoff(ply, k)
+                return max((searched + rest_low - tolerance) / count, beta)
+        avg_val = 0.0
+        for action in state.moves():
+            avg_val += child_values[action]
+        return avg_val / count
+
+    def _ply_buffers(self, state, ply):
+        """the lows, highs and values buffers of the chance nodes of a ply, made only once"""
+        size = 3 * state.table_size ** 2
+        buffers = self._buffers
+        if buffers is None or len(buffers[0][0]) != size:
+            buffers = self._buffers = []
+        while len(buffers) <= ply:
+            buffers.append(([0.0] * size, [0.0] * size, [0.0] * size))
+        return buffers[ply]
+
+    def _sampled_root_values(self, game_state, actions):
+        """
+        the sampled values of the root actions, and their confidence intervals in intervals
+        """
+        # every position gets its own samples, the same every time it is searched, and the
+        # workers draw the same samples as this process would
+        self._move_seed = hash((self.seed, game_state.hash))
+        if self.workers:
+            values = self._search_root_values(game_state, actions)
+            # the workers send back only the values, so their intervals are unknown
+            self.intervals = [(action, float("-inf"), float("inf")) for action in actions]
+            return values
+        values = []
+        self.intervals = []
+        for action in actions:
+            self._half_width = 0.0
+            value = self._root_value(game_state, action)
+            values.append(value)
+            self.intervals.append((action, value - self._half_width, value + self._half_width))
+        return values
+
+    @staticmethod
+    def _scoring_moves(state):
+        """the moves of a state that complete an sos, the most first"""
+        if not state.threats.open_threats:
+            return []
+        gains = state.threats.gains
+        cells = state.table_size ** 2
+        return list(itertools.takewhile(lambda move: gains[move // cells][move % cells],
+                                        state.moves("gain")))
+
+    @staticmethod
+    def _quiet_moves(state):
+        """the moves of a state that complete no sos, in board order"""
+        gains = state.threats.gains
+        cells = state.table_size ** 2
+        return (move for move in state.moves() if not gains[move // cells][move % cells])
+
+    @staticmethod
+    def _draw(moves, population, picks, rnd):
+        """
+        picks of the population moves drawn at random, in the order of the moves, walking
+        them only up to the last one drawn
+        :param moves: an iterable of the moves
+        :param population: how many moves there are
+        """
+        if picks >= population:
+            yield from moves
+            return
+        drawn = sorted(rnd.sample(range(population), picks))
+        k = 0
+        for i, move in enumerate(moves):
+            if i == drawn[k]:
+                yield move
+                k += 1
+                if k == picks:
+                    return
+
+    def _sampled_helper(self, state, depth, agent):
+        """
+        the value _expectimax_helper finds, with every node below the root searching at most
+        samples of its moves: a max node the moves that complete an sos, the most first, and
+        then the moves that open no triple for the opponent and the rest, drawn at random,
+        and a chance node a stratified sample of the moves of the opponent. the half width
+        of the confidence interval of a chance node right under the root is left in
+        _half_width
+        """
+        stats = self._stats
+        if depth == 0:
+            if stats is not None:
+                stats.evaluate()
+            return self.evaluation_function(state)
+        ply = int(2 * (self.depth - depth))
+        if stats is not None:
+            stats.expand(ply)
+        samples = self.samples
+        threats = state.threats
+        count = 2 * threats.empty
+        scoring = self._scoring_moves(state)
+        quiet = count - len(scoring)
+        # common random numbers: every node of the ply draws the same indexes
+        rnd = random.Random(hash((self._move_seed, ply)))
+        if agent == MAX_AGENT:
+            actions = scoring[:samples]
+            if len(actions) < samples and quiet:
+                safe = sum(1 for move in self._quiet_moves(state) if threats.is_safe(move))
+                actions += self._draw((move for move in self._quiet_moves(state)
+                                       if threats.is_safe(move)),
+                                      safe, samples - len(actions), rnd)
+                if len(actions) < samples:
+                    actions += self._draw((move for move in self._quiet_moves(state)
+                                           if not threats.is_safe(move)),
+                                          quiet - safe, samples - len(actions), rnd)
+            max_val = float("-inf")
+            for action in actions:
+                gained = state.apply_action(action, agent)
+                if stats is not None:
+                    stats.move(ply + 1, gained)
+                next_agent = 1 - agent if gained == 0 else agent
+                cur_val = self._sampled_helper(state, depth - 0.5, next_agent)
+                state.undo_action()
+                if cur_val >= max_val:
+                    max_val = cur_val
+            return max_val
+        if count == 0:
+            return 0
+        # the moves that complete an sos are the ones that change the value the most, so
+        # they are averaged first, as many of them as samples allows. two samples are left
+        # to the quiet moves when there is room, so their spread can be told, and a single
+        # sample is drawn from all the moves
+        if scoring and quiet and samples == 1:
+            strata = [(itertools.chain(scoring, self._quiet_moves(state)), count, 1)]
+        else:
+            quiet_picks = min(quiet, 2 if samples > 2 else 1)
+            scoring_picks = min(len(scoring), samples - quiet_picks)
+            strata = [(scoring, len(scoring), scoring_picks),
+                      (self._quiet_moves(state), quiet, min(quiet, samples - scoring_picks))]
+        total = 0.0
+        variance = 0.0
+        for stratum, size, stratum_picks in strata:
+            if not size:
+                continue
+            values = []
+            for action in self._draw(stratum, size, stratum_picks, rnd):
+                gained = state.apply_action(action, agent)
+                if stats is not None:
+                    stats.move(ply + 1, gained)
+                next_agent = 1 - agent if gained == 0 else agent
+                values.append(self._sampled_helper(state, depth - 0.5, next_agent))
+                state.undo_action()
+            mean = sum(values) / len(values)
+            total += size * mean
+            if ply == 1 and len(values) < size:
+                if len(values) == 1:
+                    # a single sample tells nothing of how the values of the others spread
+                    variance = float("inf")
+                else:
+                    # the variance of the stratified estimate, with the finite population
+                    # correction of sampling without replacement
+                    spread = sum((x - mean) ** 2 for x in values) / (len(values) - 1)
+                    variance += (size / count) ** 2 * spread / len(values) * (
+                        1 - len(values) / size)
+        if ply == 1:
+            self._half_width = self.CONFIDENCE_Z * math.sqrt(variance)
+        return total / count
+
+
+class MCTSNode:
+    """a node of the search tree of MCTSAgent"""
+    __slots__ = ("move", "parent", "player", "children", "untried", "unsafe", "visits", "value")
+
+    def __init__(self, move, parent, player, untried):
+        # the move that leads to the node from its parent
+        self.move = move
+        self.parent = parent
+        # the player to move in the node, which is the parent's player again after a move
+        # that completed an sos
+        self.player = player
+        self.children = []
+        self.untried = untried
+        # the moves put aside because they let the opponent complete an sos, or None once
+        # they are the only moves left and are tried like the rest
+        self.unsafe = []
+        self.visits = 0
+        # the sum of the rewards of the playouts through the node, for the player who made
+        # the move that leads to it
+        self.value = 0.0
+
+
+class MCTSAgent(Agent):
+    """
+    monte carlo tree search with the UCT selection rule. every iteration walks the tree
+    from the root, adds one node and plays the game to its end from there, making and
+    taking back the moves on the given state, so no state is copied. the reward of a
+    playout is 1 for a win, 0.5 for a tie and 0 for a loss, and it is backed up to every
+    node for the player who moved into it, so extra turns are scored for the right player
+    """
+
+    def __init__(self, iterations=1000, time_limit=None, exploration=math.sqrt(2),
+                 rollout="random", prune=True, seed=None, endgame_threshold=None,
+                 opening_book=None, playouts=1, endgame_cache_mb=DEFAULT_CACHE_MB):
+        """
+        :param iterations: playouts per move, when there is no time_limit
+        :param time_limit: seconds per move
+        :param exploration: the exploration constant of UCT
+        :param prune: when a node has moves that complete an sos, only those are added to the
+        tree, and otherwise moves that let the opponent complete an sos are added only if
+        there are no other moves. this keeps the tree narrow on big boards
+        :param rollout: "random" plays random moves in the playouts, "block" completes an sos
+        when it can and otherwise tries to play a move that gives the opponent no sos to
+        complete, like block_evaluation_function prefers
+        :param seed: a seed of the agent's own random generator, otherwise the random module
+        is used
+        :param endgame_threshold: with this many empty cells or fewer, the move is found by
+        the exact endgame solver (see endgame.solve_endgame) instead
+        :param opening_book: an opening_book.OpeningBook, or the path of one, whose moves
+        are played without searching
+        :param playouts: playouts per iteration. with more than one, they are played all at
+        once by lockstep.BatchGames, with random moves, or for the block rollout greedy
+        ones (the moves that complete the most sos's), and their mean reward is backed up
+        :param endgame_cache_mb: the memory of the endgame solver's cache, in MB
+        """
+        super().__init__()
+        if rollout not in ("random", "block"):
+            raise ValueError(f"unknown rollout {rollout!r}")
+        self.iterations = iterations
+        self.time_limit = time_limit
+        self.exploration = exploration
+        self.rollout = rollout
+        self.prune = prune
+        self.endgame_threshold = endgame_threshold
+        self.endgame_cache_mb = endgame_cache_mb
+        self.opening_book = open_book(opening_book) if isinstance(opening_book, str) \
+            else opening_book
+        self.playouts = playouts
+        self._random = random if seed is None else random.Random(seed)
+        # the moves a block rollout tries before it gives up looking for a safe one
+        self.block_tries = 4
+
+    def get_action(self, game_state):
+        state = game_state
+        if self.opening_book is not None:
+            action = self.opening_book.lookup(state)
+            if action is not None:
+                return action
+        if self.endgame_threshold is not None and \
+                0 < state.threats.empty <= self.endgame_threshold:
+            return solve_endgame(state, self.endgame_cache_mb)[1]
+        root = MCTSNode(None, None, MAX_AGENT, self._untried_moves(state))
+        if not root.untried:
+            return None
+        mark = state.num_applied
+        deadline = None if self.time_limit is None else time.perf_counter() + self.time_limit
+        iteration = 0
+        while True:
+            if deadline is None:
+                if iteration >= self.iterations:
+                    break
+            elif iteration > 0 and time.perf_counter() > deadline:
+                break
+            iteration += 1
+            node = root
+            while not node.untried and node.children:
+                node = self._select(node)
+                state.apply_action(node.move, node.parent.player)
+            if node.untried:
+                node = self._expand(state, node) or node
+            if self.playouts > 1:
+                reward = self._batch_playout(state, node.player)
+            else:
+                reward = self._playout(state, node.player)
+            while state.num_applied > mark:
+                state.undo_action()
+            while node.parent is not None:
+                node.visits += 1
+                node.value += reward if node.parent.player == MAX_AGENT else 1 - reward
+                node = node.parent
+            root.visits += 1
+        return max(root.children, key=lambda child: child.visits).move
+
+    def _untried_moves(self, state):
+        """
+        the moves of a state in random order, to be popped from the end. with prune, only
+        the moves that complete an sos if there are any
+        """
+        cells = state.table_size ** 2
+        threats = state.threats
+        moves = list(threats.moves("cell"))
+        if self.prune and threats.open_threats:
+            gains = threats.gains
+            moves = [move for move in moves if gains[move // cells][move % cells]]
+        self._random.shuffle(moves)
+        return moves
+
+    def _expand(self, state, node):
+        """
+        adds a child of an untried move to a node and makes the move on the state. with
+        prune, moves that let the opponent complete an sos are put aside while there may
+        be others
+        :return: the child, or None if every untried move was put aside
+        """
+        while node.untried:
+            move = node.untried.pop()
+            gained = state.apply_action(move, node.player)
+            if self.prune and node.unsafe is not None and not gained and \
+                    state.threats.open_threats:
+                state.undo_action()
+                node.unsafe.append(move)
+                if not node.untried and not node.children:
+                    node.untried, node.unsafe = node.unsafe, None
+                continue
+            player = node.player if gained else 1 - node.player
+            child = MCTSNode(move, node, player, self._untried_moves(state))
+            node.children.append(child)
+            return child
+        return None
+
+    def _select(self, node):
+        """the child of a fully expanded node with the best UCT score"""
+        log_visits = math.log(node.visits)
+        exploration = self.exploration
+        best, best_score = None, float("-inf")
+        for child in node.children:
+            score = child.value / child.visits + \
+                exploration * math.sqrt(log_visits / child.visits)
+            if score > best_score:
+                best, best_score = child, score
+        return best
+
+    def _playout(self, state, player):
+        """
+        plays the game to its end on the state, without taking the moves back
+        :param player: the player to move
+        :return: the reward of the end of the game for MAX_AGENT
+        """
+        cells = state.table_size ** 2
+        rnd = self._random
+        empty = [cell for cell, letter in enumerate(state.threats.letters) if letter == EMPTY]
+        rnd.shuffle(empty)
+        while empty:
+            move = None
+            if self.rollout == "block":
+                move = self._block_move(state, empty, player)
+            if move is None:
+                cell = empty.pop()
+                letter = S_LETTER if rnd.random() < 0.5 else O_LETTER
+                gained = state.apply_action(letter * cells + cell, player)
+            else:
+                gained = move
+            if not gained:
+                player = 1 - player
+        if state.score == state.opponent_score:
+            return 0.5
+        return 1.0 if state.score > state.opponent_score else 0.0
+
+    def _batch_playout(self, state, player):
+        """
+        plays self.playouts games to their end from the state at once, leaving the state as
+        it is
+        :param player: the player to move
+        :return: the mean reward of the games for MAX_AGENT
+        """
+        games = BatchGames.from_state(state, self.playouts, player, self._random.getrandbits(64))
+        policy = "greedy" if self.rollout == "block" else "random"
+        scores = games.play((policy, policy))
+        mine, theirs = scores[:, MAX_AGENT], scores[:, MIN_AGENT]
+        return float(np.mean((mine > theirs) + 0.5 * (mine == theirs)))
+
+    def _block_move(self, state, empty, player):
+        """
+        makes a move of the block rollout: one that completes an sos if there is one,
+        otherwise one of a few random moves that leaves no open triple
+        :param empty: the empty cells, the cell of the move is removed from it
+        :return: the sos's the move completed, or None if no move was made
+        """
+        cells = state.table_size ** 2
+        threats = state.threats
+        gains = threats.gains
+        if threats.open_threats:
+            for i, cell in enumerate(empty):
+                letter = S_LETTER if gains[S_LETTER][cell] else O_LETTER if gains[O_LETTER][cell] else 0
+                if letter:
+                    empty[i] = empty[-1]
+                    empty.pop()
+                    return state.apply_action(letter * cells + cell, player)
+        rnd = self._random
+        for _ in range(self.block_tries):
+            i = rnd.randrange(len(empty))
+            cell = empty[i]
+            letter = S_LETTER if rnd.random() < 0.5 else O_LETTER
+            before = threats.open_threats
+            gained = state.apply_action(letter * cells + cell, player)
+            if threats.open_threats <= before:
+                empty[i] = empty[-1]
+                empty.pop()
+                return gained
+            state.undo_action()
+        return None
@@ -0,0 +1,177 @@
+import random
+import struct
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from game_state import GameState
+from parallel import encode_state, decode_state
+from rules import EMPTY
+from symmetry import canonical_hash, get_symmetries, map_move, unique_actions
+from transposition import position_key
+
+# the first bytes of a book file, followed by the number of positions in it
+MAGIC = b"SOSBOOK1"
+HEADER = struct.Struct("<8sQ")
+
+# after the header, the sorted keys of the positions, then the move of every position
+KEY_DTYPE = np.dtype("<u8")
+MOVE_DTYPE = np.dtype([("table_size", "u1"), ("letter", "u1"), ("cell", "u1"),
+                       ("depth", "u1")])
+
+# the moves of the positions with this many letters or fewer are put in a book by default
+BOOK_PLIES = 2
+
+_books_cache = {}
+
+
+def book_key(state):
+    """
+    the key of a position in a book: the position key (see transposition.position_key) of
+    its canonical board, for the player to move
+    :param state:
+    :return: the key and the index of the symmetry that maps the board to the canonical one
+    """
+    board_key, transform = canonical_hash(state)
+    return position_key(state, 0, board_key), transform
+
+
+class OpeningBook:
+    """
+    a read-only book of opening moves, memory-mapped from a file written by build_book.
+    only the pages a lookup touches are read, and processes that open the same file share
+    them in the page cache, so a book is never loaded whole into memory. a book is pickled
+    as its path and mapped again where it is unpickled
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            magic, count = HEADER.unpack(file.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an opening book")
+        self.count = count
+        if count == 0:
+            self._keys = np.zeros(0, KEY_DTYPE)
+            self._moves = np.zeros(0, MOVE_DTYPE)
+            return
+        self._keys = np.memmap(path, KEY_DTYPE, "r", HEADER.size, (count,))
+        self._moves = np.memmap(path, MOVE_DTYPE, "r", HEADER.size + count * KEY_DTYPE.itemsize,
+                                (count,))
+
+    def __len__(self):
+        return self.count
+
+    def __reduce__(self):
+        return open_book, (self.path,)
+
+    def lookup(self, state):
+        """
+        finds the move of the book for the player to move
+        :param state:
+        :return: a move (see rules.encode_move), or None if the position is not in the book
+        """
+        if self.count == 0:
+            return None
+        key, transform = book_key(state)
+        i = int(np.searchsorted(self._keys, key))
+        if i == self.count or int(self._keys[i]) != key:
+            return None
+        table_size, letter, cell, _ = self._moves[i].tolist()
+        if table_size != state.table_size:
+            return None
+        move = letter * table_size ** 2 + cell
+        if transform != 0:
+            move = map_move(move, get_symmetries(table_size).inverses[transform], table_size)
+        if state.threats.letters[move % table_size ** 2] != EMPTY:
+            return None
+        return move
+
+
+def open_book(path):
+    """
+    returns the book of the given file, mapping it only once per process
+    :param path:
+    :return:
+    """
+    book = _books_cache.get(path)
+    if book is None:
+        book = _books_cache[path] = OpeningBook(path)
+    return book
+
+
+def opening_positions(table_size, plies=BOOK_PLIES):
+    """
+    the positions of the first moves of a game, one of every group of symmetric ones, as
+    the player to move sees them (see parallel.encode_state)
+    :param table_size:
+    :param plies: the most letters a position has
+    :return: a list of states
+    """
+    positions = []
+    frontier = [(GameState(table_size), 0)]
+    for ply in range(plies + 1):
+        positions += [state if player == 0 else decode_state(encode_state(state, player))
+                      for state, player in frontier]
+        if ply == plies:
+            break
+        seen = set()
+        next_frontier = []
+        for state, player in frontier:
+            for action in unique_actions(state, state.get_legal_actions(), player):
+                child = state.generate_successor(action, player)
+                key = book_key(child)[0]
+                if key not in seen:
+                    seen.add(key)
+                    gained = child.score + child.opponent_score > state.score + state.opponent_score
+                    next_frontier.append((child, player if gained else 1 - player))
+        frontier = next_frontier
+    return positions
+
+
+def _search_position(agent_spec, encoded, seed):
+    """searches one position of a book, in a worker process"""
+    random.seed(seed)
+    return agent_spec.build().get_action(decode_state(encoded))
+
+
+def build_book(path, agent_spec, table_sizes=(6, 7, 8, 9), plies=BOOK_PLIES, seed=0,
+               workers=None):
+    """
+    searches the opening positions of every board size with an agent and writes the moves
+    it finds to a book file. mirrored and rotated positions are searched once, since the
+    book is keyed by the canonical board
+    :param path:
+    :param agent_spec: a tournament.AgentSpec of the agent to search with, a deep one
+    :param table_sizes:
+    :param plies: the most letters a position of the book has
+    :param seed: the random module is seeded with it before every search
+    :param workers: the number of processes, None for as many as cores, 0 to search in this
+    process
+    :return: the number of positions in the book
+    """
+    positions = [state for table_size in table_sizes
+                 for state in opening_positions(table_size, plies)]
+    encoded = [encode_state(state) for state in positions]
+    if workers == 0:
+        moves = [_search_position(agent_spec, state, seed) for state in encoded]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            moves = list(executor.map(_search_position, [agent_spec] * len(encoded), encoded,
+                                      [seed] * len(encoded)))
+    depth = agent_spec.depth if isinstance(agent_spec.depth, (int, float)) else 0
+    entries = {}
+    for state, move in zip(positions, moves):
+        if move is None:
+            continue
+        key, transform = book_key(state)
+        table_size = state.table_size
+        letter, cell = divmod(map_move(move, get_symmetries(table_size).perms[transform],
+                                       table_size), table_size ** 2)
+        entries[key] = (table_size, letter, cell, int(depth * 2))
+    keys = np.array(sorted(entries), KEY_DTYPE)
+    moves = np.array([entries[int(key)] for key in keys], MOVE_DTYPE)
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, len(keys)))
+        file.write(keys.tobytes())
+        file.write(moves.tobytes())
+    _books_cache.pop(path, None)
+    return len(keys)
@@ -0,0 +1,133 @@
+import math
+import multiprocessing
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from transposition import TranspositionTable
+
+# how many agent configurations a worker keeps (with their transposition tables)
+MAX_WORKER_AGENTS = 8
+
+_pools = {}
+
+# set in every worker process by _init_worker
+_shared_bound = None
+_worker_agents = {}
+_worker_state = None
+
+
+def _init_worker(shared_bound):
+    global _shared_bound
+    _shared_bound = shared_bound
+
+
+def get_pool(workers):
+    """
+    returns a process pool of the given size with the bound its workers share, starting
+    it only once, so the processes (and what they cache) live from move to move
+    :param workers: the number of processes
+    :return: the executor and the shared bound
+    """
+    pool = _pools.get(workers)
+    if pool is None:
+        shared_bound = multiprocessing.Value("d", float("-inf"))
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                       initargs=(shared_bound,))
+        pool = _pools[workers] = (executor, shared_bound)
+    return pool
+
+
+def shutdown_pools():
+    """stops the processes of every pool"""
+    for executor, _ in _pools.values():
+        executor.shutdown()
+    _pools.clear()
+
+
+def encode_state(state, player=0):
+    """
+    a compact form of a state to send to a worker: its class, its board as bytes (a
+    byte per cell), the scores and whether it is done
+    :param state:
+    :param player: the player the state is for. an agent takes score as its own points,
+    so for player 1 the scores are swapped
+    :return:
+    """
+    board = np.asarray(state.board, dtype=np.int8).tobytes()
+    scores = (state.score, state.opponent_score) if player == 0 else \
+        (state.opponent_score, state.score)
+    return (type(state), state.table_size, board) + scores + (state.done,)
+
+
+def decode_state(encoded):
+    """
+    builds a state from encode_state
+    :param encoded:
+    :return:
+    """
+    state_class, table_size, board, score, opponent_score, done = encoded
+    board = np.frombuffer(board, dtype=np.int8).reshape(table_size, table_size).astype(float)
+    return state_class(table_size, board, score, opponent_score, done)
+
+
+def search_root(agent, game_state, actions):
+    """
+    searches the root actions of an agent in parallel, one task per action, on the pool
+    of agent.workers processes. every worker searches its action with a lower bound just
+    under the best value found so far by any worker, so an action that is worse only gets
+    a bound under the best value, and an action that is as good gets its exact value
+    an agent that can not be pickled, like one with a lambda for a function, is searched
+    in this process instead
+    :param agent: a search agent with a _root_value(state, action, alpha) method
+    :param game_state:
+    :param actions:
+    :return: the value of each action, in order
+    """
+    if not hasattr(agent, "_root_value"):
+        raise TypeError(f"{type(agent).__name__} has no _root_value to search root actions with")
+    table = agent.transposition_table
+    try:
+        spec = pickle.dumps((agent._worker_copy(), None if table is None else table.max_mb))
+    except (pickle.PicklingError, AttributeError, TypeError):
+        return [agent._root_value(game_state, action) for action in actions]
+    executor, shared_bound = get_pool(agent.workers)
+    with shared_bound.get_lock():
+        shared_bound.value = float("-inf")
+    encoded = encode_state(game_state)
+    futures = [executor.submit(_search_action, spec, encoded, int(action))
+               for action in actions]
+    return [future.result() for future in futures]
+
+
+def worker_agent(spec):
+    """
+    the agent of a spec in a worker process, made only once, so its transposition table
+    lives from task to task
+    :param spec: a pickled (agent, transposition table size in mb or None)
+    :return:
+    """
+    agent = _worker_agents.get(spec)
+    if agent is None:
+        agent, table_mb = pickle.loads(spec)
+        if table_mb is not None:
+            agent.transposition_table = TranspositionTable(table_mb)
+        if len(_worker_agents) >= MAX_WORKER_AGENTS:
+            _worker_agents.clear()
+        _worker_agents[spec] = agent
+    return agent
+
+
+def _search_action(spec, encoded, action):
+    """searches one root action in a worker process"""
+    global _worker_state
+    agent = worker_agent(spec)
+    # the searches leave the state as they got it, so the state of the last task is
+    # reused when the next one comes from the same root
+    if _worker_state is None or _worker_state[0] != encoded:
+        _worker_state = (encoded, decode_state(encoded))
+    state = _worker_state[1]
+    value = agent._root_value(state, action, math.nextafter(_shared_bound.value, -math.inf))
+    with _shared_bound.get_lock():
+        if value > _shared_bound.value:
+            _shared_bound.value = value
+    return value
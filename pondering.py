@@ -0,0 +1,141 @@
+import math
+import multiprocessing
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+from parallel import encode_state, decode_state, worker_agent
+
+# fields of the control array the ponder process reads: the generation of the ponder
+# that may run (a ponder stops once it changes), the task of it that was matched by the
+# real move (-1 before then) and until when that task may go on searching
+GENERATION, TARGET, DEADLINE = range(3)
+
+_pool = None
+
+# set in the ponder process by _init_worker
+_control = None
+
+
+def _init_worker(control):
+    global _control
+    _control = control
+
+
+def get_ponder_pool():
+    """
+    returns the process every agent of this process ponders on, with its control array,
+    starting it only once
+    :return:
+    """
+    global _pool
+    if _pool is None:
+        control = multiprocessing.Array("d", [0, -1, -math.inf])
+        executor = ProcessPoolExecutor(max_workers=1, initializer=_init_worker,
+                                       initargs=(control,))
+        _pool = (executor, control)
+    return _pool
+
+
+def shutdown_ponder_pool():
+    """stops the ponder process"""
+    global _pool
+    if _pool is not None:
+        _pool[0].shutdown(cancel_futures=True)
+        _pool = None
+
+
+class Ponder:
+    """
+    the search of the positions the replies of the opponent lead to, on the ponder process,
+    while the opponent thinks. the replies are searched one after the other in the given
+    order, so the predicted one should be first. when the real move comes, the task of the
+    position it led to is kept and every other one is stopped (see result)
+    """
+
+    def __init__(self, agent, game_state, replies, max_depth=None):
+        """
+        :param agent: an AlphaBetaAgent, a copy of it searches the positions
+        :param game_state: the position the opponent is to move in
+        :param replies: moves of the opponent that complete no sos, so the agent moves next
+        :param max_depth: the depth to search every position to, None to search until the
+        agent's time_limit runs out
+        """
+        executor, control = get_ponder_pool()
+        with control.get_lock():
+            control[GENERATION] += 1
+            control[TARGET] = -1
+            control[DEADLINE] = -math.inf
+            self.generation = control[GENERATION]
+        self.control = control
+        copy = agent._worker_copy()
+        copy.time_limit = None
+        table = agent.transposition_table
+        spec = pickle.dumps((copy, None if table is None else table.max_mb))
+        self._tasks = {}
+        for task, reply in enumerate(replies):
+            game_state.apply_action(reply, 1)
+            encoded = encode_state(game_state)
+            game_state.undo_action()
+            future = executor.submit(_ponder_position, spec, encoded, self.generation, task,
+                                     max_depth, agent.time_limit)
+            self._tasks[encoded] = (task, future)
+
+    def result(self, game_state, time_limit=None):
+        """
+        the pondered search of the position the opponent moved to. every other task is
+        stopped. a task that is still searching goes on for time_limit more seconds, so
+        it gets the time it searched on the opponent's turn on top of the agent's own
+        :param game_state: the position the agent is to move in
+        :param time_limit: seconds, or None when the task ends at its max_depth
+        :return: the best move (see rules.encode_move), whether all the moves were worth the
+        same and the depth of the search, or None if the position was not searched
+        """
+        task, future = self._tasks.get(encode_state(game_state), (None, None))
+        if future is None or not (future.running() or future.done()):
+            self.cancel()
+            return None
+        control = self.control
+        with control.get_lock():
+            if control[GENERATION] != self.generation:
+                return None
+            control[TARGET] = task
+            if time_limit is not None:
+                control[DEADLINE] = time.time() + time_limit
+        for _, other in self._tasks.values():
+            if other is not future:
+                other.cancel()
+        result = future.result()
+        self.cancel()
+        return result
+
+    def cancel(self):
+        """stops every task of the ponder"""
+        control = self.control
+        with control.get_lock():
+            if control[GENERATION] == self.generation:
+                control[GENERATION] += 1
+        for _, future in self._tasks.values():
+            future.cancel()
+
+
+def _ponder_position(spec, encoded, generation, task, max_depth, time_limit):
+    """searches one position of a ponder in the ponder process"""
+    control = _control
+    start = time.time()
+
+    def should_stop():
+        if control[GENERATION] != generation or control[TARGET] not in (-1, task):
+            return True
+        return time_limit is not None and time.time() > max(start + time_limit,
+                                                            control[DEADLINE])
+
+    if should_stop():
+        return None
+    agent = worker_agent(spec)
+    agent._should_stop = should_stop
+    try:
+        best_action, max_score, scores = agent._ponder_search(decode_state(encoded), max_depth)
+    finally:
+        agent._should_stop = None
+    move = int(best_action)
+    return move, max_score == min(scores), agent.searched_depth
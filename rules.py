@@ -0,0 +1,118 @@
+S_LETTER = 1
+O_LETTER = 2
+EMPTY = 0
+
+# the four line directions an SOS can be written in: row, column, diagonal, other diagonal
+ROW, COL, DIAG, DIAG2 = range(4)
+DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+_index_cache = {}
+
+
+def encode_move(letter, row, col, table_size):
+    """
+    a (letter, row, col) move as the single int the game states and agents use:
+    letter * table_size ** 2 + the flat cell
+    :param letter:
+    :param row:
+    :param col:
+    :param table_size:
+    :return:
+    """
+    return (int(letter) * table_size + int(row)) * table_size + int(col)
+
+
+def decode_move(move, table_size):
+    """
+    the (letter, row, col) of a move made by encode_move, for the ui and the other places
+    that show or get moves as tuples
+    :param move:
+    :param table_size:
+    :return:
+    """
+    letter, cell = divmod(int(move), table_size * table_size)
+    return letter, cell // table_size, cell % table_size
+
+
+class SosIndex:
+    """
+    every SOS triple of a board of a given size. a cell (row, col) is the flat index
+    row * table_size + col, and a triple is (first, middle, last) where first is the cell
+    the line starts from when going in its direction
+    """
+
+    def __init__(self, table_size):
+        self.table_size = table_size
+        cells = table_size ** 2
+        self.triples = []
+        self.directions = []
+        # for every cell, the ids of the triples it belongs to
+        self.cell_triples = [[] for _ in range(cells)]
+        # for every cell, the (other end, middle) of the triples in which the cell is an S
+        self.s_pairs = [[] for _ in range(cells)]
+        # for every cell, the (first, last) of the triples in which the cell is the O
+        self.o_pairs = [[] for _ in range(cells)]
+        for row in range(table_size):
+            for col in range(table_size):
+                for direction, (d_row, d_col) in enumerate(DIRECTIONS):
+                    end_row, end_col = row + 2 * d_row, col + 2 * d_col
+                    if not (0 <= end_row < table_size and 0 <= end_col < table_size):
+                        continue
+                    first = row * table_size + col
+                    middle = (row + d_row) * table_size + col + d_col
+                    last = end_row * table_size + end_col
+                    triple_id = len(self.triples)
+                    self.triples.append((first, middle, last))
+                    self.directions.append(direction)
+                    for cell in (first, middle, last):
+                        self.cell_triples[cell].append(triple_id)
+                    self.s_pairs[first].append((last, middle))
+                    self.s_pairs[last].append((first, middle))
+                    self.o_pairs[middle].append((first, last))
+
+
+def get_sos_index(table_size):
+    """
+    returns the triple index of the given board size, building it only once per size
+    :param table_size:
+    :return:
+    """
+    index = _index_cache.get(table_size)
+    if index is None:
+        index = _index_cache[table_size] = SosIndex(table_size)
+    return index
+
+
+def count_sos(flat_board, cell, index):
+    """
+    counts the sos's that go through a cell
+    :param flat_board: the letters of the board, indexed by flat cell
+    :param cell: flat index of the cell
+    :param index: the SosIndex of the board size
+    :return:
+    """
+    letter = flat_board[cell]
+    if letter == S_LETTER:
+        return sum(1 for other, middle in index.s_pairs[cell]
+                   if flat_board[other] == S_LETTER and flat_board[middle] == O_LETTER)
+    if letter == O_LETTER:
+        return sum(1 for first, last in index.o_pairs[cell]
+                   if flat_board[first] == S_LETTER and flat_board[last] == S_LETTER)
+    return 0
+
+
+def completed_sos(flat_board, cell, index):
+    """
+    finds the sos's that go through a cell
+    :param flat_board: the letters of the board, indexed by flat cell
+    :param cell: flat index of the cell
+    :param index: the SosIndex of the board size
+    :return: list of (direction, first cell) of every sos found
+    """
+    lines = []
+    for triple_id in index.cell_triples[cell]:
+        first, middle, last = index.triples[triple_id]
+        if flat_board[first] == S_LETTER and flat_board[middle] == O_LETTER \
+                and flat_board[last] == S_LETTER:
+            lines.append((index.directions[triple_id], first))
+    return lines
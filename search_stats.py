@@ -0,0 +1,121 @@
+class SearchStats:
+    """
+    counters of the searches of an agent, for one move or summed over many (see merge).
+    a ply is how many moves a state is from the root, so the root is ply 0
+    """
+
+    def __init__(self):
+        # how many searches (get_action calls) the counters are summed over
+        self.searches = 0
+        # nodes_by_ply[ply]: the states whose actions were searched
+        self.nodes_by_ply = []
+        # the states the evaluation function was called on (or evaluated in a batch)
+        self.leaf_evaluations = 0
+        # cutoffs_by_ply[ply]: the states whose search stopped before their last action
+        self.cutoffs_by_ply = []
+        # cutoff_indexes[i]: the cutoffs made by the i-th action searched (0 is the first)
+        self.cutoff_indexes = []
+        # chain_lengths[k]: the states reached by the k-th extra turn in a row of a player
+        self.chain_lengths = []
+        # (depth, seconds, nodes) of every iteration of the searches
+        self.iterations = []
+        self.seconds = 0.0
+        self.table_hits = 0
+        self.table_misses = 0
+        self._chains = [0]
+        # the nodes counted by the iterations recorded so far
+        self._iteration_nodes = 0
+
+    def expand(self, ply):
+        """counts a state whose actions are searched"""
+        while len(self.nodes_by_ply) <= ply:
+            self.nodes_by_ply.append(0)
+        self.nodes_by_ply[ply] += 1
+
+    def evaluate(self, count=1):
+        """counts states given to the evaluation function"""
+        self.leaf_evaluations += count
+
+    def cutoff(self, ply, index):
+        """counts a cutoff of a state at ply made by its index-th action"""
+        while len(self.cutoffs_by_ply) <= ply:
+            self.cutoffs_by_ply.append(0)
+        self.cutoffs_by_ply[ply] += 1
+        while len(self.cutoff_indexes) <= index:
+            self.cutoff_indexes.append(0)
+        self.cutoff_indexes[index] += 1
+
+    def move(self, ply, gained):
+        """
+        follows the extra turn chains of the search. called when a state at ply is reached
+        :param ply:
+        :param gained: the sos's the move to the state completed, which give an extra turn
+        :return:
+        """
+        chains = self._chains
+        while len(chains) <= ply:
+            chains.append(0)
+        chain = chains[ply - 1] + 1 if gained else 0
+        chains[ply] = chain
+        if chain:
+            while len(self.chain_lengths) <= chain:
+                self.chain_lengths.append(0)
+            self.chain_lengths[chain] += 1
+
+    def iteration(self, depth, seconds):
+        """records a finished search to the given depth and the nodes it searched"""
+        nodes = self.nodes
+        self.iterations.append((depth, seconds, nodes - self._iteration_nodes))
+        self._iteration_nodes = nodes
+
+    @property
+    def nodes(self):
+        """every state searched, the leaves included"""
+        return sum(self.nodes_by_ply) + self.leaf_evaluations
+
+    @property
+    def cutoffs(self):
+        return sum(self.cutoffs_by_ply)
+
+    @property
+    def first_action_cutoff_rate(self):
+        """the part of the cutoffs made by the first action, a measure of the move ordering"""
+        return self.cutoff_indexes[0] / self.cutoffs if self.cutoffs else None
+
+    @property
+    def effective_branching_factor(self):
+        """
+        the branching factor b of a uniform tree as deep as the deepest ply reached with as
+        many nodes as an average search, (nodes / searches) ** (1 / plies)
+        """
+        plies = len(self.nodes_by_ply)
+        if self.searches == 0 or plies == 0:
+            return None
+        return (self.nodes / self.searches) ** (1 / plies)
+
+    def merge(self, other):
+        """adds the counters of other to these"""
+        self.searches += other.searches
+        for name in ("nodes_by_ply", "cutoffs_by_ply", "cutoff_indexes", "chain_lengths"):
+            mine, theirs = getattr(self, name), getattr(other, name)
+            while len(mine) < len(theirs):
+                mine.append(0)
+            for i, count in enumerate(theirs):
+                mine[i] += count
+        self.leaf_evaluations += other.leaf_evaluations
+        self.iterations += other.iterations
+        self.seconds += other.seconds
+        self.table_hits += other.table_hits
+        self.table_misses += other.table_misses
+
+    def as_dict(self):
+        """the counters and the measures made of them, as a dict that can be saved as json"""
+        return {"searches": self.searches, "seconds": self.seconds, "nodes": self.nodes,
+                "nodes_by_ply": list(self.nodes_by_ply), "leaf_evaluations": self.leaf_evaluations,
+                "cutoffs": self.cutoffs, "cutoffs_by_ply": list(self.cutoffs_by_ply),
+                "cutoff_indexes": list(self.cutoff_indexes),
+                "first_action_cutoff_rate": self.first_action_cutoff_rate,
+                "effective_branching_factor": self.effective_branching_factor,
+                "chain_lengths": list(self.chain_lengths),
+                "iterations": [list(iteration) for iteration in self.iterations],
+                "table_hits": self.table_hits, "table_misses": self.table_misses}
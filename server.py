@@ -0,0 +1,414 @@
+import asyncio
+import collections
+import itertools
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from game_state import GameState
+from parallel import encode_state, decode_state
+from rules import S_LETTER, O_LETTER, EMPTY, encode_move, decode_move
+from tournament import AgentSpec, PERCENTILES
+from multi_agents import smart_random_play
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# the longest request line a client may send, in bytes
+MAX_LINE = 2 ** 16
+
+# how many of the last moves the latency percentiles are taken over
+LATENCY_WINDOW = 10000
+
+# set in every worker process, the agents built for the specs seen so far
+_worker_agents = {}
+
+
+def _worker_action(agent_name, encoded, seed):
+    """finds the move of an agent in a worker process"""
+    agent = _worker_agents.get(agent_name)
+    if agent is None:
+        agent = _worker_agents[agent_name] = AgentSpec.parse(agent_name).build()
+    random.seed(seed)
+    return int(agent.get_action(decode_state(encoded)))
+
+
+class Session:
+    """
+    a game held by the server: its state, whose turn it is and who plays each side
+    """
+
+    def __init__(self, game_id, table_size, players):
+        """
+        :param game_id:
+        :param table_size:
+        :param players: the AgentSpec name of each player, None for a human
+        """
+        self.game_id = game_id
+        self.state = GameState(table_size)
+        self.players = players
+        self.player = 0
+        self.moves = 0
+        self.timeouts = 0
+        self.lock = asyncio.Lock()
+        self.last_active = time.monotonic()
+
+    @property
+    def done(self):
+        return bool(self.state.is_done())
+
+    @property
+    def human_turn(self):
+        return not self.done and self.players[self.player] is None
+
+    def check_move(self, move):
+        """
+        checks a move sent by a client
+        :param move: a [letter, row, col] list
+        :return: the move as an int (see rules.encode_move)
+        """
+        try:
+            letter, row, col = (int(x) for x in move)
+        except (TypeError, ValueError):
+            raise ValueError("a move is [letter, row, col]")
+        size = self.state.table_size
+        if letter not in (S_LETTER, O_LETTER):
+            raise ValueError(f"the letter should be {S_LETTER} (S) or {O_LETTER} (O)")
+        if not (0 <= row < size and 0 <= col < size):
+            raise ValueError("the cell is off the board")
+        if self.state.threats.letters[row * size + col] != EMPTY:
+            raise ValueError("the cell is taken")
+        return encode_move(letter, row, col, size)
+
+    def apply(self, move):
+        """plays a move of the player whose turn it is, who moves again if it scored"""
+        if not self.state.apply_action(move, self.player):
+            self.player = 1 - self.player
+        self.moves += 1
+        self.last_active = time.monotonic()
+
+    def as_dict(self):
+        state = self.state
+        return {"game": self.game_id, "size": state.table_size,
+                "board": [int(letter) for letter in state.threats.letters],
+                "scores": [state.score, state.opponent_score], "player": self.player,
+                "players": self.players, "done": self.done, "moves": self.moves}
+
+
+class ServerMetrics:
+    """the throughput and latency of the moves the agents of a server made"""
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.requests = 0
+        self.moves = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.errors = 0
+        # the seconds from asking for a move to having it, queueing included
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def record_move(self, seconds):
+        self.moves += 1
+        self.latencies.append(seconds)
+
+    def as_dict(self):
+        elapsed = time.monotonic() - self.start
+        metrics = {"uptime": elapsed, "requests": self.requests, "moves": self.moves,
+                   "moves_per_sec": self.moves / elapsed if elapsed else 0.0,
+                   "rejected": self.rejected, "timeouts": self.timeouts, "errors": self.errors}
+        for percentile in PERCENTILES:
+            metrics[f"move_p{percentile}"] = \
+                float(np.percentile(self.latencies, percentile)) if self.latencies else None
+        return metrics
+
+
+class GameServer:
+    """
+    an asyncio server of many sos games at once. a client sends one json request per line
+    and gets one json response per line:
+        {"op": "new", "size": 6, "players": [null, "AlphaBetaAgent:combined_heuristic:1"]}
+        {"op": "move", "game": 1, "move": [1, 2, 3]}
+        {"op": "advance", "game": 1}
+        {"op": "state", "game": 1}
+        {"op": "close", "game": 1}
+        {"op": "metrics"}
+    a player is an AgentSpec name, or null for a human who moves with "move". after a
+    move, and on "advance", the agents play until it is a human's turn or the game ends.
+    the agents run on a bounded process pool. when max_pending moves are already waiting
+    for it, requests that need an agent are rejected with "busy" instead of queueing, so
+    the latency of the accepted ones stays bounded. a move that takes longer than
+    move_timeout is replaced by a quick safe move, though its worker finishes it
+    """
+
+    def __init__(self, workers=None, max_sessions=10000, max_pending=None, move_timeout=5.0,
+                 idle_timeout=600.0, seed=0):
+        """
+        :param workers: the number of processes of the agents, None for as many as cores
+        :param max_sessions: the most games held at once
+        :param max_pending: the most agent moves queued or running at once, 4 per worker
+        by default
+        :param move_timeout: seconds an agent has for a move
+        :param idle_timeout: seconds after which a game nobody touched is dropped
+        :param seed: the agents are seeded from it, move by move
+        """
+        workers = workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.max_sessions = max_sessions
+        self.max_pending = max_pending if max_pending is not None else 4 * workers
+        self.move_timeout = move_timeout
+        self.idle_timeout = idle_timeout
+        self.seed = seed
+        self.sessions = {}
+        self.metrics = ServerMetrics()
+        self._pending = 0
+        self._ids = itertools.count(1)
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        """starts listening, the returned asyncio server serves until it is closed"""
+        return await asyncio.start_server(self.handle_connection, host, port, limit=MAX_LINE)
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+    async def handle_connection(self, reader, writer):
+        """
+        answers the requests of one client in order. the next request is only read once
+        the last one is answered, so a client can not pile up work
+        """
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, asyncio.LimitOverrunError):
+                    break
+                if not line:
+                    break
+                response = await self.handle(line)
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle(self, line):
+        """
+        answers one request
+        :param line: the json of the request
+        :return: the response, with "ok" false and an "error" if it failed
+        """
+        self.metrics.requests += 1
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("a request is a json object")
+            op = request.get("op")
+            handler = getattr(self, f"_op_{op}", None) if isinstance(op, str) else None
+            if handler is None:
+                raise ValueError(f"unknown op {op!r}")
+            response = await handler(request)
+        except (ValueError, KeyError, TypeError) as e:
+            self.metrics.errors += 1
+            return {"ok": False, "error": str(e)}
+        response["ok"] = response.get("ok", True)
+        return response
+
+    def _session(self, request):
+        session = self.sessions.get(request.get("game"))
+        if session is None:
+            raise ValueError(f"no game {request.get('game')!r}")
+        return session
+
+    def _drop_idle(self):
+        """drops the games nobody touched for idle_timeout seconds"""
+        now = time.monotonic()
+        for game_id in [game_id for game_id, session in self.sessions.items()
+                        if now - session.last_active > self.idle_timeout]:
+            del self.sessions[game_id]
+
+    async def _op_new(self, request):
+        if len(self.sessions) >= self.max_sessions:
+            self._drop_idle()
+            if len(self.sessions) >= self.max_sessions:
+                self.metrics.rejected += 1
+                return {"ok": False, "error": "busy"}
+        size = int(request.get("size", 6))
+        if not 3 <= size <= 20:
+            raise ValueError("the size should be 3 to 20")
+        players = list(request.get("players", [None, "AlphaBetaAgent:combined_heuristic:1"]))
+        if len(players) != 2:
+            raise ValueError("a game has two players")
+        for name in players:
+            if name is not None:
+                if not isinstance(name, str):
+                    raise ValueError(f"a player is an agent name or null, not {name!r}")
+                AgentSpec.parse(name)
+        session = Session(next(self._ids), size, players)
+        self.sessions[session.game_id] = session
+        return session.as_dict()
+
+    async def _op_move(self, request):
+        session = self._session(request)
+        async with session.lock:
+            if not session.human_turn:
+                raise ValueError("it is not a human's turn")
+            session.apply(session.check_move(request["move"]))
+            return await self._advance(session)
+
+    async def _op_advance(self, request):
+        session = self._session(request)
+        async with session.lock:
+            return await self._advance(session)
+
+    async def _op_state(self, request):
+        return self._session(request).as_dict()
+
+    async def _op_close(self, request):
+        session = self.sessions.pop(request.get("game"), None)
+        return {"closed": session is not None}
+
+    async def _op_metrics(self, request):
+        metrics = self.metrics.as_dict()
+        metrics.update(sessions=len(self.sessions), pending=self._pending,
+                       max_pending=self.max_pending)
+        return metrics
+
+    async def _advance(self, session):
+        """
+        plays the agents' moves until it is a human's turn or the game ends
+        :return: the state of the game and the moves the agents played
+        """
+        played = []
+        while not session.done and not session.human_turn:
+            if self._pending >= self.max_pending:
+                self.metrics.rejected += 1
+                response = session.as_dict()
+                response.update(ok=False, error="busy", played=played)
+                return response
+            move = await self._agent_move(session)
+            session.apply(move)
+            played.append(decode_move(move, session.state.table_size))
+        response = session.as_dict()
+        response["played"] = played
+        return response
+
+    def _move_done(self, loop):
+        """called by the pool once a move's work is over, on a thread of its own"""
+        try:
+            loop.call_soon_threadsafe(self._release)
+        except RuntimeError:
+            # the loop is already closed, nothing waits on the count anymore
+            pass
+
+    def _release(self):
+        self._pending -= 1
+
+    async def _agent_move(self, session):
+        """the move of the agent whose turn it is, from the process pool"""
+        state = session.state
+        seed = self.seed * 1000003 + session.game_id * 1009 + session.moves
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        # a move that timed out keeps its worker busy until it finishes, so it stays
+        # pending until then rather than until it is given up on
+        work = self.executor.submit(_worker_action, session.players[session.player],
+                                    encode_state(state, session.player), seed)
+        self._pending += 1
+        work.add_done_callback(lambda _: self._move_done(loop))
+        try:
+            move = await asyncio.wait_for(asyncio.wrap_future(work), self.move_timeout)
+        except asyncio.TimeoutError:
+            self.metrics.timeouts += 1
+            session.timeouts += 1
+            move = smart_random_play(state)
+            if move is None:
+                actions = state.get_legal_actions()
+                move = actions[random.Random(seed).randrange(len(actions))]
+            move = int(move)
+        self.metrics.record_move(time.perf_counter() - start)
+        return move
+
+
+async def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, **kwargs):
+    """
+    runs a GameServer until it is cancelled
+    :param kwargs: the arguments of GameServer
+    :return:
+    """
+    game_server = GameServer(**kwargs)
+    server = await game_server.start(host, port)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        game_server.close()
+
+
+async def _request(reader, writer, request):
+    writer.write(json.dumps(request).encode() + b"\n")
+    await writer.drain()
+    return json.loads(await reader.readline())
+
+
+async def _client_game(host, port, size, agent, rnd):
+    """
+    plays one game as a human making random moves against an agent
+    :return: how many requests were rejected as busy
+    """
+    reader, writer = await asyncio.open_connection(host, port, limit=MAX_LINE)
+    busy = 0
+    try:
+        response = await _request(reader, writer, {"op": "new", "size": size,
+                                                   "players": [None, agent]})
+        while not response["ok"] and response.get("error") == "busy":
+            busy += 1
+            await asyncio.sleep(0.05)
+            response = await _request(reader, writer, {"op": "new", "size": size,
+                                                       "players": [None, agent]})
+        game_id = response["game"]
+        while not response["done"]:
+            if not response["ok"]:
+                busy += 1
+                await asyncio.sleep(0.05)
+                response = await _request(reader, writer, {"op": "advance", "game": game_id})
+                continue
+            empty = [cell for cell, letter in enumerate(response["board"]) if letter == EMPTY]
+            cell = rnd.choice(empty)
+            move = [rnd.choice((S_LETTER, O_LETTER)), cell // size, cell % size]
+            response = await _request(reader, writer, {"op": "move", "game": game_id,
+                                                       "move": move})
+        await _request(reader, writer, {"op": "close", "game": game_id})
+    finally:
+        writer.close()
+    return busy
+
+
+async def load_test(host=DEFAULT_HOST, port=DEFAULT_PORT, games=100, concurrency=100, size=6,
+                    agent="AlphaBetaAgent:combined_heuristic:1", seed=0):
+    """
+    plays many games against a running server at once, as clients that move at random
+    :param games: how many games to play
+    :param concurrency: how many of them are played at the same time
+    :return: the metrics of the server after the games, with the seconds they took and
+    the busy responses the clients got
+    """
+    limit = asyncio.Semaphore(concurrency)
+    rnd = random.Random(seed)
+
+    async def play():
+        async with limit:
+            return await _client_game(host, port, size, agent, random.Random(rnd.random()))
+
+    start = time.perf_counter()
+    busy = await asyncio.gather(*(play() for _ in range(games)))
+    seconds = time.perf_counter() - start
+    reader, writer = await asyncio.open_connection(host, port, limit=MAX_LINE)
+    try:
+        metrics = await _request(reader, writer, {"op": "metrics"})
+    finally:
+        writer.close()
+    metrics.update(games=games, seconds=seconds, client_busy=sum(busy))
+    return metrics
@@ -1,8 +1,18 @@
+import argparse
+import asyncio
+import json
+import sys
 import time
 
 from game import *
-from graphics import *
 from multi_agents import *
+from bitboard import BitboardGameState
+from transposition import TranspositionTable
+from tournament import AgentSpec, play_game, play_tournament, print_summary
+import benchmark
+import opening_book
+import server
+import lockstep
 
 DEFAULT_SIZE = 6
 
@@ -15,12 +25,16 @@ class Sos:
     def __init__(self, agent, opponent, is_graphic=True, board_size=DEFAULT_SIZE):
         self.is_graphic = is_graphic
         self.board_size = board_size
-        self.graphics = Graphics(self)
+        self.graphics = None
         self.agent = agent
         self.opponent = opponent
         self.state = None
         self.game_type = -1
         if is_graphic:
+            # tkinter is only loaded for the ui, so games without ui run on machines with
+            # no display and start faster
+            from graphics import Graphics
+            self.graphics = Graphics(self)
             self.menu()
 
     def set_agent(self, agent):
@@ -64,55 +78,226 @@ class Sos:
         game = Game(self.board_size)
         self.game_type = 2
         self.state = GameState(self.board_size)
+        # the game as the opponent sees it: an agent takes score as its own points and
+        # moves as MAX_AGENT, so the moves of the players are swapped in it
+        opponent_state = GameState(self.board_size)
         if self.is_graphic:
             self.graphics.game_screen(game, True)
         while not game.done():
-            agent = self.agent if game.player == MAX_AGENT else self.opponent
-            action = agent.get_action(self.state)
-            self.state = self.state.generate_successor(action, game.player)
+            player = game.player
+            agent = self.agent if player == MAX_AGENT else self.opponent
+            action = agent.get_action(self.state if player == MAX_AGENT else opponent_state)
+            state = self.state.generate_successor(action, player)
+            gained = state.score + state.opponent_score > \
+                self.state.score + self.state.opponent_score
+            self.state = state
+            opponent_state = opponent_state.generate_successor(action, 1 - player)
+            if not gained and not state.is_done():
+                # the agent thinks on the opponent's turn
+                agent.ponder(self.state if player == MAX_AGENT else opponent_state)
             if self.is_graphic:
-                self.graphics.choose_tile(action[0], action[1], action[2])
+                self.graphics.choose_tile(*decode_move(action, self.board_size))
                 time.sleep(sleep_sec)
             else:
                 game.make_turn(action)
             if game.done():
                 break
+        self.agent.stop_running()
+        self.opponent.stop_running()
         return game.score
 
 
-def test_agents(heuristic, num_of_runs=30, depth=2, board_size=6):
+def test_agents(heuristic, num_of_runs=30, depth=2, board_size=6, workers=None, seed=0,
+                results_file=None):
     """
-    runs several games without ui and prints some statistics about them
+    plays several games without ui of an ExpectimaxAgent with the heuristic against a
+    MinmaxAgent, on a pool of processes (see tournament.play_tournament), and prints some
+    statistics about them
     :param heuristic:
     :param num_of_runs:
     :param depth:
     :param board_size:
+    :param workers: the number of processes, None for as many as cores
+    :param seed: the seed of the games, the same seed plays the same games
+    :param results_file: a path to write every game to as a json line
+    :return: the summaries of the games
+    """
+    agent = AgentSpec(ExpectimaxAgent, heuristic, depth)
+    opponent = AgentSpec(MinmaxAgent, opponent_score_function, 0.5)
+    out = None if results_file is None else open(results_file, "w")
+    try:
+        results, summaries = play_tournament(agent, opponent, (board_size,), num_of_runs, seed,
+                                             workers, out)
+    finally:
+        if out is not None:
+            out.close()
+    for result in results:
+        print(f"Game {result['game'] + 1}: AI: {result['scores'][0]}, "
+              f"Opponent: {result['scores'][1]} | seed: {result['seed']}")
+    print_summary(summaries)
+    return summaries
+
+
+def count_all_sos(board):
+    """
+    counts every sos on the board by sliding over it, without using the sos index
+    :param board:
+    :return:
+    """
+    s_cells, o_cells = board == S_LETTER, board == O_LETTER
+    count = np.sum(s_cells[:, :-2] & o_cells[:, 1:-1] & s_cells[:, 2:])
+    count += np.sum(s_cells[:-2, :] & o_cells[1:-1, :] & s_cells[2:, :])
+    count += np.sum(s_cells[:-2, :-2] & o_cells[1:-1, 1:-1] & s_cells[2:, 2:])
+    count += np.sum(s_cells[:-2, 2:] & o_cells[1:-1, 1:-1] & s_cells[2:, :-2])
+    return int(count)
+
+
+def test_scoring(num_of_runs=100, board_size=DEFAULT_SIZE):
+    """
+    plays random games through Game (the path the ui scores with), GameState and
+    BitboardGameState, and checks after every move that all of them agree with
+    each other and with a full recount of the board
+    :param num_of_runs:
+    :param board_size:
     :return:
     """
-    ai_wins, ai_average, opponent_average, avg_time = 0, 0, 0, 0
-    ai_ties = 0
     for i in range(1, num_of_runs + 1):
-        start = time.time()
-        agent = ExpectimaxAgent(heuristic, depth)
-        opponent = MinmaxAgent(opponent_score_function, 0.5)
-        sos = Sos(agent, opponent, False, board_size)
-        scores = sos.ai_loop()
-        ai_score, opponent_score = scores[0], scores[1]
-        ai_average += ai_score
-        opponent_average += opponent_score
-        if ai_score > opponent_score:
-            ai_wins += 1
-        if ai_score == opponent_score:
-            ai_ties += 1
-        end = time.time()
-        total = end - start
-        avg_time += total
-        print(f"Game {i}: AI: {ai_score}, Opponent: {opponent_score} | time: {total}")
-    print(f"AI Victories: {ai_wins}")
-    print(f"AI ties: {ai_ties}")
-    print(f"Average of SOS: {ai_average / num_of_runs}")
-    print(f"Opponent average of SOS: {opponent_average / num_of_runs}")
-    print(f"Average Time: {avg_time / num_of_runs}")
+        game = Game(board_size)
+        state = GameState(board_size)
+        bit_state = BitboardGameState(board_size)
+        while not game.done():
+            actions = state.get_legal_actions()
+            action = actions[random.randint(0, len(actions) - 1)]
+            state.apply_action(action, game.player)
+            bit_state.apply_action(action, game.player)
+            game.make_turn(action)
+            scores = [game.score, [state.score, state.opponent_score],
+                      [bit_state.score, bit_state.opponent_score]]
+            assert scores[0] == scores[1] == scores[2], f"Game {i}: scores differ {scores}"
+            assert sum(game.score) == count_all_sos(game.board.board), \
+                f"Game {i}: {sum(game.score)} sos's scored but {count_all_sos(game.board.board)} on board"
+    print(f"All {num_of_runs} games of size {board_size} scored the same")
+
+
+def test_pruning(num_of_positions=6, board_size=4, depth=2, filled=6, seed=0):
+    """
+    searches random positions with ExpectimaxAgent of every heuristic, with and without
+    pruning, checks that both play the same move and find the same value for every root
+    action that is not worse than the best one (the pruned search only bounds the worse
+    ones from above), and prints how many nodes each searched
+    :param num_of_positions:
+    :param board_size:
+    :param depth:
+    :param filled: how many cells of each position have a letter
+    :param seed: the positions are benchmark.random_position(board_size, filled, seed + i)
+    :return: the nodes of every heuristic, without and with pruning
+    """
+    heuristics = [good_minus_bad_evaluation_function, score_evaluation_function,
+                  opponent_score_function, min_score_evaluation_function,
+                  block_evaluation_function, combined_heuristic]
+    counts = {}
+    for heuristic in heuristics:
+        nodes = [0, 0]
+        for i in range(num_of_positions):
+            state = benchmark.random_position(board_size, filled, seed + i)
+            agents = [ExpectimaxAgent(heuristic, depth, pruning=pruning, collect_stats=True)
+                      for pruning in (None, "star1")]
+            moves = []
+            for k, agent in enumerate(agents):
+                random.seed(seed + i)
+                moves.append(agent.get_action(state))
+                nodes[k] += agent.stats.nodes
+            assert moves[0] == moves[1], \
+                f"{heuristic.__name__}, position {i}: moves differ {moves}"
+            actions = agents[0]._root_actions(state, state.get_legal_actions())
+            exact = agents[0]._search_root_values(state, actions)
+            pruned = agents[1]._pruned_root_values(state, actions)
+            best = max(exact)
+            for action, value, bound in zip(actions, exact, pruned):
+                assert bound == value if value == best else value <= bound < best, \
+                    f"{heuristic.__name__}, position {i}: action {action} is worth {value} " \
+                    f"but was searched as {bound}"
+        counts[heuristic.__name__] = nodes
+        print(f"{heuristic.__name__}: {nodes[0]} nodes without pruning, {nodes[1]} with "
+              f"({nodes[0] / nodes[1]:.1f}x fewer)")
+    print(f"All {num_of_positions} positions of size {board_size} searched the same")
+    return counts
+
+
+def test_shared_table(num_of_positions=30, board_size=4, depth=1.5, filled=6, seed=0):
+    """
+    searches random positions with MinmaxAgent and AlphaBetaAgent sharing one transposition
+    table, each after the other has filled it, and checks that the move of the second is
+    as good as the best move of a search without a table
+    :param num_of_positions:
+    :param board_size:
+    :param depth:
+    :param filled: how many cells of each position have a letter
+    :param seed: the positions are benchmark.random_position(board_size, filled, seed + i)
+    :return:
+    """
+    heuristic = good_minus_bad_evaluation_function
+    for i in range(num_of_positions):
+        state = benchmark.random_position(board_size, filled, seed + i)
+        reference = MinmaxAgent(heuristic, depth)
+        best = max(reference._root_value(state, action)
+                   for action in state.get_legal_actions())
+        for first_class, second_class in ((MinmaxAgent, AlphaBetaAgent),
+                                          (AlphaBetaAgent, MinmaxAgent)):
+            table = TranspositionTable()
+            first_class(heuristic, depth, transposition_table=table).get_action(state)
+            action = second_class(heuristic, depth, transposition_table=table).get_action(state)
+            value = reference._root_value(state, action)
+            assert value == best, \
+                f"position {i}: {second_class.__name__} after {first_class.__name__} played " \
+                f"{action} worth {value}, the best move is worth {best}"
+    print(f"All {num_of_positions} positions of size {board_size} played the best move with a "
+          f"shared table")
+
+
+class _SeatCheckAgent(MCTSAgent):
+    """an MCTSAgent that checks it is given its own points as score (see test_seats)"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # the sos's the agent completed so far
+        self.points = 0
+
+    def get_action(self, game_state):
+        made = count_all_sos(game_state.board)
+        assert (game_state.score, game_state.opponent_score) == (self.points, made - self.points), \
+            f"given scores {game_state.score}, {game_state.opponent_score} but made " \
+            f"{self.points} of {made}"
+        action = super().get_action(game_state)
+        letter, cell = divmod(action, game_state.table_size ** 2)
+        self.points += game_state.threats.gains[letter][cell]
+        return action
+
+
+def test_seats(num_of_games=10, board_size=5, iterations=200):
+    """
+    plays MCTSAgent in both seats of tournament.play_game against AlphaBetaAgent, checks
+    that every state it is given has its own points as score and the opponent's as
+    opponent_score, and prints how it did in each seat
+    :param num_of_games: games per seat
+    :param board_size:
+    :param iterations: playouts per move of MCTSAgent
+    :return: the mean margin of MCTSAgent in each seat
+    """
+    agent = AgentSpec(_SeatCheckAgent, iterations=iterations)
+    opponent = AgentSpec(AlphaBetaAgent, good_minus_bad_evaluation_function, 1)
+    margins = []
+    for seat in (0, 1):
+        results = []
+        for game in range(num_of_games):
+            players = (agent, opponent) if seat == 0 else (opponent, agent)
+            scores, _ = play_game(*players, board_size, game)
+            results.append(scores[seat] - scores[1 - seat])
+        margins.append(sum(results) / num_of_games)
+        print(f"seat {seat}: {sum(r > 0 for r in results)} wins, {sum(r == 0 for r in results)} "
+              f"ties, {sum(r < 0 for r in results)} losses, mean margin {margins[-1]:.2f}")
+    print(f"All {2 * num_of_games} games of size {board_size} gave MCTSAgent its own scores")
+    return margins
 
 
 def run_ui():
@@ -125,6 +310,236 @@ def run_ui():
     Sos(agent, opponent, True)
 
 
+def _depth(text):
+    """a search depth, an int when it is whole so it is named the same way as in code"""
+    depth = float(text)
+    return int(depth) if depth.is_integer() else depth
+
+
+def _state_class(args):
+    return BitboardGameState if args.bitboard else GameState
+
+
+def _play_command(args):
+    """plays one game without ui and prints its scores and move times"""
+    agent, opponent = AgentSpec.parse(args.agent), AgentSpec.parse(args.opponent)
+    scores, move_times = play_game(agent, opponent, args.size, args.seed, _state_class(args))
+    print(f"{agent.name}: {scores[0]}, {opponent.name}: {scores[1]}")
+    for name, times in zip((agent.name, opponent.name), move_times):
+        if times:
+            print(f"{name}: {len(times)} moves, average move time "
+                  f"{sum(times) / len(times) * 1000:.1f}ms")
+
+
+def _format_seconds(seconds):
+    if seconds >= 1:
+        return f"{seconds:.2f}s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f}ms"
+    return f"{seconds * 1e6:.2f}us"
+
+
+def _bench_command(args):
+    """
+    times get_action of one agent on random positions, or runs the benchmark suite and
+    saves it or compares it with a saved one
+    """
+    if args.agent is not None:
+        result = benchmark.bench_agent(AgentSpec.parse(args.agent), args.size, args.positions,
+                                       args.filled, args.seed, _state_class(args))
+        latencies = ", ".join(f"p{p} {result[f'p{p}'] * 1000:.1f}ms"
+                              for p in benchmark.PERCENTILES)
+        print(f"{result['agent']}: mean {result['mean'] * 1000:.1f}ms, {latencies}")
+        return 0
+    suite = benchmark.run_suite(args.sizes, args.depths, args.agents, args.seed, args.min_time,
+                                args.positions, args.max_move_time, not args.no_memory)
+    for result in suite["results"]:
+        if result.get("skipped"):
+            print(f"{result['name']}: skipped, too slow")
+        else:
+            extra = "".join(f", {key} {result[key]:.0f}" for key in
+                            ("per_sec", "nodes_per_sec", "peak_memory") if result.get(key))
+            print(f"{result['name']}: {_format_seconds(result['time'])}{extra}")
+    if args.out is not None:
+        benchmark.save_results(suite, args.out)
+    if args.compare is None:
+        return 0
+    rows, regressions = benchmark.compare(suite, benchmark.load_results(args.compare),
+                                          args.threshold)
+    print(f"compared {len(rows)} benchmarks with {args.compare}")
+    for name, old_time, new_time, ratio in regressions:
+        print(f"REGRESSION {name}: {_format_seconds(old_time)} -> {_format_seconds(new_time)} "
+              f"({ratio - 1:+.0%})")
+    return 1 if regressions else 0
+
+
+def _tournament_command(args):
+    """plays a tournament without ui and prints its summary"""
+    out = sys.stdout if args.out == "-" else None if args.out is None else open(args.out, "w")
+    try:
+        _, summaries = play_tournament(AgentSpec.parse(args.agent), AgentSpec.parse(args.opponent),
+                                       args.sizes, args.games, args.seed, args.workers, out,
+                                       _state_class(args))
+    finally:
+        if out is not None and out is not sys.stdout:
+            out.close()
+    print_summary(summaries, sys.stderr if args.out == "-" else sys.stdout)
+
+
+def _book_command(args):
+    """searches the opening positions and writes them to a book file"""
+    agent = AgentSpec.parse(args.agent)
+    count = opening_book.build_book(args.out, agent, args.sizes, args.plies, args.seed,
+                                    args.workers)
+    print(f"{count} positions searched by {agent.name} written to {args.out}")
+
+
+def _serve_command(args):
+    """runs the game server until it is interrupted"""
+    print(f"serving sos games on {args.host}:{args.port}")
+    try:
+        asyncio.run(server.serve(args.host, args.port, workers=args.workers,
+                                 max_sessions=args.max_sessions, max_pending=args.max_pending,
+                                 move_timeout=args.move_timeout, seed=args.seed))
+    except KeyboardInterrupt:
+        pass
+
+
+def _load_test_command(args):
+    """plays games against a running server and prints its metrics"""
+    metrics = asyncio.run(server.load_test(args.host, args.port, args.games, args.concurrency,
+                                           args.size, args.agent, args.seed))
+    print(json.dumps(metrics, indent=1))
+
+
+def _simulate_command(args):
+    """plays many games in lockstep and prints how they ended, or saves their positions"""
+    policies = (args.policy, args.opponent_policy)
+    start = time.perf_counter()
+    if args.dataset is not None:
+        boards, players, scores, margins = lockstep.generate_dataset(args.games, args.size,
+                                                                     policies, args.seed)
+        np.savez_compressed(args.dataset, boards=boards, players=players, scores=scores,
+                            margins=margins)
+        print(f"{len(boards)} positions of {args.games} games saved to {args.dataset}")
+        return
+    scores = lockstep.simulate(args.games, args.size, policies, args.seed)
+    seconds = time.perf_counter() - start
+    margins = scores[:, 0] - scores[:, 1]
+    print(f"{args.games} games of {args.policy} against {args.opponent_policy} on "
+          f"{args.size}x{args.size} in {seconds:.2f}s, "
+          f"{args.games * args.size ** 2 / seconds:,.0f} moves per second")
+    print(f"  wins: {np.mean(margins > 0):.1%}, ties: {np.mean(margins == 0):.1%}, "
+          f"losses: {np.mean(margins < 0):.1%}")
+    print(f"  Average of SOS: {scores[:, 0].mean():.2f}, opponent: {scores[:, 1].mean():.2f}, "
+          f"margin: {margins.mean():.2f} +- {margins.std():.2f}")
+
+
+def main(argv=None):
+    """
+    the command line of the game. with no command it runs the ui, the other commands run
+    without ui and never load tkinter. agents are given as
+    tournament.AgentSpec names, like AlphaBetaAgent:combined_heuristic:2
+    :param argv: the arguments, sys.argv[1:] if None
+    :return:
+    """
+    parser = argparse.ArgumentParser(prog="sos.py", description="SOS game and search agents")
+    commands = parser.add_subparsers(dest="command")
+
+    play = commands.add_parser("play", help="play one game without ui")
+    play.add_argument("--agent", default="AlphaBetaAgent:combined_heuristic:1")
+    play.add_argument("--opponent", default="RandomAgent")
+    play.add_argument("--size", type=int, default=DEFAULT_SIZE)
+    play.add_argument("--seed", type=int, default=0)
+    play.set_defaults(run=_play_command)
+
+    bench = commands.add_parser("bench", help="run the benchmark suite, or time one agent")
+    bench.add_argument("--agent", default=None, help="time only this agent")
+    bench.add_argument("--size", type=int, default=DEFAULT_SIZE, help="board size of --agent")
+    bench.add_argument("--filled", type=int, default=8, help="letters on the --agent positions")
+    bench.add_argument("--positions", type=int, default=3, help="positions per agent benchmark")
+    bench.add_argument("--seed", type=int, default=0)
+    bench.add_argument("--sizes", type=int, nargs="+", default=list(benchmark.SIZES))
+    bench.add_argument("--depths", type=_depth, nargs="+", default=list(benchmark.DEPTHS))
+    bench.add_argument("--agents", nargs="+", default=list(benchmark.AGENTS))
+    bench.add_argument("--min-time", type=float, default=0.1,
+                       help="seconds to repeat every state and heuristic benchmark for")
+    bench.add_argument("--max-move-time", type=float, default=10.0,
+                       help="skip bigger boards and deeper searches of an agent slower than this")
+    bench.add_argument("--no-memory", action="store_true", help="do not measure peak memory")
+    bench.add_argument("--out", default=None, help="a file to save the results to as json")
+    bench.add_argument("--compare", default=None, help="a saved json to compare the results with")
+    bench.add_argument("--threshold", type=float, default=benchmark.REGRESSION_THRESHOLD,
+                       help="how much slower is a regression, 0.1 for 10%%")
+    bench.set_defaults(run=_bench_command)
+
+    tournament = commands.add_parser("tournament", help="play many games on a process pool")
+    tournament.add_argument("--agent", default="ExpectimaxAgent:score_evaluation_function:1")
+    tournament.add_argument("--opponent", default="MinmaxAgent:opponent_score_function:0.5")
+    tournament.add_argument("--sizes", type=int, nargs="+", default=[DEFAULT_SIZE])
+    tournament.add_argument("--games", type=int, default=30, help="games per board size")
+    tournament.add_argument("--seed", type=int, default=0)
+    tournament.add_argument("--workers", type=int, default=None,
+                            help="processes, as many as cores by default, 0 for none")
+    tournament.add_argument("--out", default=None,
+                            help="a file to write every game to as a json line, - for stdout")
+    tournament.set_defaults(run=_tournament_command)
+
+    book = commands.add_parser("book", help="search the opening positions into a book file")
+    book.add_argument("--out", default="opening_book.bin")
+    book.add_argument("--agent", default="AlphaBetaAgent:combined_heuristic:2")
+    book.add_argument("--sizes", type=int, nargs="+", default=[6, 7, 8, 9])
+    book.add_argument("--plies", type=int, default=opening_book.BOOK_PLIES,
+                      help="the most letters a position of the book has")
+    book.add_argument("--seed", type=int, default=0)
+    book.add_argument("--workers", type=int, default=None,
+                      help="processes, as many as cores by default, 0 for none")
+    book.set_defaults(run=_book_command)
+
+    serve = commands.add_parser("serve", help="serve many games at once over a socket")
+    serve.add_argument("--host", default=server.DEFAULT_HOST)
+    serve.add_argument("--port", type=int, default=server.DEFAULT_PORT)
+    serve.add_argument("--workers", type=int, default=None,
+                       help="processes of the agents, as many as cores by default")
+    serve.add_argument("--max-sessions", type=int, default=10000)
+    serve.add_argument("--max-pending", type=int, default=None,
+                       help="agent moves waiting at once before requests are rejected as busy")
+    serve.add_argument("--move-timeout", type=float, default=5.0,
+                       help="seconds an agent has for a move before a quick one is played")
+    serve.add_argument("--seed", type=int, default=0)
+    serve.set_defaults(run=_serve_command)
+
+    load_test = commands.add_parser("loadtest", help="play random games against a server")
+    load_test.add_argument("--host", default=server.DEFAULT_HOST)
+    load_test.add_argument("--port", type=int, default=server.DEFAULT_PORT)
+    load_test.add_argument("--games", type=int, default=100)
+    load_test.add_argument("--concurrency", type=int, default=100)
+    load_test.add_argument("--size", type=int, default=DEFAULT_SIZE)
+    load_test.add_argument("--agent", default="AlphaBetaAgent:combined_heuristic:1")
+    load_test.add_argument("--seed", type=int, default=0)
+    load_test.set_defaults(run=_load_test_command)
+
+    simulate = commands.add_parser("simulate", help="play many games at once with array "
+                                                    "operations, for baselines and datasets")
+    simulate.add_argument("--games", type=int, default=10000)
+    simulate.add_argument("--size", type=int, default=DEFAULT_SIZE)
+    simulate.add_argument("--policy", choices=lockstep.POLICIES, default="random",
+                          help="the policy of the first player")
+    simulate.add_argument("--opponent-policy", choices=lockstep.POLICIES, default="random")
+    simulate.add_argument("--seed", type=int, default=0)
+    simulate.add_argument("--dataset", default=None,
+                          help="a .npz file to save every position of the games to")
+    simulate.set_defaults(run=_simulate_command)
+
+    for command in (play, bench, tournament):
+        command.add_argument("--bitboard", action="store_true",
+                             help="use BitboardGameState instead of GameState")
+    args = parser.parse_args(argv)
+    if args.command is None:
+        run_ui()
+        return 0
+    return args.run(args) or 0
+
+
 if __name__ == '__main__':
-    # test_agents(score_evaluation_function, 30, 1, 6)
-    run_ui()
+    sys.exit(main())
@@ -0,0 +1,134 @@
+from rules import S_LETTER, O_LETTER
+from transposition import get_zobrist_keys
+
+# the 8 symmetries of the square (the D4 group) as maps of (row, col) on an n x n board.
+# the first one is the identity, so the first symmetric hash of a state is its own hash
+TRANSFORMS = (
+    lambda row, col, n: (row, col),
+    lambda row, col, n: (col, n - 1 - row),
+    lambda row, col, n: (n - 1 - row, n - 1 - col),
+    lambda row, col, n: (n - 1 - col, row),
+    lambda row, col, n: (row, n - 1 - col),
+    lambda row, col, n: (n - 1 - row, col),
+    lambda row, col, n: (col, row),
+    lambda row, col, n: (n - 1 - col, n - 1 - row),
+)
+
+HASH_BITS = 64
+HASH_MASK = (1 << HASH_BITS) - 1
+
+_symmetries_cache = {}
+
+
+class Symmetries:
+    """
+    the symmetries of a board size as permutations of the flat cells, with the zobrist
+    keys of every (letter, cell) under each of them. the 8 keys of a (letter, cell) are
+    packed into one int, 64 bits per symmetry, so a state updates all 8 hashes of its
+    board with a single xor
+    """
+
+    def __init__(self, table_size):
+        self.table_size = table_size
+        cells = range(table_size ** 2)
+        self.perms = []
+        for transform in TRANSFORMS:
+            perm = []
+            for cell in cells:
+                row, col = transform(cell // table_size, cell % table_size, table_size)
+                perm.append(row * table_size + col)
+            self.perms.append(perm)
+        self.inverses = []
+        for perm in self.perms:
+            inverse = [0] * len(perm)
+            for cell, image in enumerate(perm):
+                inverse[image] = cell
+            self.inverses.append(inverse)
+        letters = get_zobrist_keys(table_size).letters
+        # keys[letter][cell] is the packed keys of the images of the cell
+        self.keys = [None, None, None]
+        for letter in (S_LETTER, O_LETTER):
+            self.keys[letter] = [sum(letters[letter][perm[cell]] << (HASH_BITS * i)
+                                     for i, perm in enumerate(self.perms))
+                                 for cell in cells]
+
+
+def get_symmetries(table_size):
+    """
+    returns the symmetries of the given board size, building them only once per size
+    :param table_size:
+    :return:
+    """
+    symmetries = _symmetries_cache.get(table_size)
+    if symmetries is None:
+        symmetries = _symmetries_cache[table_size] = Symmetries(table_size)
+    return symmetries
+
+
+def packed_hashes(flat_board, table_size):
+    """
+    computes the packed hashes of the board under each symmetry from scratch
+    :param flat_board: the letters of the board, indexed by flat cell
+    :param table_size:
+    :return:
+    """
+    keys = get_symmetries(table_size).keys
+    hashes = 0
+    for cell, letter in enumerate(flat_board):
+        if letter:
+            hashes ^= keys[int(letter)][cell]
+    return hashes
+
+
+def unpack_hashes(hashes):
+    """
+    splits packed hashes into the hash of the board under each symmetry
+    :param hashes:
+    :return:
+    """
+    return tuple((hashes >> (HASH_BITS * i)) & HASH_MASK for i in range(len(TRANSFORMS)))
+
+
+def canonical_hash(state):
+    """
+    the smallest hash of the board of the state over its symmetries. mirrored and rotated
+    boards have the same canonical hash
+    :param state:
+    :return: the canonical hash and the index of the symmetry that gives it
+    """
+    hashes = state.symmetric_hashes
+    transform = min(range(len(hashes)), key=hashes.__getitem__)
+    return hashes[transform], transform
+
+
+def map_move(move, perm, table_size):
+    """
+    maps a move (see rules.encode_move) with a permutation of the cells
+    :param move:
+    :param perm: one of Symmetries.perms or Symmetries.inverses
+    :param table_size:
+    :return:
+    """
+    letter, cell = divmod(int(move), table_size * table_size)
+    return letter * table_size * table_size + perm[cell]
+
+
+def unique_actions(state, actions, player):
+    """
+    keeps the first of every group of actions that lead to symmetric boards, since such
+    actions are worth the same
+    :param state:
+    :param actions:
+    :param player: the player making the actions
+    :return:
+    """
+    seen = set()
+    unique = []
+    for action in actions:
+        state.apply_action(action, player)
+        key = min(state.symmetric_hashes)
+        state.undo_action()
+        if key not in seen:
+            seen.add(key)
+            unique.append(action)
+    return unique
@@ -0,0 +1,352 @@
+import heapq
+import math
+import random
+from rules import S_LETTER, O_LETTER, EMPTY, get_sos_index
+
+# what an open triple is missing. an open triple has one empty cell and completes an sos
+# with the right letter there: S_S misses its O, _OS its first S and SO_ its last S
+CLOSED, MISSING_O, MISSING_FIRST, MISSING_LAST = range(4)
+
+
+def _triple_role(first, middle, last):
+    if first == S_LETTER and middle == EMPTY and last == S_LETTER:
+        return MISSING_O
+    if first == EMPTY and middle == O_LETTER and last == S_LETTER:
+        return MISSING_FIRST
+    if first == S_LETTER and middle == O_LETTER and last == EMPTY:
+        return MISSING_LAST
+    return CLOSED
+
+
+# the role of a triple, indexed by first * 9 + middle * 3 + last
+ROLES = [_triple_role(code // 9, code // 3 % 3, code % 3) for code in range(27)]
+
+
+def _openers(code):
+    """the (position in the triple, letter) of every move that leaves the triple open"""
+    letters = [code // 9, code // 3 % 3, code % 3]
+    if letters.count(EMPTY) != 2:
+        return ()
+    openers = []
+    for position in range(3):
+        if letters[position] != EMPTY:
+            continue
+        for letter in (S_LETTER, O_LETTER):
+            after = letters[:]
+            after[position] = letter
+            if ROLES[after[0] * 9 + after[1] * 3 + after[2]] != CLOSED:
+                openers.append((position, letter))
+    return tuple(openers)
+
+
+# the moves that open a triple, indexed like ROLES
+OPENERS = [_openers(code) for code in range(27)]
+
+
+def _fills(code):
+    """the (position in the triple, letter) of every empty cell of a live triple"""
+    letters = [code // 9, code // 3 % 3, code % 3]
+    if any(letter not in (EMPTY, sos_letter)
+           for letter, sos_letter in zip(letters, (S_LETTER, O_LETTER, S_LETTER))):
+        return ()
+    return tuple((position, sos_letter) for position, (letter, sos_letter)
+                 in enumerate(zip(letters, (S_LETTER, O_LETTER, S_LETTER))) if letter == EMPTY)
+
+
+# the letters that still complete an sos from a triple, indexed like ROLES. a triple is live
+# if they exist, that is if every letter it has is the one of an sos there
+FILLS = [_fills(code) for code in range(27)]
+
+_safe_tables_cache = {}
+
+
+def _safe_tables(table_size):
+    """
+    the tables the safe moves are found with, built only once per board size: for every
+    triple and every code of its letters, the moves (see rules.encode_move) that leave the
+    triple open, and for every cell, the cells that share a triple with it
+    """
+    tables = _safe_tables_cache.get(table_size)
+    if tables is None:
+        index = get_sos_index(table_size)
+        cells = table_size ** 2
+        openers = [[frozenset(letter * cells + triple[position]
+                              for position, letter in OPENERS[code]) for code in range(27)]
+                   for triple in index.triples]
+        neighbours = [sorted({cell} | {other for triple_id in ids
+                                       for other in index.triples[triple_id]})
+                      for cell, ids in enumerate(index.cell_triples)]
+        tables = _safe_tables_cache[table_size] = (openers, neighbours)
+    return tables
+
+
+class ThreatTable:
+    """
+    keeps, for a board that changes one cell at a time, every open triple of the board:
+    how many sos's each empty cell would complete with an S and with an O, how many open
+    triples there are, and how many S's are the end of an open triple (the S's that
+    block_evaluation_function counts). placing or removing a letter only looks at the
+    triples of its cell.
+    it also keeps the safe moves, the moves that open no triple for the opponent. they are
+    brought up to date only when one is asked for, around the cells changed since then, and
+    a letter placed and removed again in between (a move of a search and its undo) is not
+    counted as a change, so the searches do not pay for them
+    """
+
+    def __init__(self, table_size, flat_board=None):
+        index = get_sos_index(table_size)
+        cells = table_size ** 2
+        self._cells = cells
+        self._triples = index.triples
+        # for every cell, (id, first, middle, last) of the triples it belongs to
+        self._cell_triples = [[(triple_id,) + index.triples[triple_id] for triple_id in ids]
+                              for ids in index.cell_triples]
+        self.letters = [EMPTY] * cells if flat_board is None else [int(x) for x in flat_board]
+        # gains[letter][cell]: the sos's that putting letter in the (empty) cell completes
+        self.gains = [None, [0] * cells, [0] * cells]
+        self.open_threats = 0
+        # the number of empty cells, so there are 2 * empty legal moves
+        self.empty = self.letters.count(EMPTY)
+        # for every cell, the open triples in which it is an S end
+        self._s_ends = [0] * cells
+        # the number of cells with an S that is the end of some open triple
+        self.near_sos = 0
+        # the sum of the missing cells of the open triples, to find the cell they all miss
+        self._gap_sum = 0
+        self._roles = [CLOSED] * len(self._triples)
+        for triple_id in range(len(self._triples)):
+            self._update_triple(triple_id)
+        self._openers, self._neighbours = _safe_tables(table_size)
+        # the safe moves to empty cells, in any order, and the index of every move in it or
+        # -1, so a move is added, removed and drawn in O(1)
+        self._safe = []
+        self._safe_index = [-1] * 3 * cells
+        # the cells changed since the safe moves were brought up to date, or None when
+        # there were too many of them and every cell is checked again
+        self._dirty = None
+
+    def copy(self):
+        """a copy of the table that can change independently"""
+        table = ThreatTable.__new__(ThreatTable)
+        table._cells = self._cells
+        table._triples = self._triples
+        table._cell_triples = self._cell_triples
+        table.letters = self.letters[:]
+        table.gains = [None, self.gains[S_LETTER][:], self.gains[O_LETTER][:]]
+        table.open_threats = self.open_threats
+        table.empty = self.empty
+        table._s_ends = self._s_ends[:]
+        table.near_sos = self.near_sos
+        table._gap_sum = self._gap_sum
+        table._roles = self._roles[:]
+        table._openers = self._openers
+        table._neighbours = self._neighbours
+        table._safe = self._safe[:]
+        table._safe_index = self._safe_index[:]
+        table._dirty = None if self._dirty is None else self._dirty[:]
+        return table
+
+    def gain(self, letter, cell):
+        """how many sos's putting letter in the empty cell would complete"""
+        return self.gains[letter][cell]
+
+    def moves(self, order="board"):
+        """
+        generates the legal moves of the board lazily, as ints (see rules.encode_move). the
+        board may be changed between moves as long as it is restored before the next one is
+        asked for
+        :param order: "board" for every S move and then every O move, row by row (the order
+        of get_legal_actions), "cell" for both letters of a cell before the next cell, or
+        "gain" for the moves that complete an sos first, the most sos's first, and then the
+        rest in board order
+        :return: a generator of moves
+        """
+        cells = self._cells
+        letters = self.letters
+        if order == "cell":
+            for cell in range(cells):
+                if letters[cell] == EMPTY:
+                    yield S_LETTER * cells + cell
+                    yield O_LETTER * cells + cell
+            return
+        if order not in ("board", "gain"):
+            raise ValueError(f"unknown order {order!r}")
+        skip = ()
+        if order == "gain" and self.open_threats:
+            gains = self.gains
+            scoring = [(gains[letter][cell], letter * cells + cell)
+                       for letter in (S_LETTER, O_LETTER) for cell in range(cells)
+                       if letters[cell] == EMPTY and gains[letter][cell]]
+            scoring.sort(key=lambda x: x[0], reverse=True)
+            skip = {move for _, move in scoring}
+            for _, move in scoring:
+                yield move
+        for letter in (S_LETTER, O_LETTER):
+            offset = letter * cells
+            for cell in range(cells):
+                if letters[cell] == EMPTY and offset + cell not in skip:
+                    yield offset + cell
+
+    def most_sos(self, moves):
+        """
+        a bound of the sos's the next moves can complete, of both players together. a triple
+        they complete is live now, and every empty cell of it is one of the cells they fill:
+        a cell completes at most the open triples its best letter completes now, two cells at
+        most one more triple that misses both of them (the letters of two triples that miss
+        the same two cells contradict each other) and three cells at most one that misses all
+        three
+        :param moves: how many moves are made
+        :return:
+        """
+        moves = min(moves, self.empty)
+        if moves <= 0:
+            return 0
+        gains_s, gains_o = self.gains[S_LETTER], self.gains[O_LETTER]
+        best = heapq.nlargest(moves, (max(gain_s, gain_o)
+                                      for gain_s, gain_o in zip(gains_s, gains_o)))
+        if moves == 1:
+            return best[0]
+        letters = self.letters
+        # the live triples by how many letters they miss
+        missing = [0, 0, 0, 0]
+        for first, middle, last in self._triples:
+            missing[len(FILLS[letters[first] * 9 + letters[middle] * 3 + letters[last]])] += 1
+        return (sum(best) + min(missing[2], math.comb(moves, 2)) +
+                min(missing[3], math.comb(moves, 3)))
+
+    def is_safe(self, move):
+        """whether a move to an empty cell opens no triple for the opponent"""
+        self._update_safe()
+        return self._safe_index[move] >= 0
+
+    def random_safe_move(self, rnd=random):
+        """
+        a random move after which the board has no open triple, so the opponent can not
+        complete an sos next (a move block_evaluation_function rates 1). when there are open
+        triples, only a move in the cell they all miss can be one
+        :param rnd: the random generator to draw the move with
+        :return: the move (see rules.encode_move), or None if there is no such move
+        """
+        self._update_safe()
+        cells = self._cells
+        if self.open_threats:
+            # if every open triple misses the same cell, it is the mean of the missing cells
+            gap = self._gap_sum // self.open_threats
+            if self.gains[S_LETTER][gap] + self.gains[O_LETTER][gap] != self.open_threats:
+                return None
+            moves = [letter * cells + gap for letter in (S_LETTER, O_LETTER)
+                     if self._safe_index[letter * cells + gap] >= 0]
+            return rnd.choice(moves) if moves else None
+        if not self._safe:
+            return None
+        return self._safe[rnd.randrange(len(self._safe))]
+
+    def place(self, cell, letter):
+        """puts a letter in an empty cell"""
+        self.letters[cell] = letter
+        self.empty -= 1
+        self._update_cell(cell)
+        dirty = self._dirty
+        if dirty is not None:
+            dirty.append(cell)
+            if len(dirty) > self._cells:
+                self._dirty = None
+
+    def remove(self, cell):
+        """empties a cell"""
+        self.letters[cell] = EMPTY
+        self.empty += 1
+        self._update_cell(cell)
+        dirty = self._dirty
+        if dirty is not None:
+            # taking back the last letter placed leaves the cell as it was
+            if dirty and dirty[-1] == cell:
+                dirty.pop()
+            else:
+                dirty.append(cell)
+                if len(dirty) > self._cells:
+                    self._dirty = None
+
+    def _update_safe(self):
+        """brings the safe moves up to date with the cells changed since the last time"""
+        if self._dirty is None:
+            cells = range(self._cells)
+        elif self._dirty:
+            neighbours = self._neighbours
+            cells = {other for cell in self._dirty for other in neighbours[cell]}
+        else:
+            return
+        self._dirty = []
+        letters = self.letters
+        for cell in cells:
+            s_move, o_move = S_LETTER * self._cells + cell, O_LETTER * self._cells + cell
+            s_safe = o_safe = letters[cell] == EMPTY
+            if s_safe:
+                for triple_id, first, middle, last in self._cell_triples[cell]:
+                    openers = self._openers[triple_id][
+                        letters[first] * 9 + letters[middle] * 3 + letters[last]]
+                    if s_move in openers:
+                        s_safe = False
+                    if o_move in openers:
+                        o_safe = False
+            self._set_safe(s_move, s_safe)
+            self._set_safe(o_move, o_safe)
+
+    def _set_safe(self, move, safe):
+        i = self._safe_index[move]
+        if safe and i < 0:
+            self._safe_index[move] = len(self._safe)
+            self._safe.append(move)
+        elif not safe and i >= 0:
+            last = self._safe.pop()
+            if last != move:
+                self._safe[i] = last
+                self._safe_index[last] = i
+            self._safe_index[move] = -1
+
+    def _update_cell(self, cell):
+        """updates the roles of the triples of a cell after it changed"""
+        letters = self.letters
+        roles = self._roles
+        for triple_id, first, middle, last in self._cell_triples[cell]:
+            role = ROLES[letters[first] * 9 + letters[middle] * 3 + letters[last]]
+            old_role = roles[triple_id]
+            if role != old_role:
+                if old_role != CLOSED:
+                    self._count(first, middle, last, old_role, -1)
+                if role != CLOSED:
+                    self._count(first, middle, last, role, 1)
+                roles[triple_id] = role
+
+    def _update_triple(self, triple_id):
+        first, middle, last = self._triples[triple_id]
+        letters = self.letters
+        role = ROLES[letters[first] * 9 + letters[middle] * 3 + letters[last]]
+        if role != CLOSED:
+            self._count(first, middle, last, role, 1)
+        self._roles[triple_id] = role
+
+    def _count(self, first, middle, last, role, sign):
+        """adds (sign 1) or removes (sign -1) an open triple from the counts"""
+        self.open_threats += sign
+        if role == MISSING_O:
+            self.gains[O_LETTER][middle] += sign
+            self._gap_sum += sign * middle
+            self._count_s_end(first, sign)
+            self._count_s_end(last, sign)
+        elif role == MISSING_FIRST:
+            self.gains[S_LETTER][first] += sign
+            self._gap_sum += sign * first
+            self._count_s_end(last, sign)
+        else:
+            self.gains[S_LETTER][last] += sign
+            self._gap_sum += sign * last
+            self._count_s_end(first, sign)
+
+    def _count_s_end(self, cell, sign):
+        ends = self._s_ends[cell] + sign
+        self._s_ends[cell] = ends
+        if sign > 0 and ends == 1:
+            self.near_sos += 1
+        elif sign < 0 and ends == 0:
+            self.near_sos -= 1
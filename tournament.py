@@ -0,0 +1,229 @@
+import ast
+import json
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from game import Game
+from game_state import GameState
+import multi_agents
+
+# the latency percentiles reported for every agent
+PERCENTILES = (50, 90, 99)
+
+
+class AgentSpec:
+    """
+    how to build an agent for a tournament: its class and the arguments to make it with.
+    a spec is sent to the worker processes, so the class and the evaluation function
+    should be defined at the top level of a module
+    """
+
+    def __init__(self, agent_class, evaluation_function=None, depth=None, **kwargs):
+        self.agent_class = agent_class
+        self.evaluation_function = evaluation_function
+        self.depth = depth
+        self.kwargs = kwargs
+
+    @property
+    def name(self):
+        parts = [self.agent_class.__name__]
+        if self.evaluation_function is not None:
+            parts.append(self.evaluation_function.__name__)
+        if self.depth is not None:
+            parts.append(str(self.depth))
+        parts += [f"{key}={value}" for key, value in sorted(self.kwargs.items())]
+        return ":".join(parts)
+
+    @staticmethod
+    def parse(text):
+        """
+        makes a spec from its name, like "AlphaBetaAgent:combined_heuristic:2" or
+        "AlphaBetaAgent:combined_heuristic:2:time_limit=0.5". the class and the evaluation
+        function are looked up in multi_agents
+        :param text: the agent class, then optionally the evaluation function, the depth
+        and key=value arguments, separated by ":"
+        :return:
+        """
+        parts = text.split(":")
+        positional = [part for part in parts[1:] if "=" not in part]
+        if len(positional) > 2:
+            raise ValueError(f"bad agent spec {text!r}")
+        kwargs = {}
+        for part in parts[1:]:
+            if "=" in part:
+                key, value = part.split("=", 1)
+                kwargs[key] = _parse_value(value)
+        agent_class = getattr(multi_agents, parts[0], None)
+        if not isinstance(agent_class, type):
+            raise ValueError(f"unknown agent {parts[0]!r}")
+        evaluation_function = None
+        if positional and positional[0] != "None":
+            evaluation_function = getattr(multi_agents, positional[0], None)
+            if not callable(evaluation_function):
+                raise ValueError(f"unknown evaluation function {positional[0]!r}")
+        depth = _parse_value(positional[1]) if len(positional) > 1 else None
+        return AgentSpec(agent_class, evaluation_function, depth, **kwargs)
+
+    def build(self):
+        """makes a new agent from the spec"""
+        args = []
+        if self.evaluation_function is not None or self.depth is not None:
+            args.append(self.evaluation_function)
+        if self.depth is not None:
+            args.append(self.depth)
+        return self.agent_class(*args, **self.kwargs)
+
+
+def _parse_value(text):
+    """a python literal, or the text itself if it is not one"""
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+
+
+def game_seed(seed, board_size, game):
+    """the seed of one game of a tournament, so every game can be replayed on its own"""
+    return seed * 1000000 + board_size * 1000 + game
+
+
+def play_game(agent_spec, opponent_spec, board_size, seed, state_class=GameState):
+    """
+    plays one game without ui, the agent moving first, like Sos.ai_loop does. the
+    random module is seeded first, so RandomAgent and smart_random_play play the same
+    way every time the game is played with the same seed
+    :param agent_spec:
+    :param opponent_spec:
+    :param board_size:
+    :param seed:
+    :param state_class: GameState or bitboard.BitboardGameState
+    :return: the scores and the seconds every move of each player took
+    """
+    random.seed(seed)
+    agents = (agent_spec.build(), opponent_spec.build())
+    game = Game(board_size)
+    # the game as each player sees it: an agent takes score as its own points and moves as
+    # player 0, so the second player's state has the moves of the players swapped
+    states = (state_class(board_size), state_class(board_size))
+    move_times = ([], [])
+    while not game.done():
+        player = game.player
+        state = states[player]
+        start = time.perf_counter()
+        action = agents[player].get_action(state)
+        move_times[player].append(time.perf_counter() - start)
+        gained = state.apply_action(action, 0)
+        states[1 - player].apply_action(action, 1)
+        if not gained and not state.is_done():
+            agents[player].ponder(state)
+        game.make_turn(action)
+    for agent in agents:
+        agent.stop_running()
+    return list(game.score), move_times
+
+
+def _play_tournament_game(agent_spec, opponent_spec, board_size, game, seed, state_class):
+    """plays one game of a tournament, in a worker process, and makes its result record"""
+    scores, move_times = play_game(agent_spec, opponent_spec, board_size, seed, state_class)
+    if scores[0] == scores[1]:
+        winner = None
+    else:
+        winner = 0 if scores[0] > scores[1] else 1
+    return {"board_size": board_size, "game": game, "seed": seed,
+            "agent": agent_spec.name, "opponent": opponent_spec.name,
+            "scores": scores, "winner": winner, "margin": scores[0] - scores[1],
+            "agent_move_times": move_times[0], "opponent_move_times": move_times[1]}
+
+
+def summarize(results):
+    """
+    the win and tie rates, score margins and move latency percentiles of game results
+    :param results: result records of play_tournament
+    :return: a dict
+    """
+    games = len(results)
+    if games == 0:
+        return {"games": 0}
+    margins = np.array([result["margin"] for result in results])
+    summary = {"games": games,
+               "win_rate": sum(result["winner"] == 0 for result in results) / games,
+               "tie_rate": sum(result["winner"] is None for result in results) / games,
+               "loss_rate": sum(result["winner"] == 1 for result in results) / games,
+               "agent_average": float(np.mean([result["scores"][0] for result in results])),
+               "opponent_average": float(np.mean([result["scores"][1] for result in results])),
+               "margin_mean": float(margins.mean()),
+               "margin_std": float(margins.std())}
+    for side in ("agent", "opponent"):
+        times = [t for result in results for t in result[f"{side}_move_times"]]
+        for percentile in PERCENTILES:
+            summary[f"{side}_move_p{percentile}"] = \
+                float(np.percentile(times, percentile)) if times else None
+    return summary
+
+
+def play_tournament(agent_spec, opponent_spec, board_sizes=(6,), num_games=30, seed=0,
+                    workers=None, out=None, state_class=GameState):
+    """
+    plays num_games games between two agents on every board size, on a pool of worker
+    processes. every game has its own seed (see game_seed), so the results are the same
+    however many workers play them and in whatever order they finish
+    :param agent_spec: an AgentSpec of the agent that moves first
+    :param opponent_spec: an AgentSpec
+    :param board_sizes:
+    :param num_games: games per board size
+    :param seed: the seed of the whole tournament
+    :param workers: the number of processes, None for as many as cores, 0 to play in this
+    process
+    :param out: a file to write the result of every game to as a json line once it ends
+    :param state_class: GameState or bitboard.BitboardGameState
+    :return: the results of all the games, ordered by board size and game, and the summary
+    of every board size and of all of them (under the key "all")
+    """
+    games = [(agent_spec, opponent_spec, size, game, game_seed(seed, size, game), state_class)
+             for size in board_sizes for game in range(num_games)]
+    results = []
+
+    def record(result):
+        results.append(result)
+        if out is not None:
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+
+    if workers == 0:
+        for args in games:
+            record(_play_tournament_game(*args))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_play_tournament_game, *args) for args in games]
+            for future in as_completed(futures):
+                record(future.result())
+    results.sort(key=lambda result: (result["board_size"], result["game"]))
+    summaries = {size: summarize([result for result in results if result["board_size"] == size])
+                 for size in board_sizes}
+    summaries["all"] = summarize(results)
+    return results, summaries
+
+
+def print_summary(summaries, file=sys.stdout):
+    """
+    prints tournament summaries
+    :param summaries: the summaries play_tournament returns
+    :param file:
+    :return:
+    """
+    for key, summary in summaries.items():
+        if summary["games"] == 0:
+            continue
+        title = "All board sizes" if key == "all" else f"Board size {key}"
+        print(f"{title}: {summary['games']} games", file=file)
+        print(f"  AI wins: {summary['win_rate']:.1%}, ties: {summary['tie_rate']:.1%}, "
+              f"losses: {summary['loss_rate']:.1%}", file=file)
+        print(f"  Average of SOS: {summary['agent_average']:.2f}, "
+              f"opponent: {summary['opponent_average']:.2f}, "
+              f"margin: {summary['margin_mean']:.2f} +- {summary['margin_std']:.2f}", file=file)
+        for side in ("agent", "opponent"):
+            latencies = ", ".join(f"p{p} {summary[f'{side}_move_p{p}'] * 1000:.1f}ms"
+                                  for p in PERCENTILES if summary[f"{side}_move_p{p}"] is not None)
+            print(f"  {side} move time: {latencies}", file=file)
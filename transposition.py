@@ -0,0 +1,126 @@
+import random
+from rules import S_LETTER, O_LETTER, get_sos_index
+
+# the keys are drawn from a fixed seed so a position hashes the same in every process
+ZOBRIST_SEED = 1357
+
+# bound types of a stored value
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+# fields of a stored entry
+KEY, DEPTH, VALUE, BOUND, MOVE = range(5)
+
+# a rough size in bytes of one stored entry (the tuple, its key, value and move)
+ENTRY_BYTES = 256
+
+_keys_cache = {}
+
+
+class ZobristKeys:
+    """
+    random 64 bit keys for every (letter, cell) of a board size, for the scores of both
+    players and for the player to move. a position's hash is the xor of its keys
+    """
+
+    def __init__(self, table_size):
+        rnd = random.Random(ZOBRIST_SEED * 100 + table_size)
+        cells = table_size ** 2
+        max_score = len(get_sos_index(table_size).triples)
+        # indexed by letter, so letters[S_LETTER][cell] is the key of an S in cell
+        self.letters = [None, None, None]
+        self.letters[S_LETTER] = [rnd.getrandbits(64) for _ in range(cells)]
+        self.letters[O_LETTER] = [rnd.getrandbits(64) for _ in range(cells)]
+        self.score = [rnd.getrandbits(64) for _ in range(max_score + 1)]
+        self.op_score = [rnd.getrandbits(64) for _ in range(max_score + 1)]
+        self.turn = rnd.getrandbits(64)
+
+
+def get_zobrist_keys(table_size):
+    """
+    returns the zobrist keys of the given board size, drawing them only once per size
+    :param table_size:
+    :return:
+    """
+    keys = _keys_cache.get(table_size)
+    if keys is None:
+        keys = _keys_cache[table_size] = ZobristKeys(table_size)
+    return keys
+
+
+def position_key(state, agent, board_key=None):
+    """
+    the key of a search position: the board hash of the state together with both
+    scores and the agent to move, since the evaluation functions depend on all of them
+    :param state:
+    :param agent:
+    :param board_key: a hash to use instead of the board hash, like its canonical hash
+    :return:
+    """
+    keys = get_zobrist_keys(state.table_size)
+    if board_key is None:
+        board_key = state.hash
+    key = board_key ^ keys.score[state.score] ^ keys.op_score[state.opponent_score]
+    return key ^ keys.turn if agent else key
+
+
+class TranspositionTable:
+    """
+    a transposition table of a fixed size. every bucket has two slots, one that keeps the
+    deepest search seen of its positions and one that is always replaced, so the table
+    never grows past the memory it was given. the values are stored for the player to
+    move. a table should only be shared between agents with the same evaluation function
+    """
+
+    def __init__(self, max_mb=16):
+        self.max_mb = max_mb
+        self.num_buckets = max(1, int(max_mb * 2 ** 20) // (2 * ENTRY_BYTES))
+        self._deep = [None] * self.num_buckets
+        self._recent = [None] * self.num_buckets
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        """removes every entry from the table"""
+        self._deep = [None] * self.num_buckets
+        self._recent = [None] * self.num_buckets
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        """
+        finds the entry of a position
+        :param key:
+        :return: a (key, depth, value, bound, move) tuple or None
+        """
+        bucket = key % self.num_buckets
+        entry = self._deep[bucket]
+        if entry is None or entry[KEY] != key:
+            entry = self._recent[bucket]
+            if entry is None or entry[KEY] != key:
+                self.misses += 1
+                return None
+        self.hits += 1
+        return entry
+
+    def store(self, key, depth, value, bound, move):
+        """
+        stores the result of searching a position. it takes the depth-preferred slot if it
+        was searched at least as deep as what is there, otherwise the always-replace slot
+        :param key:
+        :param depth: the depth left when the position was searched
+        :param value:
+        :param bound: EXACT, LOWER or UPPER
+        :param move: the best move found, or None
+        :return:
+        """
+        bucket = key % self.num_buckets
+        entry = (key, depth, value, bound, move)
+        deep = self._deep[bucket]
+        if deep is None or deep[KEY] == key or depth >= deep[DEPTH]:
+            if deep is not None and deep[KEY] != key:
+                self._recent[bucket] = deep
+            self._deep[bucket] = entry
+        else:
+            self._recent[bucket] = entry